@@ -0,0 +1,282 @@
+from typing import Any, Iterator, List, Tuple
+from token_types import TokenType
+
+class Node:
+    """
+    Base class for CFPL syntax tree nodes. Every node records the line and
+    column (both 1-based) of the first token it was parsed from; `fields`
+    lists the attributes that hold the node's children and data.
+    """
+    __slots__ = ('line', 'column')
+    fields = ()
+
+    def __repr__(self):
+        args = ', '.join(repr(getattr(self, field)) for field in self.fields)
+        return f'{self.__class__.__name__}({args})'
+
+# Statements
+
+class Program(Node):
+    """
+    names lists the declared variables by slot once resolver.resolve() has
+    run, and types the type INPUT converts values to for each slot: the
+    declared type ('INT', 'FLOAT', 'CHAR' or 'BOOL') if the program was
+    type-checked with strict, otherwise None, for INPUT to guess it. The
+    `temporaries` slots after the declared ones hold values cached by the
+    loop optimizer.
+    """
+    __slots__ = ('statements', 'names', 'types', 'strict', 'temporaries')
+    fields = ('statements',)
+
+    def __init__(self, statements: List[Node], line: int = 0, column: int = 0):
+        self.statements = statements
+        self.names = None
+        self.types = None
+        self.strict = False
+        self.temporaries = 0
+        self.line = line
+        self.column = column
+
+class VarDecl(Node):
+    """VAR a, b=1 AS INT; variables holds (name, initial literal or None) pairs"""
+    __slots__ = ('variables', 'var_type', 'slots')
+    fields = ('variables', 'var_type')
+
+    def __init__(self, variables: List[Tuple[str, Any]], var_type: TokenType, line: int = 0, column: int = 0):
+        self.variables = variables
+        self.var_type = var_type
+        self.slots = None
+        self.line = line
+        self.column = column
+
+class Assign(Node):
+    __slots__ = ('name', 'value', 'slot')
+    fields = ('name', 'value')
+
+    def __init__(self, name: str, value: Node, line: int = 0, column: int = 0):
+        self.name = name
+        self.value = value
+        self.slot = None
+        self.line = line
+        self.column = column
+
+class ChainAssign(Node):
+    """a = b = value"""
+    __slots__ = ('names', 'value', 'slots')
+    fields = ('names', 'value')
+
+    def __init__(self, names: List[str], value: Node, line: int = 0, column: int = 0):
+        self.names = names
+        self.value = value
+        self.slots = None
+        self.line = line
+        self.column = column
+
+class Output(Node):
+    """
+    OUTPUT: parts joined with &. The parts form a template: fixed Text
+    segments, never two in a row, and the expressions whose values go
+    between them.
+    """
+    __slots__ = ('parts',)
+    fields = ('parts',)
+
+    def __init__(self, parts: List[Node], line: int = 0, column: int = 0):
+        self.parts = parts
+        self.line = line
+        self.column = column
+
+class Input(Node):
+    __slots__ = ('names', 'slots')
+    fields = ('names',)
+
+    def __init__(self, names: List[str], line: int = 0, column: int = 0):
+        self.names = names
+        self.slots = None
+        self.line = line
+        self.column = column
+
+class If(Node):
+    __slots__ = ('condition', 'body', 'orelse')
+    fields = ('condition', 'body', 'orelse')
+
+    def __init__(self, condition: Node, body: List[Node], orelse: List[Node], line: int = 0, column: int = 0):
+        self.condition = condition
+        self.body = body
+        self.orelse = orelse
+        self.line = line
+        self.column = column
+
+class While(Node):
+    """
+    invariants lists the slots of the Invariant values to clear each time
+    the loop starts; info is the loop's LoopInfo once
+    loop_optimizer.optimize_loops() has run
+    """
+    __slots__ = ('condition', 'body', 'invariants', 'info')
+    fields = ('condition', 'body')
+
+    def __init__(self, condition: Node, body: List[Node], line: int = 0, column: int = 0):
+        self.condition = condition
+        self.body = body
+        self.invariants = []
+        self.info = None
+        self.line = line
+        self.column = column
+
+# OUTPUT parts
+
+class Text(Node):
+    """
+    Fixed text of an OUTPUT: string literals and # parts written next to each
+    other, with their escapes resolved
+    """
+    __slots__ = ('value',)
+    fields = ('value',)
+
+    def __init__(self, value: str, line: int = 0, column: int = 0):
+        self.value = value
+        self.line = line
+        self.column = column
+
+# Expressions; `type` is the static type type_checker.check_types() found
+# for the expression, or None where it is not known
+
+class Literal(Node):
+    __slots__ = ('value', 'type')
+    fields = ('value',)
+
+    def __init__(self, value: Any, line: int = 0, column: int = 0):
+        self.value = value
+        self.type = None
+        self.line = line
+        self.column = column
+
+class Var(Node):
+    __slots__ = ('name', 'slot', 'type')
+    fields = ('name',)
+
+    def __init__(self, name: str, line: int = 0, column: int = 0):
+        self.name = name
+        self.slot = None
+        self.type = None
+        self.line = line
+        self.column = column
+
+class BinaryOp(Node):
+    """op is the operator as written in CFPL ('+', '<>', ...), or 'and' / 'or'"""
+    __slots__ = ('op', 'left', 'right', 'type')
+    fields = ('op', 'left', 'right')
+
+    def __init__(self, op: str, left: Node, right: Node, line: int = 0, column: int = 0):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.type = None
+        self.line = line
+        self.column = column
+
+class Chain(Node):
+    """
+    A run of left-associative binary operators of one precedence level,
+    evaluated left to right: ((operands[0] ops[0] operands[1]) ops[1] operands[2]) ...
+    The parser only builds chains of three or more operands.
+    """
+    __slots__ = ('operands', 'ops', 'type')
+    fields = ('operands', 'ops')
+
+    def __init__(self, operands: List[Node], ops: List[str], line: int = 0, column: int = 0):
+        self.operands = operands
+        self.ops = ops
+        self.type = None
+        self.line = line
+        self.column = column
+
+class UnaryOp(Node):
+    """op is '+', '-', 'NOT', or 'FLOAT' where the type checker widens an INT"""
+    __slots__ = ('op', 'operand', 'type')
+    fields = ('op', 'operand')
+
+    def __init__(self, op: str, operand: Node, line: int = 0, column: int = 0):
+        self.op = op
+        self.operand = operand
+        self.type = None
+        self.line = line
+        self.column = column
+
+class Invariant(Node):
+    """
+    An expression whose value cannot change while an enclosing loop runs.
+    It is evaluated the first time it is reached after the loop starts, and
+    the value is kept in variable slot `slot` until the loop starts again.
+    """
+    __slots__ = ('expr', 'slot', 'type')
+    fields = ('expr',)
+
+    def __init__(self, expr: Node, slot: int, line: int = 0, column: int = 0):
+        self.expr = expr
+        self.slot = slot
+        self.type = None
+        self.line = line
+        self.column = column
+
+def iter_child_nodes(node: Node) -> Iterator[Node]:
+    """Yield the direct child nodes of node, in field order"""
+    for field in node.fields:
+        value = getattr(node, field)
+        if isinstance(value, Node):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, Node):
+                    yield item
+
+def walk(node: Node) -> Iterator[Node]:
+    """Yield node and all of its descendants, parents before children"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(list(iter_child_nodes(node))))
+
+def join_text(parts: List[Node]) -> List[Node]:
+    """OUTPUT parts with each run of Text parts merged into one Text"""
+    joined = []
+    for part in parts:
+        if isinstance(part, Text) and joined and isinstance(joined[-1], Text):
+            previous = joined[-1]
+            joined[-1] = Text(previous.value + part.value, previous.line, previous.column)
+        else:
+            joined.append(part)
+    return joined
+
+def tree_depth(node: Node) -> int:
+    """Number of nodes on the longest path from node down to a leaf"""
+    deepest = 0
+    stack = [(node, 1)]
+    while stack:
+        node, depth = stack.pop()
+        deepest = max(deepest, depth)
+        stack.extend((child, depth + 1) for child in iter_child_nodes(node))
+    return deepest
+
+class NodeVisitor:
+    """
+    Dispatches visit(node) to visit_<ClassName>(node), falling back to
+    generic_visit(). The bound method for each node class is looked up once
+    per visitor and cached.
+    """
+    def __init__(self):
+        self._visitors = {}
+
+    def visit(self, node: Node):
+        try:
+            visitor = self._visitors[node.__class__]
+        except KeyError:
+            visitor = self._visitors[node.__class__] = getattr(
+                self, 'visit_' + node.__class__.__name__, self.generic_visit)
+        return visitor(node)
+
+    def generic_visit(self, node: Node):
+        for child in iter_child_nodes(node):
+            self.visit(child)
@@ -0,0 +1,537 @@
+import marshal
+from array import array
+from typing import Any, List
+from ast_nodes import BinaryOp, Chain, Node, NodeVisitor, Program, Text, UnaryOp, tree_depth
+from closed_form import ClosedForm
+from config import DEFAULT_VALUES, INTERPRETER_VERSION
+from evaluator import (BINARY_OPERATIONS, COMPARISON_OPERATORS, CFPLEvaluator, SHORT_CIRCUIT_OPERATORS,
+                       UNARY_OPERATIONS, UNSET, operation_parts)
+from limits import iteration_steps
+from resolver import resolve
+
+# Opcodes. Every instruction is two words of an array('i'): the opcode and
+# its argument (0 when unused).
+LOAD_CONST = 0       # push constants[arg]
+LOAD_VAR = 1         # push the value in variable slot arg
+STORE_VAR = 2        # pop into variable slot arg
+DEFINE_VAR = 3       # pop into variable slot arg, declaring it
+UNDEFINED = 4        # fail: names[arg] was never declared
+DUP_TOP = 5          # push the top of the stack again
+BINARY = 6           # pop right and left, push BINARY_OPERATORS[arg](left, right)
+UNARY = 7            # pop x, push UNARY_OPERATORS[arg](x)
+TO_STR = 8           # replace the top of the stack with its str()
+OUTPUT = 9           # pop arg strings and output them as one line
+INPUT = 10           # read input into the variables whose name indices are the tuple constants[arg]
+JUMP = 11            # continue at word arg
+JUMP_IF_FALSE = 12   # pop a condition, continue at word arg if it is false
+HALT = 13
+FORGET = 14          # clear the Invariant value in slot arg
+JUMP_IF_SET = 15     # continue at word arg if the top of the stack is a value, else pop it
+CLOSED_FORM = 16     # set a loop's variables from the ClosedForm fields constants[arg];
+                     # push False if that worked, True if the loop has to run
+JUMP_IF_TRUE = 17    # pop a condition, continue at word arg if it is true
+JUMP_IF_FALSE_OR_POP = 18  # continue at word arg if the top of the stack is false, else pop it
+JUMP_IF_TRUE_OR_POP = 19   # continue at word arg if the top of the stack is true, else pop it
+COMPARE_JUMP_IF_FALSE = 20  # pop right and left; continue at word arg >> 3 unless
+                            # COMPARISON_OPERATORS[arg & 7] holds for them
+COMPARE_JUMP_IF_TRUE = 21   # the same, continuing at word arg >> 3 if it holds
+# Loops of programs compiled for runs with ExecutionLimits keep an iteration
+# count and the budget's next batch size on the stack while they run; arg
+# is the steps each iteration counts
+LOOP_ENTER = 22      # push 0 and the batch size the budget gives
+LOOP_TICK = 23       # count an iteration, reporting the count once it reaches the batch size
+LOOP_EXIT = 24       # pop the batch size and count, reporting what is left of the count
+
+OPCODE_NAMES = [
+    'LOAD_CONST', 'LOAD_VAR', 'STORE_VAR', 'DEFINE_VAR', 'UNDEFINED', 'DUP_TOP',
+    'BINARY', 'UNARY', 'TO_STR', 'OUTPUT', 'INPUT', 'JUMP', 'JUMP_IF_FALSE', 'HALT',
+    'FORGET', 'JUMP_IF_SET', 'CLOSED_FORM', 'JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP',
+    'JUMP_IF_TRUE_OR_POP', 'COMPARE_JUMP_IF_FALSE', 'COMPARE_JUMP_IF_TRUE', 'LOOP_ENTER',
+    'LOOP_TICK', 'LOOP_EXIT',
+]
+
+JUMPS = (JUMP, JUMP_IF_FALSE, JUMP_IF_SET, JUMP_IF_TRUE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP)
+COMPARE_JUMPS = (COMPARE_JUMP_IF_FALSE, COMPARE_JUMP_IF_TRUE)
+
+# Jump of `left op right` for AND / OR that keeps left as the result when
+# it decides it, skipping right
+SHORT_CIRCUIT_JUMPS = {'and': JUMP_IF_FALSE_OR_POP, 'or': JUMP_IF_TRUE_OR_POP}
+
+BINARY_OPERATORS = list(BINARY_OPERATIONS)
+UNARY_OPERATORS = list(UNARY_OPERATIONS)
+DIVIDE = BINARY_OPERATORS.index('/')
+# The functions the VM applies for each operator index, shared by every run
+BINARY_FUNCTIONS = [BINARY_OPERATIONS[op] for op in BINARY_OPERATORS]
+UNARY_FUNCTIONS = [UNARY_OPERATIONS[op] for op in UNARY_OPERATORS]
+COMPARISON_FUNCTIONS = [BINARY_OPERATIONS[op] for op in COMPARISON_OPERATORS]
+
+# The compiler recurses once per tree level; deeper programs are left to
+# the tree-walking evaluator, which does not recurse
+COMPILE_DEPTH_LIMIT = 200
+
+BYTECODE_MAGIC = b'CFPLB\0'
+
+class Bytecode:
+    """
+    A compiled program: two-word instructions, the source line of each
+    instruction, the constant pool and the variable names. The first
+    `slots` names are the declared variables, in slot order; the rest are
+    names the program uses without declaring them. types holds the
+    declared type of each slot. The `temporaries` value slots after the
+    declared ones hold Invariant values.
+    """
+    __slots__ = ('code', 'lines', 'constants', 'names', 'types', 'slots', 'temporaries')
+
+    def __init__(self, code: array = None, lines: array = None,
+                 constants: List[Any] = None, names: List[str] = None, slots: int = 0,
+                 temporaries: int = 0, types: List[str] = None):
+        self.code = code if code is not None else array('i')
+        self.lines = lines if lines is not None else array('i')
+        self.constants = constants if constants is not None else []
+        self.names = names if names is not None else []
+        self.slots = slots
+        self.temporaries = temporaries
+        self.types = types if types is not None else []
+
+    def __len__(self):
+        return len(self.lines)
+
+    def to_bytes(self) -> bytes:
+        """Serialize with marshal; constants are only numbers, strings, booleans and tuples"""
+        return BYTECODE_MAGIC + marshal.dumps((
+            INTERPRETER_VERSION, self.code.tobytes(), self.lines.tobytes(),
+            tuple(self.constants), tuple(self.names), self.slots, self.temporaries,
+            tuple(self.types),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Bytecode':
+        if not data.startswith(BYTECODE_MAGIC):
+            raise ValueError("Not CFPL bytecode")
+        try:
+            version, *fields = marshal.loads(data[len(BYTECODE_MAGIC):])
+        except (EOFError, ValueError, TypeError) as e:
+            raise ValueError(f"Corrupt CFPL bytecode: {e}")
+        if version != INTERPRETER_VERSION:
+            raise ValueError(f"Bytecode is for interpreter version {version}, not {INTERPRETER_VERSION}")
+        try:
+            code, lines, constants, names, slots, temporaries, types = fields
+        except ValueError as e:
+            raise ValueError(f"Corrupt CFPL bytecode: {e}")
+        bytecode = cls(array('i'), array('i'), list(constants), list(names), slots, temporaries,
+                       list(types))
+        bytecode.code.frombytes(code)
+        bytecode.lines.frombytes(lines)
+        if len(bytecode.code) != 2 * len(bytecode.lines):
+            raise ValueError("Corrupt CFPL bytecode: instruction and line counts differ")
+        return bytecode
+
+class BytecodeCompiler(NodeVisitor):
+    """
+    Compiles a syntax tree into Bytecode for the stack machine in VMEvaluator;
+    with limited, loops report their iterations to the ExecutionBudget
+    """
+    def __init__(self, limited: bool = False):
+        super().__init__()
+        self.limited = limited
+        self.bytecode = Bytecode()
+        self.constant_index = {}
+        self.name_index = {}
+
+    def compile(self, program: Program) -> Bytecode:
+        if program.names is None:
+            resolve(program)
+        # Declared names first, so that a name's index is its slot
+        for var_name in program.names:
+            self.name(var_name)
+        self.bytecode.slots = len(program.names)
+        self.bytecode.types = list(program.types)
+        self.bytecode.temporaries = program.temporaries
+        self.visit(program)
+        self.emit(HALT, 0, 0)
+        return self.bytecode
+
+    def generic_visit(self, node: Node):
+        raise Exception(f"Cannot compile node: {node!r}")
+
+    def emit(self, opcode: int, arg: int, line: int) -> int:
+        """Append an instruction, returning its word position"""
+        position = len(self.bytecode.code)
+        self.bytecode.code.append(opcode)
+        self.bytecode.code.append(arg)
+        self.bytecode.lines.append(line)
+        return position
+
+    def patch(self, position: int, target: int):
+        """Point the jump at word position to word target"""
+        code = self.bytecode.code
+        if code[position] in COMPARE_JUMPS:
+            code[position + 1] = target << 3 | code[position + 1] & 7
+        else:
+            code[position + 1] = target
+
+    def patch_all(self, positions: List[int]):
+        """Point every jump in positions to the next instruction"""
+        for position in positions:
+            self.patch(position, len(self.bytecode.code))
+
+    def constant(self, value: Any) -> int:
+        # Keyed by type as well, since 1, 1.0 and TRUE compare equal
+        key = (type(value), value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.bytecode.constants)
+            self.bytecode.constants.append(value)
+        return index
+
+    def name(self, name: str) -> int:
+        index = self.name_index.get(name)
+        if index is None:
+            index = self.name_index[name] = len(self.bytecode.names)
+            self.bytecode.names.append(name)
+        return index
+
+    # Expressions
+
+    def visit_Literal(self, node):
+        self.emit(LOAD_CONST, self.constant(node.value), node.line)
+
+    def visit_Var(self, node):
+        if node.slot is None:
+            self.emit(UNDEFINED, self.name(node.name), node.line)
+        else:
+            self.emit(LOAD_VAR, node.slot, node.line)
+
+    def visit_BinaryOp(self, node):
+        self.visit(node.left)
+        if node.op in SHORT_CIRCUIT_OPERATORS:
+            jump = self.emit(SHORT_CIRCUIT_JUMPS[node.op], 0, node.line)
+            self.visit(node.right)
+            self.patch_all([jump])
+        else:
+            self.visit(node.right)
+            self.emit(BINARY, BINARY_OPERATORS.index(node.op), node.line)
+
+    def visit_Chain(self, node):
+        self.visit(node.operands[0])
+        # Short-circuit jumps go to the end of the run of AND (or OR)
+        # operators they are part of
+        jumps = []
+        for index, (op, operand) in enumerate(zip(node.ops, node.operands[1:])):
+            if op in SHORT_CIRCUIT_OPERATORS:
+                jumps.append(self.emit(SHORT_CIRCUIT_JUMPS[op], 0, node.line))
+                self.visit(operand)
+                if index + 1 == len(node.ops) or node.ops[index + 1] != op:
+                    self.patch_all(jumps)
+                    jumps = []
+            else:
+                self.visit(operand)
+                self.emit(BINARY, BINARY_OPERATORS.index(op), node.line)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.operand)
+        self.emit(UNARY, UNARY_OPERATORS.index(node.op), node.line)
+
+    def visit_Invariant(self, node):
+        self.emit(LOAD_VAR, node.slot, node.line)
+        to_end = self.emit(JUMP_IF_SET, 0, node.line)
+        self.visit(node.expr)
+        self.emit(DUP_TOP, 0, node.line)
+        self.emit(STORE_VAR, node.slot, node.line)
+        self.patch(to_end, len(self.bytecode.code))
+
+    # Statements
+
+    def compile_block(self, statements: List[Node]):
+        for statement in statements:
+            self.visit(statement)
+
+    def visit_VarDecl(self, node):
+        default = DEFAULT_VALUES[node.var_type.name]
+        for slot, (var_name, initial_value) in zip(node.slots, node.variables):
+            value = default if initial_value is None else initial_value
+            self.emit(LOAD_CONST, self.constant(value), node.line)
+            self.emit(DEFINE_VAR, slot, node.line)
+
+    def visit_Assign(self, node):
+        if node.slot is None:
+            self.emit(UNDEFINED, self.name(node.name), node.line)
+            return
+        self.visit(node.value)
+        self.emit(STORE_VAR, node.slot, node.line)
+
+    def visit_ChainAssign(self, node):
+        for var_name, slot in zip(node.names, node.slots):
+            if slot is None:
+                self.emit(UNDEFINED, self.name(var_name), node.line)
+                return
+        self.visit(node.value)
+        for slot in node.slots[:-1]:
+            self.emit(DUP_TOP, 0, node.line)
+            self.emit(STORE_VAR, slot, node.line)
+        self.emit(STORE_VAR, node.slots[-1], node.line)
+
+    def visit_Output(self, node):
+        for part in node.parts:
+            if isinstance(part, Text):
+                self.emit(LOAD_CONST, self.constant(part.value), part.line)
+            else:
+                self.visit(part)
+                if part.type != 'CHAR':
+                    self.emit(TO_STR, 0, node.line)
+        self.emit(OUTPUT, len(node.parts), node.line)
+
+    def visit_Input(self, node):
+        indices = tuple(self.name(var_name) for var_name in node.names)
+        self.emit(INPUT, self.constant(indices), node.line)
+
+    def compile_jump(self, condition: Node, when: bool) -> List[int]:
+        """
+        Code for an IF or WHILE condition that jumps when the condition's
+        truth equals when and falls through otherwise; returns the jumps for
+        the caller to patch. AND / OR and NOT become control flow, and
+        comparisons jump directly, without putting a BOOL on the stack.
+        """
+        if isinstance(condition, UnaryOp) and condition.op == 'NOT':
+            return self.compile_jump(condition.operand, not when)
+        if isinstance(condition, BinaryOp) and condition.op in COMPARISON_OPERATORS:
+            self.visit(condition.left)
+            self.visit(condition.right)
+            opcode = COMPARE_JUMP_IF_TRUE if when else COMPARE_JUMP_IF_FALSE
+            return [self.emit(opcode, COMPARISON_OPERATORS.index(condition.op), condition.line)]
+        if isinstance(condition, (BinaryOp, Chain)):
+            operands, ops = operation_parts(condition)
+            op = ops[0]
+            if op in SHORT_CIRCUIT_OPERATORS and all(other == op for other in ops):
+                if (op == 'or') == when:
+                    # The first operand that jumps decides the result
+                    return [jump for operand in operands for jump in self.compile_jump(operand, when)]
+                # Every operand has to hold (or fail) for the jump; the
+                # first that does not skips the rest
+                skips = []
+                for operand in operands[:-1]:
+                    skips.extend(self.compile_jump(operand, not when))
+                jumps = self.compile_jump(operands[-1], when)
+                self.patch_all(skips)
+                return jumps
+        self.visit(condition)
+        return [self.emit(JUMP_IF_TRUE if when else JUMP_IF_FALSE, 0, condition.line)]
+
+    def visit_If(self, node):
+        to_else = self.compile_jump(node.condition, False)
+        self.compile_block(node.body)
+        if node.orelse:
+            to_end = self.emit(JUMP, 0, node.line)
+            self.patch_all(to_else)
+            self.compile_block(node.orelse)
+            self.patch(to_end, len(self.bytecode.code))
+        else:
+            self.patch_all(to_else)
+
+    def visit_While(self, node):
+        for slot in node.invariants:
+            self.emit(FORGET, slot, node.line)
+        to_skip = None
+        if node.info is not None and node.info.closed_form is not None:
+            self.emit(CLOSED_FORM, self.constant(node.info.closed_form.fields()), node.line)
+            to_skip = self.emit(JUMP_IF_FALSE, 0, node.line)
+        # The condition follows the body, so each iteration ends in a single
+        # jump back to the body's start
+        steps = iteration_steps(node)
+        if self.limited:
+            self.emit(LOOP_ENTER, steps, node.line)
+        to_condition = self.emit(JUMP, 0, node.line)
+        start = len(self.bytecode.code)
+        if self.limited:
+            self.emit(LOOP_TICK, steps, node.line)
+        self.compile_block(node.body)
+        self.patch(to_condition, len(self.bytecode.code))
+        for jump in self.compile_jump(node.condition, True):
+            self.patch(jump, start)
+        if self.limited:
+            self.emit(LOOP_EXIT, steps, node.line)
+        if to_skip is not None:
+            self.patch(to_skip, len(self.bytecode.code))
+
+    def visit_Program(self, node):
+        self.compile_block(node.statements)
+
+def disassemble(bytecode: Bytecode) -> str:
+    """One line per instruction: jump target mark, word position, source line, opcode, argument"""
+    code = bytecode.code
+    targets = {code[pc + 1] for pc in range(0, len(code), 2) if code[pc] in JUMPS}
+    targets.update(code[pc + 1] >> 3 for pc in range(0, len(code), 2) if code[pc] in COMPARE_JUMPS)
+    lines = []
+    last_line = None
+    for pc in range(0, len(code), 2):
+        opcode, arg = code[pc], code[pc + 1]
+        line = bytecode.lines[pc // 2]
+        if opcode in (LOAD_CONST, CLOSED_FORM):
+            detail = repr(bytecode.constants[arg])
+        elif opcode == INPUT:
+            detail = ', '.join(bytecode.names[index] for index in bytecode.constants[arg])
+        elif opcode == UNDEFINED:
+            detail = bytecode.names[arg]
+        elif opcode in (LOAD_VAR, STORE_VAR, DEFINE_VAR, FORGET):
+            detail = bytecode.names[arg] if arg < bytecode.slots else f"<invariant {arg}>"
+        elif opcode == BINARY:
+            detail = BINARY_OPERATORS[arg]
+        elif opcode == UNARY:
+            detail = UNARY_OPERATORS[arg]
+        elif opcode in JUMPS:
+            detail = f"to {arg}"
+        elif opcode in COMPARE_JUMPS:
+            detail = f"{COMPARISON_OPERATORS[arg & 7]} to {arg >> 3}"
+        elif opcode in (LOOP_ENTER, LOOP_TICK, LOOP_EXIT):
+            detail = f"{arg} steps"
+        else:
+            detail = ''
+        line_text = str(line) if line != last_line else ''
+        last_line = line
+        mark = '>>' if pc in targets else ''
+        lines.append(f"{line_text:>5} {mark:>2} {pc:>6} {OPCODE_NAMES[opcode]:<21} {arg:>5}  {detail}".rstrip())
+    return '\n'.join(lines)
+
+class VMEvaluator(CFPLEvaluator):
+    """
+    Runs programs compiled to Bytecode. The bytecode of the last program
+    run is kept, so running it again with new input does not recompile it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.compiled_ast = None
+        self.compiled_limited = False
+        self.bytecode = None
+
+    def compile(self, ast: Program) -> Bytecode:
+        return BytecodeCompiler(self.limits is not None).compile(ast)
+
+    def execute_program(self, ast: Program, input_data: str = ""):
+        limited = self.limits is not None
+        if ast is not self.compiled_ast or limited != self.compiled_limited:
+            if tree_depth(ast) > COMPILE_DEPTH_LIMIT:
+                bytecode = None
+            else:
+                bytecode = self.compile(ast)
+            self.compiled_ast, self.compiled_limited, self.bytecode = ast, limited, bytecode
+
+        if self.bytecode is None:
+            return super().execute_program(ast, input_data)
+        return self.execute_bytecode(self.bytecode, input_data)
+
+    def execute_bytecode(self, bytecode: Bytecode, input_data: str = "") -> str:
+        self.names = bytecode.names[:bytecode.slots]
+        self.types = bytecode.types
+        self.values = [UNSET] * (bytecode.slots + bytecode.temporaries)
+        self.start_output()
+        self.start_budget()
+        self.input_queue = input_data.split(',') if input_data.strip() else []
+
+        self.run(bytecode)
+
+        return self.output_text()
+
+    def run(self, bytecode: Bytecode):
+        code = bytecode.code
+        constants = bytecode.constants
+        names = bytecode.names
+        slots = bytecode.slots
+        values = self.values
+        binary = BINARY_FUNCTIONS
+        unary = UNARY_FUNCTIONS
+        compare = COMPARISON_FUNCTIONS
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+
+        # Most frequent instructions first
+        while True:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if opcode == LOAD_VAR:
+                push(values[arg])
+            elif opcode == LOAD_CONST:
+                push(constants[arg])
+            elif opcode == BINARY:
+                right = pop()
+                try:
+                    stack[-1] = binary[arg](stack[-1], right)
+                except ZeroDivisionError as e:
+                    if arg == DIVIDE:
+                        self.error_at(str(e), bytecode.lines[pc // 2 - 1])
+                    raise
+            elif opcode == COMPARE_JUMP_IF_TRUE:
+                right = pop()
+                if compare[arg & 7](pop(), right):
+                    pc = arg >> 3
+            elif opcode == COMPARE_JUMP_IF_FALSE:
+                right = pop()
+                if not compare[arg & 7](pop(), right):
+                    pc = arg >> 3
+            elif opcode == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif opcode == STORE_VAR:
+                values[arg] = pop()
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode == TO_STR:
+                stack[-1] = str(stack[-1])
+            elif opcode == OUTPUT:
+                parts = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                self.output.append(''.join(parts))
+            elif opcode == UNARY:
+                stack[-1] = unary[arg](stack[-1])
+            elif opcode == JUMP_IF_TRUE:
+                if pop():
+                    pc = arg
+            elif opcode == JUMP_IF_FALSE_OR_POP:
+                if not stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif opcode == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif opcode == DUP_TOP:
+                push(stack[-1])
+            elif opcode == DEFINE_VAR:
+                values[arg] = pop()
+            elif opcode == INPUT:
+                indices = constants[arg]
+                self.read_input([names[index] for index in indices],
+                                [index if index < slots else None for index in indices],
+                                bytecode.lines[pc // 2 - 1])
+            elif opcode == JUMP_IF_SET:
+                if stack[-1] is not UNSET:
+                    pc = arg
+                else:
+                    pop()
+            elif opcode == FORGET:
+                values[arg] = UNSET
+            elif opcode == CLOSED_FORM:
+                push(not self.run_closed_form(ClosedForm(*constants[arg])))
+            elif opcode == LOOP_TICK:
+                stack[-2] += 1
+                if stack[-2] >= stack[-1]:
+                    stack[-1] = self.budget.charge(stack[-2], arg, bytecode.lines[pc // 2 - 1])
+                    stack[-2] = 0
+            elif opcode == LOOP_ENTER:
+                push(0)
+                push(self.budget.charge(0, arg, bytecode.lines[pc // 2 - 1]))
+            elif opcode == LOOP_EXIT:
+                pop()
+                count = pop()
+                if count:
+                    self.budget.charge(count, arg, bytecode.lines[pc // 2 - 1])
+            elif opcode == UNDEFINED:
+                self.error_at(f"Undefined variable: {names[arg]}", bytecode.lines[pc // 2 - 1])
+            elif opcode == HALT:
+                return
+            else:
+                raise Exception(f"Bad opcode {opcode} at {pc - 2}")
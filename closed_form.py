@@ -0,0 +1,255 @@
+import math
+import operator
+from fractions import Fraction
+from typing import Any, Callable, List, Optional, Tuple
+from ast_nodes import Assign, BinaryOp, Chain, Literal, Node, Var, While
+
+# Integers up to this size are exact as floats, and so are sums and
+# products of them that stay within it
+EXACT_FLOAT_LIMIT = 2 ** 53
+
+COMPARISONS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '<>': operator.ne,
+}
+
+# An operand is (slot, None) for a variable or (None, value) for a literal
+
+class ClosedForm:
+    """
+    The effect of a counting loop computed without iterating it:
+
+        WHILE (i op bound)
+            i = i + step                 (once, anywhere in the body)
+            x = x + term + term - ...    (any number of accumulators)
+
+    A term is a variable or literal the loop does not assign, i itself, or
+    i times such a variable or literal. Every field holds only numbers,
+    strings, None and tuples, so the bytecode can keep one as a constant.
+    updates holds (slot, after_step, terms) per accumulator, after_step
+    telling whether its statement comes after the counter's; each term is
+    (sign, uses_counter, operand).
+    """
+    __slots__ = ('counter', 'op', 'bound', 'step', 'updates')
+
+    def __init__(self, counter: int, op: str, bound: Tuple, step, updates: Tuple):
+        self.counter = counter
+        self.op = op
+        self.bound = bound
+        self.step = step
+        self.updates = updates
+
+    def fields(self) -> Tuple:
+        return (self.counter, self.op, self.bound, self.step, self.updates)
+
+    @property
+    def targets(self) -> Tuple[int, ...]:
+        """Slots the loop assigns, in the order apply() returns their values"""
+        return (self.counter,) + tuple(slot for slot, _, _ in self.updates)
+
+    @property
+    def reads(self) -> Tuple[int, ...]:
+        """Slots whose values apply() reads"""
+        slots = list(self.targets)
+        operands = [self.bound] + [operand for _, _, terms in self.updates for _, _, operand in terms]
+        for slot, _ in operands:
+            if slot is not None and slot not in slots:
+                slots.append(slot)
+        return tuple(slots)
+
+    @property
+    def iteration_steps(self) -> int:
+        """Steps per iteration for ExecutionLimits: the condition and one per statement"""
+        return 2 + len(self.updates)
+
+    def __repr__(self):
+        return f'ClosedForm{self.fields()!r}'
+
+    def trips(self, read: Callable[[int], Any]) -> Optional[int]:
+        """How many iterations the loop runs, given read(slot) as for apply(); None if unknown"""
+        start = read(self.counter)
+        bound = operand_value(self.bound, read)
+        if not (is_number(start) and is_number(bound)):
+            return None
+        return trip_count(start, self.op, bound, self.step)
+
+    def apply(self, read: Callable[[int], Any]) -> Optional[Tuple]:
+        """
+        The values of the target slots once the loop has finished, given
+        read(slot) for their values before it starts. None when the loop
+        does not run at all, would never finish, or has values the result
+        cannot be proven exact for; the loop then has to be run as usual.
+        """
+        start = read(self.counter)
+        bound = operand_value(self.bound, read)
+        step = self.step
+        if not (is_number(start) and is_number(bound)):
+            return None
+        trips = trip_count(start, self.op, bound, step)
+        if not trips:
+            return None
+
+        counter_float = isinstance(start, float) or isinstance(step, float)
+        needs_limit = counter_float
+        start_exact = exact_integer(start)
+        step_exact = exact_integer(step)
+        if start_exact is None or step_exact is None:
+            return None
+        end_exact = start_exact + trips * step_exact
+        largest_counter = max(abs(start_exact), abs(end_exact))
+
+        results = [float(end_exact) if counter_float else end_exact]
+        limits = [largest_counter]
+        for slot, after_step, terms in self.updates:
+            value = read(slot)
+            if not is_number(value) or (isinstance(value, float) and value == 0
+                                        and math.copysign(1, value) < 0):
+                # -0.0 + 0 would stay -0.0 only when added to step by step
+                return None
+            total = exact_integer(value)
+            if total is None:
+                return None
+            is_float = isinstance(value, float)
+            # Sum of the counter values the statement sees, one per iteration
+            shift = 1 if after_step else 0
+            counter_sum = trips * start_exact + step_exact * (trips * (trips - 1) // 2 + shift * trips)
+            # Counter values seen after the first iteration are floats
+            # whenever the counter is
+            counter_seen_float = isinstance(start, float) or (
+                isinstance(step, float) and (after_step or trips > 1))
+            largest_step = 0
+            for sign, uses_counter, operand in terms:
+                coefficient = operand_value(operand, read)
+                if not is_number(coefficient):
+                    return None
+                exact = exact_integer(coefficient)
+                if exact is None:
+                    return None
+                if isinstance(coefficient, float) or (uses_counter and counter_seen_float):
+                    is_float = True
+                if uses_counter:
+                    total += sign * exact * counter_sum
+                    largest_step += abs(exact) * largest_counter
+                else:
+                    total += sign * exact * trips
+                    largest_step += abs(exact)
+            needs_limit = needs_limit or is_float
+            results.append(float(total) if is_float else total)
+            limits.append(abs(exact_integer(value)) + trips * largest_step)
+
+        if needs_limit and max(limits) > EXACT_FLOAT_LIMIT:
+            # Float rounding could make stepping differ from the exact result
+            return None
+        return tuple(results)
+
+def is_number(value) -> bool:
+    """INT or FLOAT, and finite; BOOL values take the usual path"""
+    return type(value) is int or (type(value) is float and math.isfinite(value))
+
+def exact_integer(value) -> Optional[int]:
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    return value
+
+def operand_value(operand: Tuple, read: Callable[[int], Any]):
+    slot, value = operand
+    return read(slot) if slot is not None else value
+
+def trip_count(start, op: str, bound, step) -> Optional[int]:
+    """
+    How many times `counter op bound` holds for counter = start,
+    start + step, ... before it first fails; None if it never fails
+    """
+    holds = COMPARISONS[op]
+    if not holds(start, bound):
+        return 0
+    distance = (Fraction(bound) - Fraction(start)) / Fraction(step)
+    if op == '<>':
+        # Only stops on reaching bound exactly
+        if distance.denominator != 1 or distance <= 0:
+            return None
+        return int(distance)
+    if distance <= 0:
+        # The counter moves away from the bound
+        return None
+    if op in ('<', '>'):
+        return math.ceil(distance)
+    return math.floor(distance) + 1
+
+def find_closed_form(loop: While) -> Optional[ClosedForm]:
+    """The ClosedForm of a loop whose LoopInfo names a counter, or None"""
+    info = loop.info
+    if info is None or info.counter is None:
+        return None
+    counter, op, bound = info.counter
+    step = info.inductions[counter]
+    bound = invariant_operand(bound, info.assigned)
+    if bound is None or step == 0 or not is_number(step):
+        return None
+
+    updates = []
+    after_step = False
+    targets = set()
+    for statement in loop.body:
+        if not isinstance(statement, Assign) or statement.slot in targets:
+            return None
+        targets.add(statement.slot)
+        if statement.slot == counter:
+            after_step = True
+            continue
+        terms = accumulator_terms(statement, counter, info.assigned)
+        if terms is None:
+            return None
+        updates.append((statement.slot, after_step, terms))
+    return ClosedForm(counter, op, bound, step, tuple(updates))
+
+def invariant_operand(node: Node, assigned: frozenset) -> Optional[Tuple]:
+    if isinstance(node, Literal):
+        return (None, node.value)
+    if isinstance(node, Var) and node.slot is not None and node.slot not in assigned:
+        return (node.slot, None)
+    return None
+
+def accumulator_terms(statement: Assign, counter: int, assigned: frozenset) -> Optional[Tuple]:
+    """The terms added to the variable by `x = x + term - term ...`, or None"""
+    terms = []
+    found_self = False
+    for sign, node in signed_terms(statement.value):
+        if isinstance(node, Var) and node.slot == statement.slot and sign > 0 and not found_self:
+            found_self = True
+        elif isinstance(node, Var) and node.slot == counter:
+            terms.append((sign, True, (None, 1)))
+        elif isinstance(node, BinaryOp) and node.op == '*':
+            if isinstance(node.left, Var) and node.left.slot == counter:
+                operand = invariant_operand(node.right, assigned)
+            elif isinstance(node.right, Var) and node.right.slot == counter:
+                operand = invariant_operand(node.left, assigned)
+            else:
+                return None
+            if operand is None:
+                return None
+            terms.append((sign, True, operand))
+        else:
+            operand = invariant_operand(node, assigned)
+            if operand is None:
+                return None
+            terms.append((sign, False, operand))
+    if not found_self or not terms:
+        return None
+    return tuple(terms)
+
+def signed_terms(expr: Node) -> List[Tuple[int, Node]]:
+    """Split a sum of + and - operations into (sign, operand) pairs"""
+    terms = []
+    pending = [(1, expr)]
+    while pending:
+        sign, node = pending.pop()
+        if isinstance(node, BinaryOp) and node.op in ('+', '-'):
+            pending.append((-sign if node.op == '-' else sign, node.right))
+            pending.append((sign, node.left))
+        elif isinstance(node, Chain) and node.ops[0] in ('+', '-'):
+            for op, operand in reversed(list(zip(node.ops, node.operands[1:]))):
+                pending.append((-sign if op == '-' else sign, operand))
+            pending.append((sign, node.operands[0]))
+        else:
+            terms.append((sign, node))
+    return terms
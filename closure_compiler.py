@@ -0,0 +1,372 @@
+from typing import Callable, List
+from ast_nodes import Literal, Node, NodeVisitor, Program, Text, Var, tree_depth
+from evaluator import (BINARY_OPERATIONS, CFPLEvaluator, SHORT_CIRCUIT_OPERATORS, UNARY_OPERATIONS,
+                       UNSET, leaf_comparison, short_circuits)
+from limits import iteration_steps
+
+# Compiled closures call each other once per tree level; deeper programs
+# are left to the tree-walking evaluator, which does not recurse
+CLOSURE_DEPTH_LIMIT = 150
+
+# One factory per operator, so each compiled node runs the operator inline;
+# Python's own and / or skip the right operand as CFPL's do
+BINARY_CLOSURES = {
+    'or': lambda left, right: lambda v: left(v) or right(v),
+    'and': lambda left, right: lambda v: left(v) and right(v),
+    '==': lambda left, right: lambda v: left(v) == right(v),
+    '<>': lambda left, right: lambda v: left(v) != right(v),
+    '>': lambda left, right: lambda v: left(v) > right(v),
+    '<': lambda left, right: lambda v: left(v) < right(v),
+    '>=': lambda left, right: lambda v: left(v) >= right(v),
+    '<=': lambda left, right: lambda v: left(v) <= right(v),
+    '+': lambda left, right: lambda v: left(v) + right(v),
+    '-': lambda left, right: lambda v: left(v) - right(v),
+    '*': lambda left, right: lambda v: left(v) * right(v),
+    '%': lambda left, right: lambda v: left(v) % right(v),
+}
+
+class ClosureCompiler(NodeVisitor):
+    """
+    Compiles a resolved syntax tree into nested Python closures, one per
+    node. Every closure takes the list of variable values, indexed by slot;
+    expressions return their value and statements return None. Errors are raised through the runtime
+    evaluator, so messages match the tree-walking evaluator's. With limited,
+    loops report their iterations to the runtime's ExecutionBudget.
+    """
+    def __init__(self, runtime: CFPLEvaluator, limited: bool = False):
+        super().__init__()
+        self.runtime = runtime
+        self.limited = limited
+
+    def compile(self, node: Node) -> Callable:
+        return self.visit(node)
+
+    def generic_visit(self, node: Node):
+        self.runtime.error(f"Unknown node: {node!r}", node)
+
+    # Expressions
+
+    def visit_Literal(self, node):
+        value = node.value
+        return lambda v: value
+
+    def visit_Var(self, node):
+        if node.slot is None:
+            return self.undefined(node.name, node)
+        slot = node.slot
+        return lambda v: v[slot]
+
+    def undefined(self, var_name: str, node: Node) -> Callable:
+        """A closure raising the undefined-variable error when it is reached"""
+        error = self.runtime.error
+        def undefined(v):
+            error(f"Undefined variable: {var_name}", node)
+        return undefined
+
+    def compile_binary(self, node: Node, op: str, left: Callable, right: Callable) -> Callable:
+        if op == '/':
+            error = self.runtime.error
+            def divide(v):
+                a = left(v)
+                b = right(v)
+                if b == 0:
+                    error("Division by zero", node)
+                return a / b
+            return divide
+        return BINARY_CLOSURES[op](left, right)
+
+    def compile_leaf_binary(self, node: Node, op: str, left: Node, right: Node) -> Callable:
+        """
+        Specialized closures for a variable combined with a literal or with
+        another variable, which read the operands directly instead of
+        calling a closure for each; None for any other operands
+        """
+        if not isinstance(left, Var) or not isinstance(right, (Var, Literal)):
+            return None
+        if op in SHORT_CIRCUIT_OPERATORS:
+            return None
+        if left.slot is None or (isinstance(right, Var) and right.slot is None):
+            return None
+
+        operation = BINARY_OPERATIONS[op]
+        runtime = self.runtime
+        slot = left.slot
+        if isinstance(right, Literal):
+            value = right.value
+            def var_literal(v):
+                try:
+                    return operation(v[slot], value)
+                except ZeroDivisionError as e:
+                    runtime.division_error(node, op, e)
+            return var_literal
+
+        other = right.slot
+        def var_var(v):
+            try:
+                return operation(v[slot], v[other])
+            except ZeroDivisionError as e:
+                runtime.division_error(node, op, e)
+        return var_var
+
+    def visit_BinaryOp(self, node):
+        compiled = self.compile_leaf_binary(node, node.op, node.left, node.right)
+        if compiled is not None:
+            return compiled
+        return self.compile_binary(node, node.op, self.visit(node.left), self.visit(node.right))
+
+    def visit_Chain(self, node):
+        operands = [self.visit(operand) for operand in node.operands]
+        if len(operands) <= 4:
+            compiled = self.compile_leaf_binary(node, node.ops[0], node.operands[0], node.operands[1])
+            if compiled is None:
+                compiled = self.compile_binary(node, node.ops[0], operands[0], operands[1])
+            for op, operand in zip(node.ops[1:], operands[2:]):
+                compiled = self.compile_binary(node, op, compiled, operand)
+            return compiled
+
+        # Long chains fold in a loop rather than nesting one closure per operator
+        return self.compile_fold(node, operands[0], list(zip(node.ops, operands[1:])))
+
+    def compile_fold(self, node: Node, first: Callable, steps: List[tuple]) -> Callable:
+        runtime = self.runtime
+        if any(op in SHORT_CIRCUIT_OPERATORS for op, _ in steps):
+            def logical_chain(v):
+                value = first(v)
+                for op, operand in steps:
+                    if op not in SHORT_CIRCUIT_OPERATORS:
+                        value = runtime.apply_binary(node, op, value, operand(v))
+                    elif not short_circuits(op, value):
+                        value = operand(v)
+                return value
+            return logical_chain
+        def chain(v):
+            value = first(v)
+            for op, operand in steps:
+                value = runtime.apply_binary(node, op, value, operand(v))
+            return value
+        return chain
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if node.op == '-':
+            return lambda v: -operand(v)
+        if node.op == 'NOT':
+            return lambda v: not operand(v)
+        operation = UNARY_OPERATIONS[node.op]
+        return lambda v: operation(operand(v))
+
+    def visit_Invariant(self, node):
+        slot = node.slot
+        expr = self.visit(node.expr)
+        def invariant(v):
+            value = v[slot]
+            if value is UNSET:
+                value = v[slot] = expr(v)
+            return value
+        return invariant
+
+    # Statements
+
+    def compile_block(self, statements: List[Node]) -> Callable:
+        compiled = tuple(self.visit(statement) for statement in statements)
+        if not compiled:
+            return lambda v: None
+        if len(compiled) == 1:
+            return compiled[0]
+        if len(compiled) == 2:
+            first, second = compiled
+            def block(v):
+                first(v)
+                second(v)
+            return block
+        def block(v):
+            for statement in compiled:
+                statement(v)
+        return block
+
+    def visit_VarDecl(self, node):
+        runtime = self.runtime
+        return lambda v: runtime.visit_VarDecl(node)
+
+    def visit_Assign(self, node):
+        if node.slot is None:
+            return self.undefined(node.name, node)
+        slot = node.slot
+        value = self.visit(node.value)
+        def assign(v):
+            v[slot] = value(v)
+        return assign
+
+    def visit_ChainAssign(self, node):
+        for var_name, slot in zip(node.names, node.slots):
+            if slot is None:
+                return self.undefined(var_name, node)
+        slots = node.slots
+        value = self.visit(node.value)
+        def assign(v):
+            result = value(v)
+            for slot in slots:
+                v[slot] = result
+        return assign
+
+    def visit_Output(self, node):
+        # The fixed text of the template is in place in a buffer; each run
+        # fills in the expression values of a copy of it
+        buffer = []
+        slots = []
+        for part in node.parts:
+            if isinstance(part, Text):
+                buffer.append(part.value)
+            else:
+                slots.append((len(buffer), self.visit(part), part.type == 'CHAR'))
+                buffer.append('')
+        runtime = self.runtime
+
+        if not slots:
+            text = ''.join(buffer)
+            return lambda v: runtime.output.append(text)
+        if len(slots) == 1:
+            # Text around a single value is concatenated directly
+            index, expr, is_text = slots[0]
+            prefix, suffix = ''.join(buffer[:index]), ''.join(buffer[index + 1:])
+            if is_text:
+                return lambda v: runtime.output.append(prefix + expr(v) + suffix)
+            return lambda v: runtime.output.append(prefix + str(expr(v)) + suffix)
+
+        slots = tuple(slots)
+        def output(v):
+            line = buffer[:]
+            for index, expr, is_text in slots:
+                value = expr(v)
+                line[index] = value if is_text else str(value)
+            runtime.output.append(''.join(line))
+        return output
+
+    def visit_Input(self, node):
+        runtime = self.runtime
+        return lambda v: runtime.visit_Input(node)
+
+    def visit_If(self, node):
+        body = self.compile_block(node.body)
+        orelse = self.compile_block(node.orelse)
+        comparison = leaf_comparison(node.condition)
+        if comparison is not None:
+            # Compare the values in the branch itself, without a closure call
+            operation, slot, other, value = comparison
+            if other is None:
+                def if_(v):
+                    if operation(v[slot], value):
+                        body(v)
+                    else:
+                        orelse(v)
+            else:
+                def if_(v):
+                    if operation(v[slot], v[other]):
+                        body(v)
+                    else:
+                        orelse(v)
+            return if_
+        condition = self.visit(node.condition)
+        def if_(v):
+            if condition(v):
+                body(v)
+            else:
+                orelse(v)
+        return if_
+
+    def visit_While(self, node):
+        condition = self.visit(node.condition)
+        body = self.compile_block(node.body)
+        invariants = tuple(node.invariants)
+        closed_form = node.info.closed_form if node.info is not None else None
+        if self.limited:
+            return self.limited_while(node, condition, body, invariants, closed_form)
+        if closed_form is not None:
+            run_closed_form = self.runtime.run_closed_form
+            def while_(v):
+                for slot in invariants:
+                    v[slot] = UNSET
+                if not run_closed_form(closed_form):
+                    while condition(v):
+                        body(v)
+            return while_
+        comparison = leaf_comparison(node.condition)
+        if not invariants and comparison is not None:
+            operation, slot, other, value = comparison
+            if other is None:
+                def while_(v):
+                    while operation(v[slot], value):
+                        body(v)
+            else:
+                def while_(v):
+                    while operation(v[slot], v[other]):
+                        body(v)
+            return while_
+        if not invariants:
+            def while_(v):
+                while condition(v):
+                    body(v)
+            return while_
+        def while_(v):
+            for slot in invariants:
+                v[slot] = UNSET
+            while condition(v):
+                body(v)
+        return while_
+
+    def limited_while(self, node: Node, condition: Callable, body: Callable, invariants: tuple,
+                      closed_form) -> Callable:
+        runtime = self.runtime
+        run_closed_form = runtime.run_closed_form
+        steps = iteration_steps(node)
+        line = node.line
+        def while_(v):
+            for slot in invariants:
+                v[slot] = UNSET
+            if closed_form is not None and run_closed_form(closed_form):
+                return
+            charge = runtime.budget.charge
+            count = 0
+            batch = charge(0, steps, line)
+            while condition(v):
+                count += 1
+                if count >= batch:
+                    batch = charge(count, steps, line)
+                    count = 0
+                body(v)
+            if count:
+                charge(count, steps, line)
+        return while_
+
+    def visit_Program(self, node):
+        return self.compile_block(node.statements)
+
+class ClosureEvaluator(CFPLEvaluator):
+    """
+    Runs programs compiled by ClosureCompiler. The closures of the last
+    program run are kept, so running it again with new input does not
+    recompile it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.compiled_ast = None
+        self.compiled_limited = False
+        self.compiled = None
+
+    def execute_program(self, ast: Program, input_data: str = ""):
+        self.prepare(ast, input_data)
+
+        limited = self.limits is not None
+        if ast is not self.compiled_ast or limited != self.compiled_limited:
+            if tree_depth(ast) > CLOSURE_DEPTH_LIMIT:
+                compiled = None
+            else:
+                compiled = ClosureCompiler(self, limited).compile(ast)
+            self.compiled_ast, self.compiled_limited, self.compiled = ast, limited, compiled
+
+        if self.compiled is None:
+            return super().execute_program(ast, input_data)
+
+        self.compiled(self.values)
+
+        return self.output_text()
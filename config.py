@@ -49,3 +49,25 @@ APP_SETTINGS = {
     'HTML_FILE': 'index.html',
     'WEB_FOLDER': 'web'
 }
+
+# Execution limits of programs run from the web page (see ExecutionLimits);
+# None leaves a limit off
+WEB_EXECUTION_LIMITS = {
+    'max_steps': None,
+    'max_iterations': None,
+    'timeout': 30.0
+}
+
+# Output of programs run from the web page kept in memory (see
+# BoundedOutput); the rest is spilled to a temporary file
+WEB_OUTPUT_LIMITS = {
+    'max_bytes': 1 << 20,
+    'head_bytes': 1 << 19
+}
+
+# Interpreter version; part of every on-disk compiled program cache key,
+# bump it whenever the syntax tree or any compiled form changes
+INTERPRETER_VERSION = '2.0'
+
+# Default directory for compiled program caches (like __pycache__)
+CACHE_DIRECTORY = '__cfplcache__'
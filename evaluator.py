@@ -1,224 +1,490 @@
+import operator
 from typing import Any, Dict, List
-from token_types import TokenType
+from ast_nodes import (Assign, BinaryOp, Chain, ChainAssign, If, Invariant, Literal, Node, NodeVisitor, Output,
+                       Program, Text, UnaryOp, Var, While, tree_depth)
+from config import DEFAULT_VALUES
+from limits import ExecutionBudget, iteration_steps
+from resolver import resolve
 
-class CFPLEvaluator:
+def divide(left, right):
+    if right == 0:
+        raise ZeroDivisionError("Division by zero")
+    return left / right
+
+# AND / OR are also listed here for constant folding; when a program runs,
+# their right operand is only evaluated if the left one does not already
+# decide the result
+BINARY_OPERATIONS = {
+    'or': lambda left, right: left or right,
+    'and': lambda left, right: left and right,
+    '==': operator.eq, '<>': operator.ne,
+    '>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le,
+    '+': operator.add, '-': operator.sub, '*': operator.mul,
+    '/': divide, '%': operator.mod,
+}
+
+SHORT_CIRCUIT_OPERATORS = ('and', 'or')
+
+COMPARISON_OPERATORS = ('==', '<>', '>', '<', '>=', '<=')
+
+UNARY_OPERATIONS = {
+    '+': operator.pos,
+    '-': operator.neg,
+    'NOT': operator.not_,
+    'FLOAT': float,
+}
+
+# Python type of the input values each declared type accepts
+INPUT_TYPES = {'INT': int, 'FLOAT': float, 'BOOL': bool}
+
+# Expressions nested deeper than this are evaluated with an explicit stack
+# (evaluate_iteratively()); each level takes two frames of the recursive
+# visitors, which keeps them well inside Python's default recursion limit
+RECURSIVE_DEPTH_LIMIT = 200
+
+# Value of a variable slot whose VAR declaration has not run yet, and of an
+# Invariant slot not yet computed since its loop started
+UNSET = object()
+
+def short_circuits(op: str, left) -> bool:
+    """Whether left alone decides `left op right` for op AND / OR; the result is then left"""
+    return not left if op == 'and' else bool(left)
+
+def deep_expressions(program: Program) -> frozenset:
+    """The expressions of program's statements nested deeper than RECURSIVE_DEPTH_LIMIT"""
+    if tree_depth(program) <= RECURSIVE_DEPTH_LIMIT:
+        return frozenset()
+    deep = set()
+    statements = list(program.statements)
+    while statements:
+        statement = statements.pop()
+        if isinstance(statement, (Assign, ChainAssign)):
+            expressions = [statement.value]
+        elif isinstance(statement, If):
+            expressions = [statement.condition]
+            statements.extend(statement.body + statement.orelse)
+        elif isinstance(statement, While):
+            expressions = [statement.condition]
+            statements.extend(statement.body)
+        elif isinstance(statement, Output):
+            expressions = [part for part in statement.parts if part.__class__ is not Text]
+        else:
+            continue
+        deep.update(expression for expression in expressions if tree_depth(expression) > RECURSIVE_DEPTH_LIMIT)
+    return frozenset(deep)
+
+def operation_parts(node: Node):
+    """The operands and operators of a BinaryOp or Chain"""
+    if isinstance(node, BinaryOp):
+        return (node.left, node.right), (node.op,)
+    return node.operands, node.ops
+
+def leaf_comparison(condition: Node):
+    """
+    (operation, slot, other_slot, value) when condition compares a declared
+    variable with a literal value (other_slot None) or with another declared
+    variable, so that a loop can test it without visiting its operands;
+    otherwise None
+    """
+    if not isinstance(condition, BinaryOp) or condition.op not in COMPARISON_OPERATORS:
+        return None
+    left, right = condition.left, condition.right
+    if not isinstance(left, Var) or left.slot is None:
+        return None
+    operation = BINARY_OPERATIONS[condition.op]
+    if isinstance(right, Literal):
+        return operation, left.slot, None, right.value
+    if isinstance(right, Var) and right.slot is not None:
+        return operation, left.slot, right.slot, None
+    return None
+
+class CFPLEvaluator(NodeVisitor):
     def __init__(self):
-        self.variables = {}
+        super().__init__()
+        # Variable values live in a flat list indexed by the slots that
+        # resolver.resolve() gave the program's declared names
+        self.names = []
+        # Declared type of each slot
+        self.types = []
+        self.values = []
         self.output = []
+        # OutputSink to stream output to, or None to collect it in self.output
+        self.output_sink = None
+        # ExecutionLimits of every run, and the ExecutionBudget of the
+        # current one; None when runs are not limited
+        self.limits = None
+        self.budget = None
         self.input_queue = []
-    
-    def error(self, message: str):
+        # Expressions of the program last prepared that are too deep for
+        # the recursive visitors
+        self.prepared_ast = None
+        self.deep = frozenset()
+
+    @property
+    def variables(self) -> Dict[str, Any]:
+        """Name -> value of every declared variable, built on demand"""
+        return {name: value for name, value in zip(self.names, self.values) if value is not UNSET}
+
+    def prepare(self, ast: Program, input_data: str):
+        """Reset the run state for executing ast with input_data"""
+        if ast.names is None:
+            resolve(ast)
+        self.names = ast.names
+        self.types = ast.types
+        if ast is not self.prepared_ast:
+            self.prepared_ast, self.deep = ast, deep_expressions(ast)
+        self.values = [UNSET] * (len(ast.names) + ast.temporaries)
+        self.start_output()
+        self.start_budget()
+        self.input_queue = input_data.split(',') if input_data.strip() else []
+
+    def start_budget(self):
+        self.budget = ExecutionBudget(self.limits) if self.limits is not None else None
+
+    def start_output(self):
+        """Point self.output, which OUTPUT statements append to, at this run's destination"""
+        if self.output_sink is None:
+            self.output = []
+        else:
+            self.output_sink.start()
+            self.output = self.output_sink
+
+    def output_text(self) -> str:
+        """The output a finished run returns"""
+        if self.output_sink is None:
+            return '\n'.join(self.output)
+        return self.output_sink.text()
+
+    def error(self, message: str, node: Node = None):
+        self.error_at(message, node.line if node is not None else 0)
+
+    def error_at(self, message: str, line: int):
+        if line:
+            raise Exception(f"Runtime error at line {line}: {message}")
         raise Exception(f"Runtime error: {message}")
-    
-    def evaluate_expression(self, expr):
-        if isinstance(expr, (int, float, str, bool)):
-            return expr
-        
-        if isinstance(expr, tuple):
-            op = expr[0]
-            
-            if op == 'var':
-                var_name = expr[1]
-                if var_name not in self.variables:
-                    self.error(f"Undefined variable: {var_name}")
-                return self.variables[var_name]
-            
-            elif op == 'or':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left or right
-            
-            elif op == 'and':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left and right
-            
-            elif op == '==':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left == right
-            
-            elif op == '<>':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left != right
-            
-            elif op == '>':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left > right
-            
-            elif op == '<':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left < right
-            
-            elif op == '>=':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left >= right
-            
-            elif op == '<=':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left <= right
-            
-            elif op == '+':
-                if len(expr) == 2:  # Unary plus
-                    return +self.evaluate_expression(expr[1])
-                else:  # Binary plus
-                    left = self.evaluate_expression(expr[1])
-                    right = self.evaluate_expression(expr[2])
-                    return left + right
-            
-            elif op == '-':
-                if len(expr) == 2:  # Unary minus
-                    return -self.evaluate_expression(expr[1])
-                else:  # Binary minus
-                    left = self.evaluate_expression(expr[1])
-                    right = self.evaluate_expression(expr[2])
-                    return left - right
-            
-            elif op == '*':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left * right
-            
-            elif op == '/':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                if right == 0:
-                    self.error("Division by zero")
-                return left / right
-            
-            elif op == '%':
-                left = self.evaluate_expression(expr[1])
-                right = self.evaluate_expression(expr[2])
-                return left % right
-            
-            elif op == 'NOT':
-                return not self.evaluate_expression(expr[1])
-        
-        self.error(f"Unknown expression: {expr}")
-    
-    def execute_statement(self, stmt):
-        if not isinstance(stmt, tuple):
-            return
-        
-        op = stmt[0]
-        
-        if op == 'var_decl':
-            variables, initial_values, var_type = stmt[1], stmt[1], stmt[2]
-            
-            for var_name, initial_value in variables:
-                if initial_value is not None:
-                    self.variables[var_name] = initial_value
+
+    def generic_visit(self, node: Node):
+        self.error(f"Unknown node: {node!r}", node)
+
+    # Expressions
+
+    def evaluate_expression(self, expr: Node):
+        if expr in self.deep:
+            return self.evaluate_iteratively(expr)
+        return self.visit(expr)
+
+    def visit_Literal(self, node):
+        return node.value
+
+    def visit_Var(self, node):
+        try:
+            return self.values[node.slot]
+        except TypeError:
+            # Slot None: the name was never declared
+            self.error(f"Undefined variable: {node.name}", node)
+
+    def apply_binary(self, node: Node, op: str, left, right):
+        try:
+            return BINARY_OPERATIONS[op](left, right)
+        except ZeroDivisionError as e:
+            self.division_error(node, op, e)
+
+    def division_error(self, node: Node, op: str, e: ZeroDivisionError):
+        """CFPL reports division by zero; modulo by zero stays a Python error"""
+        if op == '/':
+            self.error(str(e), node)
+        raise e
+
+    def visit_BinaryOp(self, node):
+        left = self.visit(node.left)
+        if node.op in SHORT_CIRCUIT_OPERATORS:
+            return left if short_circuits(node.op, left) else self.visit(node.right)
+        right = self.visit(node.right)
+        try:
+            return BINARY_OPERATIONS[node.op](left, right)
+        except ZeroDivisionError as e:
+            self.division_error(node, node.op, e)
+
+    def visit_Chain(self, node):
+        visit = self.visit
+        operands = node.operands
+        value = visit(operands[0])
+        index = 1
+        for op in node.ops:
+            if op in SHORT_CIRCUIT_OPERATORS:
+                if not short_circuits(op, value):
+                    value = visit(operands[index])
+                index += 1
+                continue
+            right = visit(operands[index])
+            try:
+                value = BINARY_OPERATIONS[op](value, right)
+            except ZeroDivisionError as e:
+                self.division_error(node, op, e)
+            index += 1
+        return value
+
+    def visit_UnaryOp(self, node):
+        return UNARY_OPERATIONS[node.op](self.visit(node.operand))
+
+    def visit_Invariant(self, node):
+        value = self.values[node.slot]
+        if value is UNSET:
+            value = self.values[node.slot] = self.visit(node.expr)
+        return value
+
+    def evaluate_iteratively(self, expr: Node):
+        """Evaluate an expression tree of any depth with an explicit stack"""
+        values = []
+        # (node, stage) pairs. An operation at stage n > 0 has the result of
+        # its first n operands on top of values; at stage -n, the value of
+        # operand n is above that, waiting to be combined with it.
+        pending = [(expr, 0)]
+        while pending:
+            node, stage = pending.pop()
+            if isinstance(node, (Literal, Var)):
+                values.append(self.visit(node))
+            elif isinstance(node, Invariant):
+                if stage:
+                    self.values[node.slot] = values[-1]
+                elif self.values[node.slot] is not UNSET:
+                    values.append(self.values[node.slot])
                 else:
-                    # Default values
-                    if var_type == TokenType.INT:
-                        self.variables[var_name] = 0
-                    elif var_type == TokenType.FLOAT:
-                        self.variables[var_name] = 0.0
-                    elif var_type == TokenType.CHAR:
-                        self.variables[var_name] = ''
-                    elif var_type == TokenType.BOOL:
-                        self.variables[var_name] = False
-        
-        elif op == 'assign':
-            var_name = stmt[1]
-            value_expr = stmt[2]
-            
-            if var_name not in self.variables:
-                self.error(f"Undefined variable: {var_name}")
-            
-            value = self.evaluate_expression(value_expr)
-            self.variables[var_name] = value
-        
-        elif op == 'chain_assign':
-            var_names = stmt[1]
-            value_expr = stmt[2]
-            
-            for var_name in var_names:
-                if var_name not in self.variables:
-                    self.error(f"Undefined variable: {var_name}")
-            
-            value = self.evaluate_expression(value_expr)
-            for var_name in var_names:
-                self.variables[var_name] = value
-        
-        elif op == 'output':
-            output_parts = stmt[1]
-            result_parts = []
-            
-            for part in output_parts:
-                if part[0] == 'string':
-                    value = part[1]
-                    # Handle escape sequences
-                    value = value.replace('[#]', '\n').replace('[[', '[').replace(']]', ']')
-                    result_parts.append(str(value))
-                elif part[0] == 'newline':
-                    result_parts.append('\n')
-                elif part[0] == 'expr':
-                    expr_value = self.evaluate_expression(part[1])
-                    result_parts.append(str(expr_value))
-            
-            result = ''.join(result_parts)
-            self.output.append(result)
-        
-        elif op == 'input':
-            variables = stmt[1]
-            
-            for i, var_name in enumerate(variables):
-                if var_name not in self.variables:
-                    self.error(f"Undefined variable: {var_name}")
-                
-                if i < len(self.input_queue):
-                    value = self.input_queue[i].strip()
-                    # Try to convert to appropriate type
-                    try:
-                        if '.' in value:
-                            self.variables[var_name] = float(value)
-                        else:
-                            self.variables[var_name] = int(value)
-                    except ValueError:
-                        if value.upper() in ['TRUE', 'FALSE']:
-                            self.variables[var_name] = value.upper() == 'TRUE'
-                        elif len(value) == 1:
-                            self.variables[var_name] = value
-                        else:
-                            self.variables[var_name] = value
+                    pending.append((node, 1))
+                    pending.append((node.expr, 0))
+            elif isinstance(node, UnaryOp):
+                if stage:
+                    values[-1] = UNARY_OPERATIONS[node.op](values[-1])
                 else:
-                    self.error(f"Not enough input values provided for variable: {var_name}")
-        
-        elif op == 'if':
-            condition = stmt[1]
-            if_statements = stmt[2]
-            else_statements = stmt[3]
-            
-            if self.evaluate_expression(condition):
-                for statement in if_statements:
-                    self.execute_statement(statement)
+                    pending.append((node, 1))
+                    pending.append((node.operand, 0))
+            elif isinstance(node, (BinaryOp, Chain)):
+                operands, ops = operation_parts(node)
+                if stage == 0:
+                    pending.append((node, 1))
+                    pending.append((operands[0], 0))
+                    continue
+                if stage < 0:
+                    right = values.pop()
+                    values[-1] = self.apply_binary(node, ops[-stage - 1], values[-1], right)
+                    stage = 1 - stage
+                while stage < len(operands):
+                    op = ops[stage - 1]
+                    if op not in SHORT_CIRCUIT_OPERATORS:
+                        pending.append((node, -stage))
+                    elif short_circuits(op, values[-1]):
+                        stage += 1
+                        continue
+                    else:
+                        # The right operand's value is the result
+                        values.pop()
+                        pending.append((node, stage + 1))
+                    pending.append((operands[stage], 0))
+                    break
             else:
-                for statement in else_statements:
-                    self.execute_statement(statement)
-        
-        elif op == 'while':
-            condition = stmt[1]
-            statements = stmt[2]
-            
-            while self.evaluate_expression(condition):
-                for statement in statements:
-                    self.execute_statement(statement)
-    
-    def execute_program(self, ast, input_data: str = ""):
-        self.variables = {}
-        self.output = []
-        self.input_queue = input_data.split(',') if input_data.strip() else []
-        
-        if ast[0] == 'program':
-            statements = ast[1]
-            for statement in statements:
-                self.execute_statement(statement)
-        
-        return '\n'.join(self.output)
-      
\ No newline at end of file
+                self.generic_visit(node)
+        return values.pop()
+
+    # Statements
+
+    # Simple statements are carried out by their visit_* method, which
+    # returns None. IF, WHILE and the program itself instead return an
+    # iterator over the statements to run next; execute_block() keeps those
+    # on an explicit stack, so nested blocks never recurse.
+
+    def execute_statement(self, stmt: Node):
+        self.execute_block([stmt])
+
+    def execute_block(self, statements: List[Node]):
+        visit = self.visit
+        blocks = [iter(statements)]
+        while blocks:
+            for statement in blocks[-1]:
+                block = visit(statement)
+                if block is not None:
+                    blocks.append(block)
+                    break
+            else:
+                blocks.pop()
+
+    def check_defined(self, names: List[str], slots: List[int], line: int):
+        """Raise the undefined-variable error for the first name without a slot"""
+        for var_name, slot in zip(names, slots):
+            if slot is None:
+                self.error_at(f"Undefined variable: {var_name}", line)
+
+    def visit_VarDecl(self, node):
+        default = DEFAULT_VALUES[node.var_type.name]
+        for slot, (var_name, initial_value) in zip(node.slots, node.variables):
+            self.values[slot] = default if initial_value is None else initial_value
+
+    def visit_Assign(self, node):
+        slot = node.slot
+        if slot is None:
+            self.error(f"Undefined variable: {node.name}", node)
+        # The hottest paths make evaluate_expression()'s choice inline
+        value = node.value
+        self.values[slot] = self.evaluate_iteratively(value) if value in self.deep else self.visit(value)
+
+    def visit_ChainAssign(self, node):
+        self.check_defined(node.names, node.slots, node.line)
+
+        value = self.evaluate_expression(node.value)
+        for slot in node.slots:
+            self.values[slot] = value
+
+    def visit_Output(self, node):
+        self.output.append(''.join([self.visit_output_part(part) for part in node.parts]))
+
+    def visit_output_part(self, part: Node) -> str:
+        if part.__class__ is Text:
+            return part.value
+        if part.type == 'CHAR':
+            # Already a string
+            return self.evaluate_expression(part)
+        return str(self.evaluate_expression(part))
+
+    def visit_Input(self, node):
+        self.read_input(node.names, node.slots, node.line)
+
+    def read_input(self, names: List[str], slots: List[int], line: int):
+        """INPUT: names; the i-th name always reads the i-th input value"""
+        for i, (var_name, slot) in enumerate(zip(names, slots)):
+            if slot is None:
+                self.error_at(f"Undefined variable: {var_name}", line)
+
+            if i >= len(self.input_queue):
+                self.error_at(f"Not enough input values provided for variable: {var_name}", line)
+
+            self.values[slot] = self.typed_input(self.input_queue[i].strip(), self.types[slot], var_name, line)
+
+    def typed_input(self, text: str, var_type: str, var_name: str, line: int) -> Any:
+        """
+        Read an input value for a variable declared as var_type in a strict
+        program, or as whatever convert_input() makes of it for var_type None
+        """
+        if var_type is None:
+            return self.convert_input(text)
+        if var_type == 'CHAR':
+            return text
+        value = self.convert_input(text)
+        if var_type == 'FLOAT' and type(value) in (int, float):
+            return float(value)
+        if type(value) is INPUT_TYPES[var_type]:
+            return value
+        self.error_at(f"Invalid {var_type} input for variable {var_name}: {text}", line)
+
+    @staticmethod
+    def convert_input(value: str) -> Any:
+        """Read an input value as FLOAT, INT or BOOL, or else keep the text"""
+        try:
+            if '.' in value:
+                return float(value)
+            return int(value)
+        except ValueError:
+            if value.upper() in ('TRUE', 'FALSE'):
+                return value.upper() == 'TRUE'
+            return value
+
+    def visit_If(self, node):
+        condition = node.condition
+        if condition in self.deep:
+            return iter(node.body if self.evaluate_iteratively(condition) else node.orelse)
+        return iter(node.body if self.visit(condition) else node.orelse)
+
+    def visit_While(self, node):
+        return self.iterate_while(node)
+
+    def iterate_while(self, node):
+        condition = node.condition
+        body = node.body
+        for slot in node.invariants:
+            self.values[slot] = UNSET
+        if node.info is not None and node.info.closed_form is not None:
+            if self.run_closed_form(node.info.closed_form):
+                return
+        if self.budget is not None:
+            yield from self.iterate_limited(node)
+            return
+        comparison = leaf_comparison(condition)
+        if comparison is not None:
+            # Compare the values directly rather than visiting three nodes
+            operation, slot, other, value = comparison
+            values = self.values
+            if other is None:
+                while operation(values[slot], value):
+                    yield from body
+            else:
+                while operation(values[slot], values[other]):
+                    yield from body
+            return
+        test = self.evaluate_iteratively if condition in self.deep else self.visit
+        while test(condition):
+            yield from body
+
+    def iterate_limited(self, node):
+        """iterate_while() for runs with ExecutionLimits, reporting the iterations to the budget"""
+        condition = node.condition
+        body = node.body
+        charge = self.budget.charge
+        steps = iteration_steps(node)
+        count = 0
+        batch = charge(0, steps, node.line)
+        comparison = leaf_comparison(condition)
+        if comparison is not None:
+            operation, slot, other, value = comparison
+            values = self.values
+            while operation(values[slot], value if other is None else values[other]):
+                count += 1
+                if count >= batch:
+                    batch = charge(count, steps, node.line)
+                    count = 0
+                yield from body
+            if count:
+                charge(count, steps, node.line)
+            return
+        test = self.evaluate_iteratively if condition in self.deep else self.visit
+        while test(condition):
+            count += 1
+            if count >= batch:
+                batch = charge(count, steps, node.line)
+                count = 0
+            yield from body
+        if count:
+            charge(count, steps, node.line)
+
+    def apply_closed_form(self, form, read):
+        """
+        form.apply(read), or None if the loop has to be run instead, which is
+        also the case when its iterations would exceed the run's limits
+        """
+        budget = self.budget
+        if budget is None:
+            return form.apply(read)
+        trips = form.trips(read)
+        if trips is None or not budget.allows(trips, form.iteration_steps):
+            return None
+        result = form.apply(read)
+        if result is not None:
+            budget.record(trips, form.iteration_steps)
+        return result
+
+    def run_closed_form(self, form) -> bool:
+        """Set the variables a loop leaves behind from its ClosedForm; False if it must be run"""
+        values = self.values
+        result = self.apply_closed_form(form, values.__getitem__)
+        if result is None:
+            return False
+        for slot, value in zip(form.targets, result):
+            values[slot] = value
+        return True
+
+    def visit_Program(self, node):
+        return iter(node.statements)
+
+    def execute_program(self, ast: Program, input_data: str = ""):
+        self.prepare(ast, input_data)
+
+        self.execute_block([ast])
+
+        return self.output_text()
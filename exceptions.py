@@ -46,4 +46,30 @@ class InvalidInputError(RuntimeError):
     """Exception raised for invalid input"""
     def __init__(self, message: str, line_number: int = None):
         super().__init__(f"Invalid input: {message}", line_number)
-        
\ No newline at end of file
+        
+class ExecutionStopped(CFPLError):
+    """Exception raised when a run is stopped by one of its execution limits or cancelled"""
+    def format_message(self):
+        if self.line_number:
+            return f"Execution stopped at line {self.line_number}: {self.message}"
+        return f"Execution stopped: {self.message}"
+
+class StepLimitExceeded(ExecutionStopped):
+    """Exception raised when a program executes more statements than allowed"""
+    def __init__(self, max_steps: int, line_number: int = None):
+        super().__init__(f"more than {max_steps} steps executed", line_number)
+
+class IterationLimitExceeded(ExecutionStopped):
+    """Exception raised when a program runs more loop iterations than allowed"""
+    def __init__(self, max_iterations: int, line_number: int = None):
+        super().__init__(f"more than {max_iterations} loop iterations", line_number)
+
+class TimeLimitExceeded(ExecutionStopped):
+    """Exception raised when a program runs longer than allowed"""
+    def __init__(self, timeout: float, line_number: int = None):
+        super().__init__(f"time limit of {timeout:g} seconds exceeded", line_number)
+
+class ExecutionCancelled(ExecutionStopped):
+    """Exception raised when the host cancels a running program"""
+    def __init__(self, line_number: int = None):
+        super().__init__("cancelled", line_number)
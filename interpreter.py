@@ -1,37 +1,299 @@
+import time
+from typing import Iterable, List
 from lexer import CFPLLexer
 from parser import CFPLParser
 from evaluator import CFPLEvaluator
+from closure_compiler import ClosureEvaluator
+from bytecode import VMEvaluator
+from transpiler import PythonEvaluator
+from type_checker import check_types
+from optimizer import optimize
+from loop_optimizer import optimize_loops
+from resolver import resolve
+from program_cache import DiskProgramCache, ProgramCache, source_key
+from output_sink import BoundedOutput, OutputSink
+from limits import ExecutionLimits, block_steps
+from exceptions import ExecutionStopped
+from profiler import Profiler, ProfilingEvaluator
+from metrics import InterpreterMetrics
+from ast_nodes import walk
+
+# Execution backends, by name
+BACKENDS = {
+    'tree': CFPLEvaluator,
+    'closure': ClosureEvaluator,
+    'vm': VMEvaluator,
+    'python': PythonEvaluator,
+}
+
+def error_message(e: Exception) -> str:
+    """The message of e followed by its notes (such as the CFPL line of a python backend error)"""
+    return ' '.join([str(e)] + [f'({note})' for note in getattr(e, '__notes__', ())])
+
+class CompiledProgram:
+    """
+    A program compiled once by CFPLInterpreter.compile(), to be run any
+    number of times. It keeps its own evaluator, so the backend's compiled
+    form (closures, bytecode or Python code) is built on the first run and
+    reused; each run only resets the variables, input and output. Runs use
+    the interpreter's current output sink, limits and metrics.
+    """
+    def __init__(self, interpreter: 'CFPLInterpreter', ast):
+        self.interpreter = interpreter
+        self.ast = ast
+        self.evaluator = BACKENDS[interpreter.backend]()
+    
+    def run(self, input_data: str = "") -> str:
+        """Execute the program with input_data and return its output, as CFPLInterpreter.run() does"""
+        interpreter = self.interpreter
+        self.evaluator.output_sink = interpreter.output_sink
+        self.evaluator.limits = interpreter.run_limits
+        status = 'error'
+        try:
+            result = interpreter.execute(self.evaluator, self.ast, input_data)
+            status = 'ok'
+            return result
+            
+        except ExecutionStopped:
+            status = 'stopped'
+            raise
+        except Exception as e:
+            raise Exception(f"Interpreter error: {error_message(e)}") from e
+        finally:
+            interpreter.metrics.runs.inc(1, status)
+            if interpreter.output_sink is not None:
+                interpreter.output_sink.flush()
+    
+    def run_batch(self, inputs: Iterable[str]) -> List[str]:
+        """The output of a run with each input in turn; the first failing run raises its error"""
+        run = self.run
+        return [run(input_data) for input_data in inputs]
+    
+    @property
+    def variables(self):
+        """Variable state after the last run"""
+        return self.evaluator.variables
 
 class CFPLInterpreter:
-    def __init__(self):
-        self.evaluator = CFPLEvaluator()
+    def __init__(self, cache_size: int = 64, cache_dir: str = None, backend: str = 'tree',
+                 output_sink: OutputSink = None, limits: ExecutionLimits = None,
+                 metrics: InterpreterMetrics = None, strict_types: bool = False,
+                 count_statements: bool = False):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}, expected one of {', '.join(BACKENDS)}")
+        self.backend = backend
+        # Whether programs are checked against their declarations before they
+        # run (see TypeChecker); off, they run exactly as they always have
+        self.strict_types = strict_types
+        # Whether runs without limits still count their statements for the
+        # metrics, at the cost of running the budgeted loops
+        self.count_statements = count_statements
+        self.evaluator = BACKENDS[backend]()
+        self.set_output_sink(output_sink)
+        self.set_limits(limits)
+        # Parsed programs outlive reset(); they hold no run state
+        self.program_cache = ProgramCache(cache_size)
+        # Optional on-disk cache shared by every process using cache_dir
+        self.disk_cache = DiskProgramCache(cache_dir) if cache_dir else None
+        # Phase timings and sizes of every run; may be shared by interpreters
+        self.metrics = metrics if metrics is not None else InterpreterMetrics()
     
-    def run(self, code: str, input_data: str = "") -> str:
+    def parse(self, code: str):
+        """
+        Lex, parse and analyze CFPL code, reusing the syntax tree of an earlier run
+        of the same source text
         """
-        Execute CFPL code and return output
+        key = source_key(code)
+        if self.strict_types:
+            # Strict programs convert INPUT differently
+            key += '-strict'
+        ast = self.program_cache.get(key)
+        if ast is not None:
+            self.metrics.cache_hits.inc()
+            return ast
+        
+        if self.disk_cache is not None:
+            ast = self.disk_cache.get(key)
+        if ast is None:
+            metrics = self.metrics
+            started = time.perf_counter()
+            tokens = CFPLLexer(code).tokenize_compact()
+            lexed = time.perf_counter()
+            program = CFPLParser(tokens).parse_program()
+            metrics.phase_seconds.observe(time.perf_counter() - lexed, 'parse')
+            metrics.phase_seconds.observe(lexed - started, 'lex')
+            metrics.tokens.observe(len(tokens))
+            ast = self.analyze(program)
+            if self.disk_cache is not None:
+                self.disk_cache.put(key, ast)
+        
+        self.program_cache.put(key, ast)
+        return ast
+    
+    def compile(self, code: str) -> CompiledProgram:
+        """
+        Lex, parse and analyze CFPL code once, for running it with many
+        inputs without doing so again
         """
         try:
-            # Tokenize
-            lexer = CFPLLexer(code)
-            tokens = lexer.tokenize()
-            
-            # Parse
-            parser = CFPLParser(tokens)
-            ast = parser.parse_program()
+            return CompiledProgram(self, self.parse(code))
+        except Exception as e:
+            raise Exception(f"Interpreter error: {error_message(e)}") from e
+    
+    def analyze(self, ast):
+        """
+        Type-check a freshly parsed program, then optimize it and give its
+        variables their slots
+        """
+        started = time.perf_counter()
+        check_types(ast, self.strict_types)
+        ast = optimize(ast)
+        resolve(ast)
+        optimize_loops(ast)
+        self.metrics.phase_seconds.observe(time.perf_counter() - started, 'analyze')
+        self.metrics.nodes.observe(sum(1 for _ in walk(ast)))
+        return ast
+    
+    def set_output_sink(self, output_sink: OutputSink = None):
+        """
+        Stream the output of later runs to output_sink as it is produced; run()
+        then returns whatever the sink keeps. None collects the whole output
+        and returns it, as by default.
+        """
+        self.output_sink = output_sink
+        self.evaluator.output_sink = output_sink
+    
+    def set_limits(self, limits: ExecutionLimits = None):
+        """
+        Stop later runs with an ExecutionStopped error once they exceed
+        limits; None lets them run to the end, as by default
+        """
+        self.limits = limits
+        self.evaluator.limits = self.run_limits
+    
+    @property
+    def run_limits(self) -> ExecutionLimits:
+        """
+        The limits evaluators run with: self.limits, or with count_statements
+        and no limits, ones that limit nothing but let loops count their
+        statements; None otherwise, so unlimited runs take the fast paths
+        """
+        if self.limits is None and self.count_statements:
+            return ExecutionLimits()
+        return self.limits
+    
+    def run(self, code: str, input_data: str = "", profiler: Profiler = None) -> str:
+        """
+        Execute CFPL code and return output; a run stopped by the execution
+        limits raises its ExecutionStopped error unchanged. With profiler,
+        the time each statement takes is recorded in it.
+        """
+        status = 'error'
+        try:
+            # Tokenize and parse, unless this source was seen recently
+            ast = self.parse(code)
             
             # Evaluate
-            result = self.evaluator.execute_program(ast, input_data)
+            if profiler is None:
+                result = self.execute(self.evaluator, ast, input_data)
+            else:
+                result = self.profile(ast, code, input_data, profiler)
             
+            status = 'ok'
             return result
             
+        except ExecutionStopped:
+            status = 'stopped'
+            raise
         except Exception as e:
-            raise Exception(f"Interpreter error: {str(e)}")
+            raise Exception(f"Interpreter error: {error_message(e)}") from e
+        finally:
+            self.metrics.runs.inc(1, status)
+            if self.output_sink is not None:
+                self.output_sink.flush()
+    
+    def execute(self, evaluator: CFPLEvaluator, ast, input_data: str) -> str:
+        """
+        Run an analyzed program with evaluator, recording its metrics. The
+        output bytes are those the run produced: all that reached a
+        BoundedOutput, or the text returned without a sink; output streamed
+        to other sinks is not measured. Statements are only estimated for
+        runs with an ExecutionBudget (see run_limits).
+        """
+        metrics = self.metrics
+        sink = evaluator.output_sink
+        started = time.perf_counter()
+        try:
+            result = evaluator.execute_program(ast, input_data)
+        finally:
+            metrics.phase_seconds.observe(time.perf_counter() - started, 'execute')
+            budget = evaluator.budget
+            if budget is not None:
+                # Code outside loops is estimated the way loops count their bodies
+                metrics.statements.observe(block_steps(ast.statements) + budget.steps)
+            if isinstance(sink, BoundedOutput):
+                metrics.output_bytes.observe(sink.byte_count)
+        if sink is None:
+            metrics.output_bytes.observe(len(result) if result.isascii() else len(result.encode('utf-8')))
+        return result
+    
+    def profile(self, ast, code: str, input_data: str, profiler: Profiler) -> str:
+        """Run ast with a ProfilingEvaluator, recording into profiler"""
+        profiler.start(code)
+        evaluator = ProfilingEvaluator(profiler)
+        evaluator.output_sink = self.output_sink
+        evaluator.limits = self.run_limits
+        try:
+            return self.execute(evaluator, ast, input_data)
+        finally:
+            # Let get_variables() show the variables of the profiled run
+            self.evaluator.names, self.evaluator.values = evaluator.names, evaluator.values
+    
+    def run_file(self, path: str, input_data: str = "") -> str:
+        """
+        Execute a CFPL source file, streaming its tokens into the parser
+        instead of reading the whole program into memory first. Lexing and
+        parsing are interleaved, so their time is recorded as the parse phase.
+        """
+        status = 'error'
+        try:
+            with open(path, 'r', encoding='utf-8') as source:
+                started = time.perf_counter()
+                lexer = CFPLLexer(source)
+                parser = CFPLParser(lexer.iter_tokens())
+                program = parser.parse_program()
+                self.metrics.phase_seconds.observe(time.perf_counter() - started, 'parse')
+                self.metrics.tokens.observe(parser.tokens.consumed)
+                ast = self.analyze(program)
+            
+            result = self.execute(self.evaluator, ast, input_data)
+            status = 'ok'
+            return result
+            
+        except ExecutionStopped:
+            status = 'stopped'
+            raise
+        except Exception as e:
+            raise Exception(f"Interpreter error: {error_message(e)}") from e
+        finally:
+            self.metrics.runs.inc(1, status)
+            if self.output_sink is not None:
+                self.output_sink.flush()
     
     def get_variables(self):
         """Get current variable state"""
-        return self.evaluator.variables.copy()
+        return self.evaluator.variables
+    
+    def cache_info(self) -> dict:
+        """Hits, misses and size of the parsed program caches"""
+        info = self.program_cache.info()
+        if self.disk_cache is not None:
+            info['disk'] = self.disk_cache.info()
+        return info
     
     def reset(self):
         """Reset interpreter state"""
-        self.evaluator = CFPLEvaluator()
+        self.evaluator = BACKENDS[self.backend]()
+        self.evaluator.output_sink = self.output_sink
+        self.evaluator.limits = self.run_limits
         
\ No newline at end of file
@@ -1,177 +1,302 @@
-from typing import List, Union
-from token_types import Token, TokenType
+import mmap
+import re
+from itertools import accumulate
+from operator import add, sub
+from typing import IO, Iterator, List, Union
+from token_types import TYPE_CODES, Token, TokenStream, TokenType
+
+KEYWORDS = {
+    'VAR': TokenType.VAR, 'AS': TokenType.AS, 'START': TokenType.START,
+    'STOP': TokenType.STOP, 'OUTPUT': TokenType.OUTPUT, 'INPUT': TokenType.INPUT,
+    'IF': TokenType.IF, 'ELSE': TokenType.ELSE, 'WHILE': TokenType.WHILE,
+    'AND': TokenType.AND, 'OR': TokenType.OR, 'NOT': TokenType.NOT,
+    'INT': TokenType.INT, 'CHAR': TokenType.CHAR, 'BOOL': TokenType.BOOL,
+    'FLOAT': TokenType.FLOAT, 'TRUE': TokenType.BOOLEAN, 'FALSE': TokenType.BOOLEAN
+}
+
+OPERATORS = {
+    '>=': TokenType.GTE, '<=': TokenType.LTE, '==': TokenType.EQ, '<>': TokenType.NEQ,
+    '=': TokenType.ASSIGN, '+': TokenType.PLUS, '-': TokenType.MINUS,
+    '*': TokenType.MULTIPLY, '/': TokenType.DIVIDE, '%': TokenType.MODULO,
+    '>': TokenType.GT, '<': TokenType.LT, '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN, '[': TokenType.LSQUARE, ']': TokenType.RSQUARE,
+    ',': TokenType.COMMA, '&': TokenType.AMPERSAND, ':': TokenType.COLON,
+    '#': TokenType.HASH
+}
+
+# Every lexeme is one match: blanks are folded into the match in front of
+# it, and any character no other alternative accepts matches on its own so
+# that tokenize() can report it.
+TOKEN_PATTERN = re.compile(r'''
+    [ \t\r]*
+    (?:
+        [^\W\d]\w*            # identifier or keyword
+      | \d+(?:\.\d*)?         # number
+      | [<>=]=|<>             # two-character operators
+      | \*\*[^\n\0]*          # comment
+      | "[^"\n\0]*"           # string literal
+      | '[^'\n\0]*'           # character literal
+      | [^ \t\r]              # newline, single character token or error
+    )
+''', re.VERBOSE)
+
+NEWLINE_PATTERN = re.compile('\n')
+
+# Upper bound on distinct lexemes remembered while scanning, so that
+# streaming a huge source does not grow the lexeme cache without limit.
+CLASSIFY_CACHE_SIZE = 65536
+
 
 class CFPLLexer:
-    def __init__(self, text: str):
+    def __init__(self, text: Union[str, IO, mmap.mmap], encoding: str = 'utf-8'):
         self.text = text
+        self.encoding = encoding
         self.pos = 0
         self.current_line = 1
         self.tokens = []
-        
+
     def error(self, message: str):
         raise Exception(f"Lexical error at line {self.current_line}: {message}")
+
+    def classify(self, lexeme: str):
+        """Return the (type, value) pair for one lexeme (blanks stripped)"""
+        token_type = OPERATORS.get(lexeme)
+        if token_type is not None:
+            return token_type, lexeme
+
+        if lexeme == '\n':
+            return TokenType.NEWLINE, '\\n'
+
+        first = lexeme[0]
+
+        # Identifiers and keywords
+        if first == '_' or first.isalpha():
+            token_type = KEYWORDS.get(lexeme.upper(), TokenType.IDENTIFIER)
+            if token_type == TokenType.BOOLEAN:
+                return token_type, lexeme.upper() == 'TRUE'
+            return token_type, lexeme
+
+        # Numbers
+        if first.isdigit():
+            if '.' in lexeme:
+                return TokenType.FLOAT_NUM, float(lexeme)
+            return TokenType.INTEGER, int(lexeme)
+
+        # Strings and characters (a lone quote never found its closing one)
+        if first == '"' or first == "'":
+            if len(lexeme) == 1:
+                self.error("Unterminated string literal")
+            value = lexeme[1:-1]
+            if first == '"':
+                return TokenType.STRING, value
+            if len(value) != 1:
+                self.error(f"Character literal must be exactly one character, got: '{value}'")
+            return TokenType.CHARACTER, value
+
+        # Comments: Only treat ** as comment start
+        if lexeme.startswith('**'):
+            return TokenType.COMMENT, lexeme[2:]
+
+        self.error(f"Unexpected character: '{lexeme}'")
+
+    def read_lines(self) -> Iterator[str]:
+        """Read a file object or mmap source one line at a time"""
+        readline = self.text.readline
+        while True:
+            line = readline()
+            if not line:
+                return
+            if isinstance(line, bytes):
+                line = line.decode(self.encoding)
+            yield line
+
+    def tokenize(self) -> List[Token]:
+        """
+        Lex the whole source into a list of Token objects. Large programs
+        are better lexed with tokenize_compact(), which allocates no object
+        per token.
+        """
+        self.tokens.extend(self.iter_tokens())
+        return self.tokens
+
+    def tokenize_compact(self) -> TokenStream:
+        """Lex the whole source into an array-backed TokenStream"""
+        stream = TokenStream()
+        if isinstance(self.text, str):
+            column = self.extend_all(stream, self.text[self.pos:])
+        else:
+            column = stream.extend(self.scan(), self.current_line)
+        stream.append(TokenType.EOF, None, self.current_line, column)
+        return stream
+
+    def extend_all(self, stream: TokenStream, text: str) -> int:
+        """
+        Append the tokens of text to stream. All of text is matched at once
+        and each distinct match classified once; the type codes, values,
+        lines and columns of the matches are then computed with map() and
+        accumulate() rather than token by token. Returns the column just
+        past the last lexeme.
+        """
+        # A NUL character ends the source
+        end = text.find('\0')
+        if end >= 0:
+            text = text[:end]
+        matches = TOKEN_PATTERN.findall(text)
+
+        # Match (leading blanks included) -> type code, value id, leading
+        # blanks, width and whether it is a newline (0 or 1)
+        codes, value_ids, blanks, widths, newlines = {}, {}, {}, {}, {}
+        first_line = self.current_line
+        for match in dict.fromkeys(matches):
+            lexeme = match.lstrip(' \t\r')
+            try:
+                pair = self.classify(lexeme)
+            except Exception:
+                # Report the line the bad lexeme first appears on
+                self.current_line = first_line + sum(
+                    earlier.lstrip(' \t\r') == '\n' for earlier in matches[:matches.index(match)])
+                self.classify(lexeme)
+            codes[match] = TYPE_CODES[pair[0]]
+            value_ids[match] = stream.intern(pair)
+            blanks[match] = len(match) - len(lexeme)
+            widths[match] = len(match)
+            newlines[match] = pair[0] is TokenType.NEWLINE
+
+        stream.types.frombytes(bytes(map(codes.__getitem__, matches)))
+        stream.value_ids.fromlist(list(map(value_ids.__getitem__, matches)))
+        # Line of each match, and of the end of the source
+        lines = list(accumulate(map(newlines.__getitem__, matches), initial=first_line))
+        stream.lines.fromlist(lines[:-1])
+        # Offset before the start of each line, by line number
+        bases = [0] * first_line + [-1] + [newline.end() - 1 for newline in NEWLINE_PATTERN.finditer(text)]
+        # Column of each match's lexeme: its offset in text, past its blanks,
+        # less the offset before its line
+        starts = map(add, accumulate(map(widths.__getitem__, matches), initial=0), map(blanks.__getitem__, matches))
+        stream.columns.fromlist(list(map(sub, starts, map(bases.__getitem__, lines[:-1]))))
+        end_column = 0
+        if matches:
+            end_column = stream.columns[-1] + len(matches[-1]) - blanks[matches[-1]]
+            end_column -= bases[lines[-1]] - bases[lines[-2]]
+        else:
+            end_column -= bases[first_line]
+
+        self.current_line = lines[-1]
+        self.pos = len(self.text)
+        return end_column
+
+    def iter_tokens(self) -> Iterator[Token]:
+        """
+        Yield tokens one at a time instead of collecting them.
+        No lexeme spans a line, so file objects and mmaps are consumed
+        lazily, a line at a time.
+        """
+        newline = TokenType.NEWLINE
+        line = self.current_line
+        column = 1
+        for (token_type, value), blanks, width in self.scan():
+            yield Token(token_type, value, line, column + blanks)
+            if token_type is newline:
+                line += 1
+                column = 1
+            else:
+                column += width
+        yield Token(TokenType.EOF, None, line, column)
+
+    def scan(self) -> Iterator[tuple]:
+        """
+        Yield ((type, value), leading blanks, width) per lexeme, where width
+        also counts the blanks; line and column numbering is left to the
+        caller. Entries are shared between equal matches.
+        """
+        if isinstance(self.text, str):
+            chunks = (self.text[self.pos:],)
+        else:
+            chunks = self.read_lines()
+
+        newline = TokenType.NEWLINE
+        # Generated sources repeat the same lexemes over and over, so each
+        # distinct lexeme is classified once and looked up afterwards.
+        seen = {}
+
+        for chunk in chunks:
+            # A NUL character ends the source
+            end = chunk.find('\0')
+            for match in TOKEN_PATTERN.findall(chunk, 0, len(chunk) if end < 0 else end):
+                entry = seen.get(match)
+                if entry is None:
+                    if len(seen) >= CLASSIFY_CACHE_SIZE:
+                        seen.clear()
+                    lexeme = match.lstrip(' \t\r')
+                    entry = seen[match] = (self.classify(lexeme), len(match) - len(lexeme), len(match))
+                yield entry
+                if entry[0][0] is newline:
+                    self.current_line += 1
+            if end >= 0:
+                break
+
+        if isinstance(self.text, str):
+            self.pos = len(self.text)
+
+
+class IncrementalLexer:
+    """
+    Keeps the lexed tokens of every source line so that an edit only
+    re-lexes the lines it touched. Strings, characters and comments all end
+    at the end of their line, so each line lexes independently.
+    """
+    def __init__(self, text: str = ''):
+        self.lines = []
+        self.lexed = []
+        self.set_text(text)
     
-    def peek(self, offset: int = 0) -> str:
-        pos = self.pos + offset
-        if pos >= len(self.text):
-            return '\0'
-        return self.text[pos]
-    
-    def advance(self) -> str:
-        if self.pos < len(self.text):
-            char = self.text[self.pos]
-            self.pos += 1
-            if char == '\n':
-                self.current_line += 1
-            return char
-        return '\0'
+    def lex_line(self, text: str):
+        """Return (entries, error, ends_source, end_column) for one line of source"""
+        lexer = CFPLLexer(text)
+        try:
+            entries = [(token.type, token.value, token.column) for token in lexer.iter_tokens()]
+        except Exception as e:
+            # Drop the "Lexical error at line N" prefix; lines move with edits
+            return [], str(e).partition(': ')[2], False, 1
+        end_column = entries.pop()[2]  # EOF
+        return entries, None, '\0' in text, end_column
     
-    def skip_whitespace(self):
-        while self.peek() in ' \t\r':
-            self.advance()
+    def set_text(self, text: str):
+        self.lines = text.split('\n')
+        self.lexed = [self.lex_line(line) for line in self.lines]
     
-    def read_string(self, quote_char: str) -> str:
-        value = ''
-        self.advance()  # Skip opening quote
-        
-        while self.peek() != quote_char and self.peek() != '\0':
-            if self.peek() == '\n':
-                self.error("Unterminated string literal")
-            value += self.advance()
-        
-        if self.peek() == '\0':
-            self.error("Unterminated string literal")
-        
-        self.advance()  # Skip closing quote
-        return value
+    def replace_lines(self, start: int, end: int, new_lines: List[str]) -> range:
+        """
+        Replace lines start..end-1 (0-based, end exclusive) with new_lines and
+        re-lex only those; returns the indices of the re-lexed lines
+        """
+        self.lines[start:end] = new_lines
+        self.lexed[start:end] = [self.lex_line(line) for line in new_lines]
+        return range(start, start + len(new_lines))
     
-    def read_number(self) -> Union[int, float]:
-        value = ''
-        has_dot = False
-        
-        while self.peek().isdigit() or self.peek() == '.':
-            if self.peek() == '.':
-                if has_dot:
-                    break
-                has_dot = True
-            value += self.advance()
-        
-        return float(value) if has_dot else int(value)
+    def line_tokens(self, index: int) -> List[Token]:
+        entries = self.lexed[index][0]
+        return [Token(token_type, value, index + 1, column) for token_type, value, column in entries]
     
-    def read_identifier(self) -> str:
-        value = ''
-        while self.peek().isalnum() or self.peek() == '_':
-            value += self.advance()
-        return value
+    def line_error(self, index: int):
+        return self.lexed[index][1]
     
-    def read_comment(self) -> str:
-        comment = ''
-        while self.peek() != '\n' and self.peek() != '\0':
-            comment += self.advance()
-        return comment
+    def errors(self) -> List[tuple]:
+        return [(number, lexed[1]) for number, lexed in enumerate(self.lexed, 1) if lexed[1]]
     
     def tokenize(self) -> List[Token]:
-        keywords = {
-            'VAR': TokenType.VAR, 'AS': TokenType.AS, 'START': TokenType.START,
-            'STOP': TokenType.STOP, 'OUTPUT': TokenType.OUTPUT, 'INPUT': TokenType.INPUT,
-            'IF': TokenType.IF, 'ELSE': TokenType.ELSE, 'WHILE': TokenType.WHILE,
-            'AND': TokenType.AND, 'OR': TokenType.OR, 'NOT': TokenType.NOT,
-            'INT': TokenType.INT, 'CHAR': TokenType.CHAR, 'BOOL': TokenType.BOOL,
-            'FLOAT': TokenType.FLOAT, 'TRUE': TokenType.BOOLEAN, 'FALSE': TokenType.BOOLEAN
-        }
-        
-        while self.pos < len(self.text):
-            self.skip_whitespace()
-            
-            if self.peek() == '\0':
+        """Assemble the token stream CFPLLexer would produce for the whole text"""
+        tokens = []
+        last = len(self.lexed)
+        number = 1
+        end_column = 1
+        for number, (entries, error, ends_source, end_column) in enumerate(self.lexed, 1):
+            if error:
+                raise Exception(f"Lexical error at line {number}: {error}")
+            tokens.extend(Token(token_type, value, number, column)
+                          for token_type, value, column in entries)
+            if ends_source:
                 break
-            
-            # Comments: Only treat ** as comment start
-            if self.peek() == '*' and self.peek(1) == '*':
-                self.advance()  # Skip first *
-                self.advance()  # Skip second *
-                comment = self.read_comment()
-                self.tokens.append(Token(TokenType.COMMENT, comment, self.current_line))
-                continue
-            
-            # Newlines
-            if self.peek() == '\n':
-                self.advance()
-                self.tokens.append(Token(TokenType.NEWLINE, '\\n', self.current_line - 1))
-                continue
-            
-            # Strings
-            if self.peek() == '"':
-                string_val = self.read_string('"')
-                self.tokens.append(Token(TokenType.STRING, string_val, self.current_line))
-                continue
-            
-            # Characters
-            if self.peek() == "'":
-                char_val = self.read_string("'")
-                if len(char_val) != 1:
-                    self.error(f"Character literal must be exactly one character, got: '{char_val}'")
-                self.tokens.append(Token(TokenType.CHARACTER, char_val, self.current_line))
-                continue
-            
-            # Numbers
-            if self.peek().isdigit():
-                num = self.read_number()
-                token_type = TokenType.FLOAT_NUM if isinstance(num, float) else TokenType.INTEGER
-                self.tokens.append(Token(token_type, num, self.current_line))
-                continue
-            
-            # Multi-character operators
-            if self.peek() == '>' and self.peek(1) == '=':
-                self.advance()
-                self.advance()
-                self.tokens.append(Token(TokenType.GTE, '>=', self.current_line))
-                continue
-            
-            if self.peek() == '<' and self.peek(1) == '=':
-                self.advance()
-                self.advance()
-                self.tokens.append(Token(TokenType.LTE, '<=', self.current_line))
-                continue
-            
-            if self.peek() == '=' and self.peek(1) == '=':
-                self.advance()
-                self.advance()
-                self.tokens.append(Token(TokenType.EQ, '==', self.current_line))
-                continue
-            
-            if self.peek() == '<' and self.peek(1) == '>':
-                self.advance()
-                self.advance()
-                self.tokens.append(Token(TokenType.NEQ, '<>', self.current_line))
-                continue
-            
-            # Single character tokens
-            single_chars = {
-                '=': TokenType.ASSIGN, '+': TokenType.PLUS, '-': TokenType.MINUS,
-                '*': TokenType.MULTIPLY, '/': TokenType.DIVIDE, '%': TokenType.MODULO,
-                '>': TokenType.GT, '<': TokenType.LT, '(': TokenType.LPAREN,
-                ')': TokenType.RPAREN, '[': TokenType.LSQUARE, ']': TokenType.RSQUARE,
-                ',': TokenType.COMMA, '&': TokenType.AMPERSAND, ':': TokenType.COLON,
-                '#': TokenType.HASH
-            }
-            
-            if self.peek() in single_chars:
-                char = self.advance()
-                self.tokens.append(Token(single_chars[char], char, self.current_line))
-                continue
-            
-            # Identifiers and keywords
-            if self.peek().isalpha() or self.peek() == '_':
-                identifier = self.read_identifier()
-                token_type = keywords.get(identifier.upper(), TokenType.IDENTIFIER)
-                value = identifier.upper() == 'TRUE' or identifier.upper() == 'FALSE' if token_type == TokenType.BOOLEAN else identifier
-                self.tokens.append(Token(token_type, value, self.current_line))
-                continue
-            
-            # Unknown character
-            self.error(f"Unexpected character: '{self.peek()}'")
-        
-        self.tokens.append(Token(TokenType.EOF, None, self.current_line))
-        return self.tokens
-      
\ No newline at end of file
+            if number < last:
+                tokens.append(Token(TokenType.NEWLINE, '\\n', number, len(self.lines[number - 1]) + 1))
+        tokens.append(Token(TokenType.EOF, None, number, end_column))
+        return tokens
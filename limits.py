@@ -0,0 +1,152 @@
+import time
+from typing import Callable, List
+from ast_nodes import If, Node, While
+from exceptions import (ExecutionCancelled, IterationLimitExceeded, StepLimitExceeded,
+                        TimeLimitExceeded)
+
+# The clock, checkpoint and cancellation token are looked at once this many
+# loop iterations (of all loops together) have run since the last time;
+# loops report to the run's ExecutionBudget at least that often
+CHECK_INTERVAL = 1000
+
+class CancellationToken:
+    """
+    Stops the runs whose ExecutionLimits hold it once cancel() is called,
+    from any thread, at their next limit check
+    """
+    __slots__ = ('cancelled',)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def reset(self):
+        """Allow runs again after a cancel()"""
+        self.cancelled = False
+
+class ExecutionLimits:
+    """
+    Limits on each run of a program; None leaves a limit off.
+      - max_steps: statements executed by loops, where each iteration
+        counts one step for testing the condition plus the statements of
+        the body (the longer arm of an IF; a nested loop counts its own
+        iterations). Code outside loops always finishes and is not counted.
+      - max_iterations: iterations of all loops together
+      - timeout: seconds of wall-clock time
+      - cancellation: a CancellationToken the host can trip
+      - checkpoint: called with no arguments at every limit check, before
+        the token is looked at; a host whose event loop runs on the same
+        thread as the program (such as Eel's) can let it handle a
+        cancellation there
+    A loop that would exceed max_steps or max_iterations stops before the
+    iteration that would do so. Nested loops are checked when the inner
+    loop ends, so they may run a little past the limits first, and the
+    time, the checkpoint and the token are looked at every CHECK_INTERVAL
+    iterations of all loops together.
+    """
+    __slots__ = ('max_steps', 'max_iterations', 'timeout', 'cancellation', 'checkpoint')
+
+    def __init__(self, max_steps: int = None, max_iterations: int = None, timeout: float = None,
+                 cancellation: CancellationToken = None, checkpoint: Callable[[], None] = None):
+        self.max_steps = max_steps
+        self.max_iterations = max_iterations
+        self.timeout = timeout
+        self.cancellation = cancellation
+        self.checkpoint = checkpoint
+
+class ExecutionBudget:
+    """
+    The steps, iterations and time one run has used, against its
+    ExecutionLimits. Loops report to it when they start, every so often
+    while they run and when they end; the step and iteration limits are
+    checked at every report, but the clock, the checkpoint and the
+    cancellation token only once CHECK_INTERVAL iterations of any loops
+    have gone by since they were last looked at, so short loops entered
+    over and over cost no more than one long loop.
+    """
+    __slots__ = ('limits', 'steps', 'iterations', 'unchecked', 'deadline')
+
+    def __init__(self, limits: ExecutionLimits):
+        self.limits = limits
+        self.steps = 0
+        self.iterations = 0
+        # Iterations since the clock, checkpoint and token were looked at
+        self.unchecked = 0
+        self.deadline = time.monotonic() + limits.timeout if limits.timeout is not None else None
+
+    def charge(self, iterations: int, steps: int, line: int) -> int:
+        """
+        Record iterations more iterations of a loop taking steps steps each,
+        raising ExecutionStopped if a limit is exceeded; returns after how
+        many further iterations the loop has to report again
+        """
+        limits = self.limits
+        self.iterations += iterations
+        self.steps += iterations * steps
+        if limits.max_iterations is not None and self.iterations > limits.max_iterations:
+            raise IterationLimitExceeded(limits.max_iterations, line)
+        if limits.max_steps is not None and self.steps > limits.max_steps:
+            raise StepLimitExceeded(limits.max_steps, line)
+        self.unchecked += iterations
+        if self.unchecked >= CHECK_INTERVAL:
+            self.unchecked = 0
+            self.check(line)
+
+        # Report again no later than the iteration that would exceed a
+        # limit or that is due to be checked
+        batch = CHECK_INTERVAL - self.unchecked
+        if limits.max_iterations is not None:
+            batch = min(batch, limits.max_iterations - self.iterations + 1)
+        if limits.max_steps is not None and steps:
+            batch = min(batch, (limits.max_steps - self.steps) // steps + 1)
+        return batch
+
+    def check(self, line: int):
+        """Raise ExecutionStopped if the time is up or the run was cancelled, after the checkpoint"""
+        limits = self.limits
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise TimeLimitExceeded(limits.timeout, line)
+        if limits.checkpoint is not None:
+            limits.checkpoint()
+        if limits.cancellation is not None and limits.cancellation.cancelled:
+            raise ExecutionCancelled(line)
+
+    def allows(self, iterations: int, steps: int) -> bool:
+        """Whether iterations more iterations of steps steps each stay within the limits"""
+        limits = self.limits
+        if limits.max_iterations is not None and self.iterations + iterations > limits.max_iterations:
+            return False
+        return limits.max_steps is None or self.steps + iterations * steps <= limits.max_steps
+
+    def record(self, iterations: int, steps: int):
+        """Add iterations that allows() accepted, without checking the limits again"""
+        self.iterations += iterations
+        self.steps += iterations * steps
+        self.unchecked += iterations
+
+def block_steps(statements: List[Node]) -> int:
+    """
+    Steps one run of a block counts: one per statement, plus the steps of
+    the longer arm of each IF. IFs may nest deeply, so their arms are
+    added up with an explicit stack.
+    """
+    arm_steps = {}
+    pending = [(statement, False) for statement in statements if isinstance(statement, If)]
+    while pending:
+        statement, arms_done = pending.pop()
+        if arms_done:
+            arm_steps[statement] = max(sum(1 + arm_steps.get(child, 0) for child in arm)
+                                       for arm in (statement.body, statement.orelse))
+        else:
+            pending.append((statement, True))
+            pending.extend((child, False) for child in statement.body + statement.orelse
+                           if isinstance(child, If))
+    return sum(1 + arm_steps.get(statement, 0) for statement in statements)
+
+def iteration_steps(loop: While) -> int:
+    """Steps one iteration of loop counts: the condition test plus its body"""
+    if loop.info is not None:
+        return loop.info.steps
+    return 1 + block_steps(loop.body)
@@ -0,0 +1,287 @@
+from typing import Any, Dict, List, Optional, Tuple
+from ast_nodes import (Assign, BinaryOp, Chain, ChainAssign, If, Input, Invariant, Literal, Node,
+                       Output, Program, Text, UnaryOp, Var, While)
+from closed_form import ClosedForm, find_closed_form
+from limits import block_steps
+from resolver import resolve
+from type_checker import binary_type
+
+# Comparisons that can bound a counting loop
+COUNTER_COMPARISONS = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '<>': '<>'}
+
+class LoopInfo:
+    """
+    What the loop optimizer found out about a WHILE loop:
+      - assigned: the slots of the variables that the loop (including any
+        nested loop) may assign
+      - inductions: slot -> step of each induction variable, a variable
+        whose only assignment in the loop is a statement of the loop body
+        of the form `i = i + step` or `i = i - step`, with a numeric literal
+        step
+      - counter: (slot, op, bound) when the loop condition compares an
+        induction variable with an expression that does not change while
+        the loop runs, written as `i op bound`; otherwise None
+      - closed_form: the ClosedForm computing the loop's result without
+        iterating, when the loop only counts and accumulates; otherwise None
+      - steps: the steps each iteration counts against ExecutionLimits
+    """
+    __slots__ = ('assigned', 'inductions', 'counter', 'closed_form', 'steps')
+
+    def __init__(self, assigned: frozenset, inductions: Dict[int, Any] = None,
+                 counter: Optional[Tuple[int, str, Node]] = None,
+                 closed_form: Optional[ClosedForm] = None, steps: int = 1):
+        self.assigned = assigned
+        self.inductions = inductions if inductions is not None else {}
+        self.counter = counter
+        self.closed_form = closed_form
+        self.steps = steps
+
+    def __repr__(self):
+        return (f'LoopInfo({sorted(self.assigned)!r}, {self.inductions!r}, '
+                f'{self.counter!r}, {self.closed_form!r}, {self.steps!r})')
+
+def optimize_loops(program: Program) -> Program:
+    """
+    Analyze every WHILE loop of a program and move the computation of
+    loop-invariant expressions out of it. An operation whose variables are
+    not assigned anywhere in an enclosing loop is wrapped in an Invariant
+    node, which evaluates it once per start of the outermost such loop
+    instead of on every iteration. The value is only computed when the
+    expression is first reached, so an expression that would fail still
+    fails at the same point, with the same line. Each loop also gets a
+    LoopInfo describing its assignments and induction variables, and the
+    closed form of its result when it has one. The program is changed in
+    place and returned.
+    """
+    if program.names is None:
+        resolve(program)
+
+    loops = analyze_loops(program)
+    if not loops:
+        return program
+
+    # Walk the statements with the stack of loops enclosing each one
+    pending = [(statement, ()) for statement in reversed(program.statements)]
+    while pending:
+        statement, enclosing = pending.pop()
+        if isinstance(statement, While):
+            inner = enclosing + (statement,)
+            statement.condition = hoist_invariants(program, statement.condition, inner)
+            pending.extend((child, inner) for child in reversed(statement.body))
+            find_counter(statement)
+        elif not enclosing:
+            if isinstance(statement, If):
+                pending.extend((child, ()) for child in reversed(statement.orelse))
+                pending.extend((child, ()) for child in reversed(statement.body))
+        elif isinstance(statement, If):
+            statement.condition = hoist_invariants(program, statement.condition, enclosing)
+            pending.extend((child, enclosing) for child in reversed(statement.orelse))
+            pending.extend((child, enclosing) for child in reversed(statement.body))
+        elif isinstance(statement, (Assign, ChainAssign)):
+            statement.value = hoist_invariants(program, statement.value, enclosing)
+        elif isinstance(statement, Output):
+            statement.parts = [part if isinstance(part, Text)
+                               else hoist_invariants(program, part, enclosing)
+                               for part in statement.parts]
+
+    for loop in loops:
+        loop.info.closed_form = find_closed_form(loop)
+    return program
+
+def assigned_slots(statement: Node) -> List[int]:
+    """Slots of the declared variables a simple statement assigns"""
+    if isinstance(statement, Assign):
+        return [statement.slot] if statement.slot is not None else []
+    if isinstance(statement, (ChainAssign, Input)):
+        return [slot for slot in statement.slots if slot is not None]
+    return []
+
+def analyze_loops(program: Program) -> List[While]:
+    """
+    Give every WHILE loop its LoopInfo (without counter, which needs the
+    hoisted condition) and return the loops, each before those nested in it
+    """
+    loops = []
+    parents = {}
+    counts = {}
+    pending = [(statement, None) for statement in reversed(program.statements)]
+    while pending:
+        statement, loop = pending.pop()
+        if isinstance(statement, While):
+            loops.append(statement)
+            parents[statement] = loop
+            counts[statement] = {}
+            pending.extend((child, statement) for child in reversed(statement.body))
+        elif isinstance(statement, If):
+            pending.extend((child, loop) for child in reversed(statement.orelse))
+            pending.extend((child, loop) for child in reversed(statement.body))
+        elif loop is not None:
+            loop_counts = counts[loop]
+            for slot in assigned_slots(statement):
+                loop_counts[slot] = loop_counts.get(slot, 0) + 1
+
+    # Inner loops come after their parents; add their assignments to the
+    # enclosing loop once they are complete
+    for loop in reversed(loops):
+        parent = parents[loop]
+        if parent is not None:
+            parent_counts = counts[parent]
+            for slot, count in counts[loop].items():
+                parent_counts[slot] = parent_counts.get(slot, 0) + count
+
+    for loop in loops:
+        loop_counts = counts[loop]
+        inductions = {}
+        for statement in loop.body:
+            step = induction_step(statement)
+            if step is not None and loop_counts[statement.slot] == 1:
+                inductions[statement.slot] = step
+        loop.info = LoopInfo(frozenset(loop_counts), inductions, steps=1 + block_steps(loop.body))
+    return loops
+
+def induction_step(statement: Node):
+    """The step of `i = i + step`, `i = step + i` or `i = i - step`, or None"""
+    if not isinstance(statement, Assign) or statement.slot is None:
+        return None
+    value = statement.value
+    if not isinstance(value, BinaryOp) or value.op not in ('+', '-'):
+        return None
+    left, right = value.left, value.right
+    if value.op == '+' and isinstance(left, Literal):
+        left, right = right, left
+    if not isinstance(left, Var) or left.slot != statement.slot or not isinstance(right, Literal):
+        return None
+    step = right.value
+    if isinstance(step, bool) or not isinstance(step, (int, float)):
+        return None
+    return -step if value.op == '-' else step
+
+def find_counter(loop: While):
+    """Record in loop.info the induction variable its condition compares with a bound"""
+    condition = loop.condition
+    info = loop.info
+    if not isinstance(condition, BinaryOp) or condition.op not in COUNTER_COMPARISONS:
+        return
+    op, variable, bound = condition.op, condition.left, condition.right
+    if not (isinstance(variable, Var) and variable.slot in info.inductions):
+        op, variable, bound = COUNTER_COMPARISONS[op], bound, variable
+    if not (isinstance(variable, Var) and variable.slot in info.inductions):
+        return
+    if isinstance(bound, Literal) or isinstance(bound, Invariant) or (
+            isinstance(bound, Var) and bound.slot is not None and bound.slot not in info.assigned):
+        info.counter = (variable.slot, op, bound)
+
+def hoist_invariants(program: Program, expr: Node, loops: Tuple[While, ...]) -> Node:
+    """
+    Wrap the largest loop-invariant operations of expr, which runs inside
+    loops (outermost first), in Invariant nodes cleared by the outermost
+    loop they do not change in
+    """
+    # Post-order over (node, level) pairs, where level is the index of the
+    # outermost loop the node does not change in: len(loops) if it changes
+    # in the innermost loop, -1 for literals
+    results = []
+    pending = [(expr, False)]
+    while pending:
+        node, children_done = pending.pop()
+        if isinstance(node, Literal):
+            results.append((node, -1))
+        elif isinstance(node, Var):
+            results.append((node, variable_level(node.slot, loops)))
+        elif not children_done:
+            pending.append((node, True))
+            pending.extend((child, False) for child in reversed(operands(node)))
+        else:
+            count = len(operands(node))
+            children = results[len(results) - count:]
+            del results[len(results) - count:]
+            results.append(hoist_operands(program, node, children, loops))
+
+    expr, level = results.pop()
+    if 0 <= level < len(loops):
+        return wrap_invariant(program, expr, level, loops)
+    return expr
+
+def hoist_operands(program: Program, node: Node, children: List[Tuple[Node, int]],
+                   loops: Tuple[While, ...]) -> Tuple[Node, int]:
+    """Wrap the operands of node that change in fewer loops than node itself"""
+    level = max(child_level for _, child_level in children)
+    if isinstance(node, Chain):
+        node, children = split_invariant_prefix(program, node, children, level, loops)
+    set_operands(node, [wrap_invariant(program, child, child_level, loops)
+                        if 0 <= child_level < level else child
+                        for child, child_level in children])
+    return node, level
+
+def split_invariant_prefix(program: Program, node: Chain, children: List[Tuple[Node, int]],
+                           level: int, loops: Tuple[While, ...]) -> Tuple[Node, List[Tuple[Node, int]]]:
+    """
+    A chain is evaluated left to right, so the operations on its leading
+    operands form a subexpression of their own; split it off when those
+    operands change in fewer loops than the rest
+    """
+    prefix_level = children[0][1]
+    prefix = 1
+    while prefix < len(children) and max(prefix_level, children[prefix][1]) < level:
+        prefix_level = max(prefix_level, children[prefix][1])
+        prefix += 1
+    if prefix < 2 or prefix_level < 0:
+        return node, children
+
+    group = [child for child, _ in children[:prefix]]
+    if prefix == 2:
+        first = BinaryOp(node.ops[0], group[0], group[1], node.line, node.column)
+    else:
+        first = Chain(group, node.ops[:prefix - 1], node.line, node.column)
+    first.type = group[0].type
+    try:
+        for op, operand in zip(node.ops[:prefix - 1], group[1:]):
+            first.type = binary_type(op, first.type, operand.type)
+    except ValueError:
+        # Only programs not checked strictly get here; the prefix fails at run time
+        first.type = None
+    first, _ = hoist_operands(program, first, children[:prefix], loops)
+    ops = node.ops[prefix - 1:]
+    children = [(first, prefix_level)] + children[prefix:]
+    if len(children) == 2:
+        binary = BinaryOp(ops[0], None, None, node.line, node.column)
+        binary.type = node.type
+        return binary, children
+    node.ops = ops
+    return node, children
+
+def variable_level(slot: Optional[int], loops: Tuple[While, ...]) -> int:
+    if slot is None:
+        return len(loops)
+    # Inner loops assign a subset of what their enclosing loops assign
+    for index in range(len(loops) - 1, -1, -1):
+        if slot in loops[index].info.assigned:
+            return index + 1
+    return 0
+
+def operands(node: Node) -> List[Node]:
+    if isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    if isinstance(node, Chain):
+        return node.operands
+    if isinstance(node, UnaryOp):
+        return [node.operand]
+    raise Exception(f"Cannot optimize node: {node!r}")
+
+def set_operands(node: Node, children: List[Node]):
+    if isinstance(node, BinaryOp):
+        node.left, node.right = children
+    elif isinstance(node, Chain):
+        node.operands = children
+    else:
+        node.operand, = children
+
+def wrap_invariant(program: Program, expr: Node, level: int, loops: Tuple[While, ...]) -> Node:
+    if isinstance(expr, (Literal, Var)):
+        return expr
+    slot = len(program.names) + program.temporaries
+    program.temporaries += 1
+    loops[level].invariants.append(slot)
+    invariant = Invariant(expr, slot, expr.line, expr.column)
+    invariant.type = expr.type
+    return invariant
@@ -1,20 +1,134 @@
 import eel
+from config import WEB_EXECUTION_LIMITS, WEB_OUTPUT_LIMITS
 from interpreter import CFPLInterpreter
+from limits import CancellationToken, ExecutionLimits
+from lexer import IncrementalLexer
+from output_sink import BatchSink, BoundedOutput
+from profiler import Profiler
 
 # Initialize Eel
 eel.init('web')
 
-# Create interpreter instance
-interpreter = CFPLInterpreter()
+# Lets the page stop a program that is still running
+cancellation = CancellationToken()
+
+# Programs run on Eel's event loop; yielding to it at every limit check
+# lets a cancel_run() call from the page be handled while one is running
+interpreter = CFPLInterpreter(limits=ExecutionLimits(cancellation=cancellation, checkpoint=lambda: eel.sleep(0),
+                                                     **WEB_EXECUTION_LIMITS))
+
+# Tokens of the code currently in the editor, kept up to date line by line
+editor_lexer = IncrementalLexer()
+
+def push_output(text):
+    """Send a batch of output lines to the page while the program keeps running"""
+    eel.append_output(text)
+    # Let Eel deliver it now rather than once the run is over
+    eel.sleep(0)
+
+# Streamed runs send their output to the page in batches as it is produced
+stream_sink = BatchSink(push_output)
+
+# Output of the last run, of which the page gets the head and tail
+web_output = BoundedOutput(**WEB_OUTPUT_LIMITS)
+
+# Whether a program is running. Runs yield to Eel's event loop, so another
+# request (from a second window, say) could otherwise start a run on the
+# same interpreter and output while one is still going
+running = False
+
+def busy():
+    """The reply to a request that has to wait until no program is running"""
+    return {"success": False, "error": "A program is already running; stop it or wait for it to end"}
 
 @eel.expose
-def run_cfpl_code(code, input_data=""):
-    """Execute CFPL code and return output"""
+def run_cfpl_code(code, input_data="", stream=False):
+    """
+    Execute CFPL code and return output; with stream, the head of the output
+    is pushed to the page as it is produced. When the output is longer than
+    the page is sent, truncation says what get_output_lines() can fetch.
+    """
+    global running
+    if running:
+        return busy()
+    running = True
+    web_output.forward = stream_sink if stream else None
+    interpreter.set_output_sink(web_output)
+    cancellation.reset()
     try:
         result = interpreter.run(code, input_data)
-        return {"success": True, "output": result}
+        return dict(output_window(), success=True, output=result)
+    except Exception as e:
+        return dict(output_window(), success=False, error=str(e), output=web_output.text())
+    finally:
+        running = False
+
+def output_window():
+    """
+    Truncation of the last run's output and, if it was truncated, the head
+    and tail the page shows around the lines get_output_lines() can fetch
+    """
+    truncation = web_output.truncation()
+    window = {"truncation": truncation}
+    if truncation["truncated"]:
+        window["head"] = "\n".join(web_output.read_lines(0, truncation["head_lines"]))
+        window["tail"] = "\n".join(web_output.read_lines(truncation["lines"] - truncation["tail_lines"],
+                                                          truncation["tail_lines"]))
+    return window
+
+@eel.expose
+def profile_cfpl_code(code, input_data=""):
+    """
+    Execute CFPL code with the profiler; returns the output, the text
+    report and the per-line profile the page shows as a heat map, which
+    for a failed run cover what ran before the error
+    """
+    global running
+    if running:
+        return busy()
+    running = True
+    profiler = Profiler()
+    web_output.forward = None
+    interpreter.set_output_sink(web_output)
+    cancellation.reset()
+    try:
+        result = interpreter.run(code, input_data, profiler=profiler)
+        return dict(output_window(), success=True, output=result, report=profiler.report(),
+                    profile=profiler.to_json())
     except Exception as e:
-        return {"success": False, "error": str(e)}
+        return dict(output_window(), success=False, error=str(e), output=web_output.text(),
+                    report=profiler.report(), profile=profiler.to_json())
+    finally:
+        running = False
+
+@eel.expose
+def get_output_lines(start, count):
+    """
+    Lines start to start + count of the last run's output, including those
+    left out; none while another run is filling the output
+    """
+    if running:
+        return []
+    return web_output.read_lines(start, count)
+
+@eel.expose
+def cancel_run():
+    """Stop the running program at its next limit check"""
+    cancellation.cancel()
+    return {"success": True}
+
+@eel.expose
+def relex_lines(start, end, lines):
+    """Re-lex edited editor lines and return a lexical error (or None) per line"""
+    relexed = editor_lexer.replace_lines(start, end, lines)
+    return [editor_lexer.line_error(index) for index in relexed]
+
+@eel.expose
+def get_metrics(format="json"):
+    """Run metrics of the interpreter, as data or, with format="prometheus", as exposition text"""
+    if format == "prometheus":
+        return interpreter.metrics.prometheus()
+    return interpreter.metrics.snapshot()
 
 @eel.expose
 def get_variables():
@@ -24,6 +138,8 @@ def get_variables():
 @eel.expose
 def reset_interpreter():
     """Reset interpreter state"""
+    if running:
+        return busy()
     interpreter.reset()
     return {"success": True, "message": "Interpreter reset successfully"}
 
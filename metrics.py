@@ -0,0 +1,156 @@
+import math
+import os
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# Bucket upper bounds of the histograms InterpreterMetrics keeps
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+class Counter:
+    """A total that only goes up, kept separately for each combination of label values"""
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, *label_values: str):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def snapshot(self) -> dict:
+        return {
+            'type': 'counter',
+            'help': self.help,
+            'values': [{'labels': dict(zip(self.labels, key)), 'value': value}
+                       for key, value in self.values.items()],
+        }
+
+    def prometheus(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in self.values.items():
+            lines.append(f'{self.name}{label_text(zip(self.labels, key))} {number_text(value)}')
+        return lines
+
+class Histogram:
+    """
+    Counts of observed values by bucket (each value goes in the first bucket
+    whose upper bound is at least the value, or the last, unbounded one),
+    along with their count and sum, kept separately for each combination
+    of label values
+    """
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labels = labels
+        # Label values -> [bucket counts (the last unbounded), count, sum]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += 1
+        series[2] += value
+
+    def cumulative(self, counts: List[int]) -> List[Tuple[float, int]]:
+        """(upper bound, count of values up to it) pairs, ending with +Inf"""
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def snapshot(self) -> dict:
+        return {
+            'type': 'histogram',
+            'help': self.help,
+            'values': [{
+                'labels': dict(zip(self.labels, key)),
+                'buckets': [[number_text(bound), count] for bound, count in self.cumulative(counts)],
+                'count': count,
+                'sum': total,
+            } for key, (counts, count, total) in self.series.items()],
+        }
+
+    def prometheus(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, count, total) in self.series.items():
+            labels = list(zip(self.labels, key))
+            for bound, bucket_count in self.cumulative(counts):
+                lines.append(f"{self.name}_bucket{label_text(labels + [('le', number_text(bound))])} "
+                             f"{bucket_count}")
+            lines.append(f'{self.name}_sum{label_text(labels)} {number_text(total)}')
+            lines.append(f'{self.name}_count{label_text(labels)} {count}')
+        return lines
+
+def label_text(labels: Iterable[Tuple[str, str]]) -> str:
+    """Prometheus label set, such as {phase="lex"}, or nothing without labels"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in labels]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def number_text(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class InterpreterMetrics:
+    """
+    Counters and histograms describing the runs of one or more
+    CFPLInterpreters, for capacity planning: how long each phase takes,
+    how large the programs and their output are, and how runs end.
+    snapshot() gives them as plain data and prometheus() in the Prometheus
+    text exposition format.
+    """
+    def __init__(self, prefix: str = 'cfpl'):
+        self.runs = Counter(f'{prefix}_runs_total', 'Programs run, by how the run ended', ('status',))
+        self.cache_hits = Counter(f'{prefix}_parse_cache_hits_total',
+                                  'Runs that reused an already parsed program')
+        self.phase_seconds = Histogram(f'{prefix}_phase_duration_seconds',
+                                       'Time taken by each phase of a run', DURATION_BUCKETS, ('phase',))
+        self.tokens = Histogram(f'{prefix}_program_tokens', 'Tokens of each program lexed', COUNT_BUCKETS)
+        self.nodes = Histogram(f'{prefix}_program_nodes', 'Syntax tree nodes of each program analyzed',
+                               COUNT_BUCKETS)
+        self.statements = Histogram(f'{prefix}_statements_executed_estimate',
+                                    'Estimated statements executed by each run with execution limits or '
+                                    'statement counting, as counted against max_steps (an IF counts its '
+                                    'longer arm) with code outside loops counted the same way',
+                                    COUNT_BUCKETS)
+        self.output_bytes = Histogram(f'{prefix}_output_bytes',
+                                      'UTF-8 bytes of output each run produced, before any truncation',
+                                      BYTE_BUCKETS)
+
+    @property
+    def metrics(self) -> list:
+        return [self.runs, self.cache_hits, self.phase_seconds, self.tokens, self.nodes, self.statements,
+                self.output_bytes]
+
+    def snapshot(self) -> dict:
+        """Every metric by name, as JSON-serializable data"""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.prometheus())
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """
+        Write prometheus() to path, replacing the file at once so a collector
+        (such as the node exporter's textfile collector) never reads it half
+        written
+        """
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
@@ -0,0 +1,160 @@
+from typing import List
+from ast_nodes import (Assign, BinaryOp, Chain, ChainAssign, If, Literal, Node, Output, Program,
+                       Text, UnaryOp, While, join_text)
+from evaluator import BINARY_OPERATIONS, SHORT_CIRCUIT_OPERATORS, UNARY_OPERATIONS, short_circuits
+from type_checker import value_type
+
+# Folded strings longer than this are left to be built at run time, so a
+# literal such as "ab" * 100000000 does not grow the syntax tree
+FOLD_SIZE_LIMIT = 4096
+
+def optimize(program: Program) -> Program:
+    """
+    Simplify a parsed program before it is resolved and run:
+      - operations whose operands are all literals are folded into a literal
+      - AND / OR with a literal left operand are replaced by that operand
+        if it decides the result, or else by the right operand
+      - IF statements with a constant condition are replaced by the arm
+        that would run
+      - WHILE loops whose condition is constantly false are removed
+      - OUTPUT parts that fold to a literal become part of the fixed text
+        around them
+    Operations that would fail (division by zero, mixing text and numbers)
+    are left in place, so the error is still raised at run time, from the
+    same line. The program is changed in place and returned. Neither nested
+    blocks nor nested expressions are handled recursively.
+    """
+    blocks = [program.statements]
+    while blocks:
+        statements = blocks.pop()
+        statements[:] = optimize_block(statements, blocks)
+    return program
+
+def optimize_block(statements: List[Node], blocks: List[List[Node]]) -> List[Node]:
+    """
+    Return the optimized statements of one block; the bodies of IF and
+    WHILE statements that remain are added to blocks to be optimized next
+    """
+    optimized = []
+    pending = statements[::-1]
+    while pending:
+        statement = pending.pop()
+        if isinstance(statement, If):
+            statement.condition = fold_expression(statement.condition)
+            if isinstance(statement.condition, Literal):
+                # Continue with the statements of the arm that always runs
+                arm = statement.body if statement.condition.value else statement.orelse
+                pending.extend(reversed(arm))
+                continue
+            blocks.append(statement.body)
+            blocks.append(statement.orelse)
+        elif isinstance(statement, While):
+            statement.condition = fold_expression(statement.condition)
+            condition = statement.condition
+            if isinstance(condition, Literal) and not condition.value:
+                continue
+            blocks.append(statement.body)
+        elif isinstance(statement, (Assign, ChainAssign)):
+            statement.value = fold_expression(statement.value)
+        elif isinstance(statement, Output):
+            statement.parts = join_text([part if isinstance(part, Text) else text_part(fold_expression(part))
+                                         for part in statement.parts])
+        optimized.append(statement)
+    return optimized
+
+def fold_expression(expr: Node) -> Node:
+    """Fold the constant operations of an expression tree of any depth"""
+    results = []
+    pending = [(expr, False)]
+    while pending:
+        node, children_done = pending.pop()
+        if isinstance(node, BinaryOp):
+            if not children_done:
+                pending.append((node, True))
+                pending.append((node.right, False))
+                pending.append((node.left, False))
+                continue
+            node.right = results.pop()
+            node.left = results.pop()
+            results.append(fold_binary(node))
+        elif isinstance(node, Chain):
+            if not children_done:
+                pending.append((node, True))
+                pending.extend((operand, False) for operand in reversed(node.operands))
+                continue
+            count = len(node.operands)
+            node.operands = results[len(results) - count:]
+            del results[len(results) - count:]
+            results.append(fold_chain(node))
+        elif isinstance(node, UnaryOp):
+            if not children_done:
+                pending.append((node, True))
+                pending.append((node.operand, False))
+                continue
+            node.operand = results.pop()
+            results.append(fold_unary(node))
+        else:
+            results.append(node)
+    return results.pop()
+
+def text_part(part: Node) -> Node:
+    """An OUTPUT part that is a literal as the Text it prints"""
+    if isinstance(part, Literal):
+        return Text(str(part.value), part.line, part.column)
+    return part
+
+def constant(node: Node, operation, *operands) -> Node:
+    """A literal holding operation(*operands) in place of node, or node if that fails"""
+    try:
+        value = operation(*operands)
+    except Exception:
+        return node
+    if isinstance(value, str) and len(value) > FOLD_SIZE_LIMIT:
+        return node
+    literal = Literal(value, node.line, node.column)
+    literal.type = value_type(value)
+    return literal
+
+def fold_binary(node: BinaryOp) -> Node:
+    if isinstance(node.left, Literal) and node.op in SHORT_CIRCUIT_OPERATORS:
+        return node.left if short_circuits(node.op, node.left.value) else node.right
+    if isinstance(node.left, Literal) and isinstance(node.right, Literal):
+        return constant(node, BINARY_OPERATIONS[node.op], node.left.value, node.right.value)
+    return node
+
+def fold_chain(node: Chain) -> Node:
+    # A chain evaluates left to right, so only a run of literals at its
+    # start can be folded, along with the AND / OR operands they decide
+    operands, ops = node.operands, node.ops
+    folded = 0
+    value = operands[0]
+    while folded < len(ops) and isinstance(value, Literal):
+        op, operand = ops[folded], operands[folded + 1]
+        if op in SHORT_CIRCUIT_OPERATORS:
+            if not short_circuits(op, value.value):
+                value = operand
+        elif isinstance(operand, Literal):
+            result = constant(node, BINARY_OPERATIONS[op], value.value, operand.value)
+            if result is node:
+                break
+            value = result
+        else:
+            break
+        folded += 1
+
+    if folded == 0:
+        return node
+    if folded == len(ops):
+        return value
+    if folded == len(ops) - 1:
+        binary = BinaryOp(ops[-1], value, operands[-1], node.line, node.column)
+        binary.type = node.type
+        return binary
+    node.operands = [value] + operands[folded + 1:]
+    node.ops = ops[folded:]
+    return node
+
+def fold_unary(node: UnaryOp) -> Node:
+    if isinstance(node.operand, Literal):
+        return constant(node, UNARY_OPERATIONS[node.op], node.operand.value)
+    return node
@@ -0,0 +1,235 @@
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from itertools import islice
+from typing import Callable, IO, List, Union
+
+# BoundedOutput remembers where every this many spilled lines start in its
+# spill file, so any of them can be read back without an index per line
+SPILL_INDEX_INTERVAL = 1024
+
+class OutputSink(ABC):
+    """
+    Receives a program's output while it runs, instead of the evaluator
+    collecting every line until the program ends. Evaluators call
+    append(line) once per OUTPUT statement executed; text() is what
+    CFPLInterpreter.run() then returns, the part of the output the sink
+    still holds (if any).
+    """
+    def start(self):
+        """Called before each run"""
+
+    @abstractmethod
+    def append(self, line: str):
+        """Called with each line of output, without its newline"""
+
+    def flush(self):
+        """Called once a run has ended, normally or with an error"""
+
+    def text(self) -> str:
+        return ''
+
+class FileSink(OutputSink):
+    """
+    Writes each line, followed by a newline, to a text file given as a path
+    or an open file. Output of later runs is added after that of earlier ones.
+    """
+    def __init__(self, file: Union[str, IO[str]], encoding: str = 'utf-8'):
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'w', encoding=encoding) if self.owns_file else file
+        self.write = self.file.write
+
+    def append(self, line: str):
+        self.write(line + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Close the file if the sink opened it"""
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+class CallbackSink(OutputSink):
+    """Calls callback(line) for every line as soon as it is produced"""
+    def __init__(self, callback: Callable[[str], None]):
+        self.callback = callback
+        # Bound directly, so a line costs a single call
+        self.append = callback
+
+    def append(self, line: str):
+        self.callback(line)
+
+class BatchSink(OutputSink):
+    """
+    Collects lines and calls callback(text) with a batch of them joined by
+    newlines, once max_lines lines are waiting or interval seconds have
+    passed since the last batch; for consumers where each call is costly,
+    such as pushing output to the web page
+    """
+    def __init__(self, callback: Callable[[str], None], max_lines: int = 256, interval: float = 0.1):
+        self.callback = callback
+        self.max_lines = max_lines
+        self.interval = interval
+        self.lines = []
+        self.sent_at = time.monotonic()
+
+    def start(self):
+        self.lines = []
+        self.sent_at = time.monotonic()
+
+    def append(self, line: str):
+        lines = self.lines
+        lines.append(line)
+        if len(lines) >= self.max_lines or time.monotonic() - self.sent_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.callback('\n'.join(self.lines))
+            self.lines = []
+        self.sent_at = time.monotonic()
+
+class RingBufferSink(OutputSink):
+    """Keeps only the last max_lines lines of each run; text() returns those"""
+    def __init__(self, max_lines: int = 1000):
+        self.lines = deque(maxlen=max_lines)
+        # Bound directly, so a line costs a single call
+        self.append = self.lines.append
+
+    def append(self, line: str):
+        self.lines.append(line)
+
+    def start(self):
+        self.lines.clear()
+
+    def text(self) -> str:
+        return '\n'.join(self.lines)
+
+class BoundedOutput(OutputSink):
+    """
+    Keeps at most about max_bytes of a run's output in memory: the first
+    head_bytes (half by default) and the last lines that fit in the rest.
+    Lines pushed out of that tail window go to a temporary spill file, from
+    which read_lines() can fetch them on demand; truncation() describes
+    what was left out of text(). Lines that stay in the head window are
+    also passed on to forward, if given, as they are produced.
+    """
+    def __init__(self, max_bytes: int = 1 << 20, head_bytes: int = None, spill_dir: str = None,
+                 forward: OutputSink = None):
+        self.head_bytes = max_bytes // 2 if head_bytes is None else min(head_bytes, max_bytes)
+        self.tail_bytes = max_bytes - self.head_bytes
+        self.spill_dir = spill_dir
+        self.forward = forward
+        self.spill = None
+        self.start()
+
+    def start(self):
+        self.head = []
+        self.head_size = 0
+        self.filling_head = True
+        self.tail = deque()
+        self.tail_size = 0
+        self.line_count = 0
+        self.byte_count = 0
+        self.spilled_lines = 0
+        self.spilled_bytes = 0
+        # Offsets of spilled lines 0, SPILL_INDEX_INTERVAL, 2 * SPILL_INDEX_INTERVAL, ...
+        self.spill_index = []
+        if self.spill is not None:
+            self.spill.seek(0)
+            self.spill.truncate()
+        if self.forward is not None:
+            self.forward.start()
+
+    def append(self, line: str):
+        # Sizes are UTF-8 bytes, newline included
+        size = len(line) + 1 if line.isascii() else len(line.encode('utf-8')) + 1
+        self.line_count += 1
+        self.byte_count += size
+        if self.filling_head:
+            if self.head_size + size <= self.head_bytes:
+                self.head.append(line)
+                self.head_size += size
+                if self.forward is not None:
+                    self.forward.append(line)
+                return
+            self.filling_head = False
+        tail = self.tail
+        tail.append(line)
+        self.tail_size += size
+        while self.tail_size > self.tail_bytes:
+            self.spill_line(tail.popleft())
+
+    def spill_line(self, line: str):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(dir=self.spill_dir)
+        data = (line + '\n').encode('utf-8')
+        if self.spilled_lines % SPILL_INDEX_INTERVAL == 0:
+            self.spill_index.append(self.spilled_bytes)
+        self.spill.write(data)
+        self.spilled_lines += 1
+        self.spilled_bytes += len(data)
+        self.tail_size -= len(data)
+
+    def flush(self):
+        if self.forward is not None:
+            self.forward.flush()
+
+    def close(self):
+        """Delete the spill file"""
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+    def truncation(self) -> dict:
+        """
+        What text() holds of the output: the number of lines and bytes in
+        all, the lines kept at its head and tail, and the lines and bytes
+        left out between them (which read_lines() can still fetch)
+        """
+        return {
+            'truncated': self.spilled_lines > 0,
+            'lines': self.line_count,
+            'bytes': self.byte_count,
+            'head_lines': len(self.head),
+            'omitted_lines': self.spilled_lines,
+            'omitted_bytes': self.spilled_bytes,
+            'tail_lines': len(self.tail),
+        }
+
+    def text(self) -> str:
+        if not self.spilled_lines:
+            return '\n'.join(self.head + list(self.tail))
+        marker = f"... {self.spilled_lines} lines ({self.spilled_bytes} bytes) omitted ..."
+        return '\n'.join(self.head + [marker] + list(self.tail))
+
+    def read_lines(self, start: int, count: int) -> List[str]:
+        """Lines start to start + count of the whole output, wherever they are kept"""
+        end = min(start + count, self.line_count)
+        head_end = len(self.head)
+        spill_end = head_end + self.spilled_lines
+        lines = []
+        if start < head_end:
+            lines.extend(self.head[start:min(end, head_end)])
+        first, last = max(start, head_end), min(end, spill_end)
+        if first < last:
+            lines.extend(self.read_spilled(first - head_end, last - first))
+        first = max(start, spill_end)
+        if first < end:
+            lines.extend(islice(self.tail, first - spill_end, end - spill_end))
+        return lines
+
+    def read_spilled(self, first: int, count: int) -> List[str]:
+        spill = self.spill
+        spill.flush()
+        spill.seek(self.spill_index[first // SPILL_INDEX_INTERVAL])
+        for _ in range(first % SPILL_INDEX_INTERVAL):
+            spill.readline()
+        lines = [spill.readline()[:-1].decode('utf-8') for _ in range(count)]
+        # Later lines are written at the end again
+        spill.seek(0, 2)
+        return lines
@@ -1,10 +1,101 @@
-from typing import List
-from token_types import Token, TokenType
+from collections import deque
+from collections.abc import Sequence
+from typing import Iterable, List, Union
+from token_types import Token, TokenStream, TokenType
+from ast_nodes import (Assign, BinaryOp, Chain, ChainAssign, If, Input, Literal, Output, Program,
+                       Text, UnaryOp, Var, VarDecl, While, join_text)
+from config import ESCAPE_SEQUENCES
+
+# Binding power of each binary operator (higher binds tighter)
+BINARY_PRECEDENCE = {
+    TokenType.OR: 1,
+    TokenType.AND: 2,
+    TokenType.EQ: 3, TokenType.NEQ: 3,
+    TokenType.GT: 4, TokenType.LT: 4, TokenType.GTE: 4, TokenType.LTE: 4,
+    TokenType.PLUS: 5, TokenType.MINUS: 5,
+    TokenType.MULTIPLY: 6, TokenType.DIVIDE: 6, TokenType.MODULO: 6
+}
+
+# AST operator names
+BINARY_OPERATORS = {token_type: token_type.value for token_type in BINARY_PRECEDENCE}
+BINARY_OPERATORS[TokenType.OR] = 'or'
+BINARY_OPERATORS[TokenType.AND] = 'and'
+
+OPERATOR_PRECEDENCE = {BINARY_OPERATORS[token_type]: precedence
+                       for token_type, precedence in BINARY_PRECEDENCE.items()}
+
+UNARY_OPERATORS = {
+    TokenType.PLUS: '+', TokenType.MINUS: '-', TokenType.NOT: 'NOT'
+}
+
+def unescape(text: str) -> str:
+    """Resolve the [#], [[ and ]] escapes of an OUTPUT string"""
+    for sequence, replacement in ESCAPE_SEQUENCES.items():
+        text = text.replace(sequence, replacement)
+    return text
+
+# Operator stack markers of parse_expression, below every binary precedence
+OPEN_PAREN = 0
+UNARY = -1
+
+LITERAL_TYPES = frozenset([
+    TokenType.INTEGER, TokenType.FLOAT_NUM, TokenType.STRING,
+    TokenType.CHARACTER, TokenType.BOOLEAN
+])
+
+class TokenWindow:
+    """
+    Indexable view over a token iterator (e.g. CFPLLexer.iter_tokens()).
+    The parser never looks further back than the current token or further
+    ahead than peek_token(1), so only the last few tokens are kept around.
+    """
+    def __init__(self, tokens: Iterable[Token], size: int = 4):
+        self.iterator = iter(tokens)
+        self.buffer = deque()
+        self.start = 0
+        self.size = size
+
+    @property
+    def consumed(self) -> int:
+        """Tokens taken from the iterator so far"""
+        return self.start + len(self.buffer)
+
+    def __getitem__(self, index: int) -> Token:
+        offset = index - self.start
+        if offset < 0:
+            raise Exception(f"Token {index} is no longer buffered")
+
+        buffer = self.buffer
+        while offset >= len(buffer):
+            token = next(self.iterator, None)
+            if token is None:
+                raise IndexError(index)
+            buffer.append(token)
+            if len(buffer) > self.size:
+                buffer.popleft()
+                self.start += 1
+                offset -= 1
+        return buffer[offset]
 
 class CFPLParser:
-    def __init__(self, tokens: List[Token]):
+    def __init__(self, tokens: Union[List[Token], TokenStream, Iterable[Token]]):
+        if not isinstance(tokens, Sequence):
+            tokens = TokenWindow(tokens)
         self.tokens = tokens
         self.pos = 0
+        
+        # Most lookups only need the type; a TokenStream answers those
+        # straight from its type codes without building a token view
+        if isinstance(tokens, TokenStream):
+            self.token_at = tokens.token_at
+            self.type_at = tokens.type_at
+            self.value_at = tokens.value_at
+            self.position_at = tokens.position_at
+        else:
+            self.token_at = tokens.__getitem__
+            self.type_at = lambda index: tokens[index].type
+            self.value_at = lambda index: tokens[index].value
+            self.position_at = lambda index: (tokens[index].line, tokens[index].column)
     
     def error(self, message: str):
         current_token = self.current_token()
@@ -12,15 +103,29 @@ class CFPLParser:
         raise Exception(f"Parse error at line {line}: {message}")
     
     def current_token(self) -> Token:
-        if self.pos < len(self.tokens):
-            return self.tokens[self.pos]
-        return Token(TokenType.EOF, None)
+        try:
+            return self.token_at(self.pos)
+        except IndexError:
+            return Token(TokenType.EOF, None)
+    
+    def current_type(self) -> TokenType:
+        try:
+            return self.type_at(self.pos)
+        except IndexError:
+            return TokenType.EOF
+    
+    def position(self) -> tuple:
+        """(line, column) of the current token, for the node being parsed"""
+        try:
+            return self.position_at(self.pos)
+        except IndexError:
+            return 0, 0
     
     def peek_token(self, offset: int = 1) -> Token:
-        pos = self.pos + offset
-        if pos < len(self.tokens):
-            return self.tokens[pos]
-        return Token(TokenType.EOF, None)
+        try:
+            return self.token_at(self.pos + offset)
+        except IndexError:
+            return Token(TokenType.EOF, None)
     
     def consume(self, expected_type: TokenType = None) -> Token:
         token = self.current_token()
@@ -29,8 +134,24 @@ class CFPLParser:
         self.pos += 1
         return token
     
+    def expect(self, expected_type: TokenType):
+        """consume() for callers that do not need the token itself"""
+        token_type = self.current_type()
+        if token_type != expected_type:
+            self.error(f"Expected {expected_type}, got {token_type}")
+        self.pos += 1
+    
+    def consume_value(self, expected_type: TokenType):
+        """consume() for callers that only need the token's value"""
+        token_type = self.current_type()
+        if token_type != expected_type:
+            self.error(f"Expected {expected_type}, got {token_type}")
+        value = self.value_at(self.pos)
+        self.pos += 1
+        return value
+    
     def skip_newlines(self):
-        while self.current_token().type in [TokenType.NEWLINE, TokenType.COMMENT]:
+        while self.current_type() in [TokenType.NEWLINE, TokenType.COMMENT]:
             self.pos += 1
     
     def parse_literal(self):
@@ -55,281 +176,289 @@ class CFPLParser:
             self.error(f"Expected literal, got {token.type}")
     
     def parse_expression(self):
-        return self.parse_or_expression()
-    
-    def parse_or_expression(self):
-        left = self.parse_and_expression()
+        """
+        Operator precedence parsing with explicit operand and operator stacks
+        rather than recursion, so neither long operator chains nor deeply
+        nested parentheses run into Python's recursion limit. Unary operators
+        bind tighter than any binary operator and all binary operators are
+        left-associative.
+        """
+        operands = []
+        # Pending operators, innermost last: (precedence, op) for binary
+        # operators, (UNARY, (op, line, column)) and (OPEN_PAREN, None)
+        operators = []
         
-        while self.current_token().type == TokenType.OR:
-            self.consume(TokenType.OR)
-            right = self.parse_and_expression()
-            left = ('or', left, right)
-        
-        return left
-    
-    def parse_and_expression(self):
-        left = self.parse_equality_expression()
-        
-        while self.current_token().type == TokenType.AND:
-            self.consume(TokenType.AND)
-            right = self.parse_equality_expression()
-            left = ('and', left, right)
-        
-        return left
-    
-    def parse_equality_expression(self):
-        left = self.parse_relational_expression()
-        
-        while self.current_token().type in [TokenType.EQ, TokenType.NEQ]:
-            op = self.consume().type
-            right = self.parse_relational_expression()
-            left = (op.value, left, right)
-        
-        return left
-    
-    def parse_relational_expression(self):
-        left = self.parse_additive_expression()
-        
-        while self.current_token().type in [TokenType.GT, TokenType.LT, TokenType.GTE, TokenType.LTE]:
-            op = self.consume().type
-            right = self.parse_additive_expression()
-            left = (op.value, left, right)
-        
-        return left
-    
-    def parse_additive_expression(self):
-        left = self.parse_multiplicative_expression()
-        
-        while self.current_token().type in [TokenType.PLUS, TokenType.MINUS]:
-            op = self.consume().type
-            right = self.parse_multiplicative_expression()
-            left = (op.value, left, right)
-        
-        return left
-    
-    def parse_multiplicative_expression(self):
-        left = self.parse_unary_expression()
-        
-        while self.current_token().type in [TokenType.MULTIPLY, TokenType.DIVIDE, TokenType.MODULO]:
-            op = self.consume().type
-            right = self.parse_unary_expression()
-            left = (op.value, left, right)
-        
-        return left
+        while True:
+            # An operand: prefix operators and opening parentheses, then a primary
+            token_type = self.current_type()
+            while token_type in UNARY_OPERATORS or token_type == TokenType.LPAREN:
+                if token_type == TokenType.LPAREN:
+                    operators.append((OPEN_PAREN, None))
+                else:
+                    line, column = self.position()
+                    operators.append((UNARY, (UNARY_OPERATORS[token_type], line, column)))
+                self.pos += 1
+                token_type = self.current_type()
+            operands.append(self.parse_primary_expression())
+            
+            # Then a binary operator, or the end of the innermost parenthesized
+            # expression or of the whole expression
+            while True:
+                while operators and operators[-1][0] == UNARY:
+                    op, line, column = operators.pop()[1]
+                    operands.append(UnaryOp(op, operands.pop(), line, column))
+                
+                token_type = self.current_type()
+                precedence = BINARY_PRECEDENCE.get(token_type, 0)
+                if precedence:
+                    self.reduce(operands, operators, precedence)
+                    operators.append((precedence, BINARY_OPERATORS[token_type]))
+                    self.pos += 1
+                    break
+                
+                self.reduce(operands, operators, 1)
+                if not operators:
+                    return operands.pop()
+                self.expect(TokenType.RPAREN)
+                operators.pop()
     
-    def parse_unary_expression(self):
-        if self.current_token().type in [TokenType.PLUS, TokenType.MINUS, TokenType.NOT]:
-            op = self.consume().type
-            expr = self.parse_unary_expression()
-            return (op.value, expr)
-        
-        return self.parse_primary_expression()
+    def reduce(self, operands: list, operators: list, min_precedence: int):
+        """
+        Apply the pending binary operators that bind at least as tightly as
+        min_precedence. Consecutive operators of one precedence level are
+        collected into a single Chain node.
+        """
+        while operators and operators[-1][0] >= min_precedence:
+            precedence, op = operators.pop()
+            right = operands.pop()
+            left = operands[-1]
+            if isinstance(left, Chain) and OPERATOR_PRECEDENCE[left.ops[0]] == precedence:
+                left.operands.append(right)
+                left.ops.append(op)
+            elif isinstance(left, BinaryOp) and OPERATOR_PRECEDENCE[left.op] == precedence:
+                operands[-1] = Chain([left.left, left.right, right], [left.op, op], left.line, left.column)
+            else:
+                operands[-1] = BinaryOp(op, left, right, left.line, left.column)
     
     def parse_primary_expression(self):
-        token = self.current_token()
+        token_type = self.current_type()
         
-        if token.type in [TokenType.INTEGER, TokenType.FLOAT_NUM, TokenType.STRING, 
-                         TokenType.CHARACTER, TokenType.BOOLEAN]:
+        if token_type in LITERAL_TYPES:
+            value = self.value_at(self.pos)
+            line, column = self.position()
             self.pos += 1
-            return token.value
-        elif token.type == TokenType.IDENTIFIER:
-            var_name = self.consume(TokenType.IDENTIFIER).value
-            return ('var', var_name)
-        elif token.type == TokenType.LPAREN:
-            self.consume(TokenType.LPAREN)
-            expr = self.parse_expression()
-            self.consume(TokenType.RPAREN)
-            return expr
+            return Literal(value, line, column)
+        elif token_type == TokenType.IDENTIFIER:
+            var_name = self.value_at(self.pos)
+            line, column = self.position()
+            self.pos += 1
+            return Var(var_name, line, column)
         else:
-            self.error(f"Unexpected token in expression: {token.type}")
+            self.error(f"Unexpected token in expression: {token_type}")
     
     def parse_variable_declaration(self):
-        self.consume(TokenType.VAR)
+        line, column = self.position()
+        self.expect(TokenType.VAR)
         
         # Parse variable list
         variables = []
         while True:
-            var_name = self.consume(TokenType.IDENTIFIER).value
+            var_name = self.consume_value(TokenType.IDENTIFIER)
             
             # Check for initialization
             initial_value = None
-            if self.current_token().type == TokenType.ASSIGN:
-                self.consume(TokenType.ASSIGN)
+            if self.current_type() == TokenType.ASSIGN:
+                self.expect(TokenType.ASSIGN)
                 initial_value = self.parse_literal()
             
             variables.append((var_name, initial_value))
             
-            if self.current_token().type == TokenType.COMMA:
-                self.consume(TokenType.COMMA)
+            if self.current_type() == TokenType.COMMA:
+                self.expect(TokenType.COMMA)
             else:
                 break
         
         # Parse AS type
-        self.consume(TokenType.AS)
+        self.expect(TokenType.AS)
         var_type = self.consume()
         
         if var_type.type not in [TokenType.INT, TokenType.CHAR, TokenType.BOOL, TokenType.FLOAT]:
             self.error(f"Invalid type: {var_type.value}")
         
-        return ('var_decl', variables, var_type.type)
+        return VarDecl(variables, var_type.type, line, column)
     
     def parse_assignment(self):
-        var_name = self.consume(TokenType.IDENTIFIER).value
-        self.consume(TokenType.ASSIGN)
+        line, column = self.position()
+        var_name = self.consume_value(TokenType.IDENTIFIER)
+        self.expect(TokenType.ASSIGN)
         
         # Handle chained assignment (a=b=10)
         if self.peek_token().type == TokenType.ASSIGN:
-            next_var = self.consume(TokenType.IDENTIFIER).value
-            self.consume(TokenType.ASSIGN)
+            next_var = self.consume_value(TokenType.IDENTIFIER)
+            self.expect(TokenType.ASSIGN)
             value = self.parse_expression()
-            return ('chain_assign', [var_name, next_var], value)
+            return ChainAssign([var_name, next_var], value, line, column)
         else:
             value = self.parse_expression()
-            return ('assign', var_name, value)
+            return Assign(var_name, value, line, column)
     
     def parse_output(self):
-        self.consume(TokenType.OUTPUT)
-        self.consume(TokenType.COLON)
+        line, column = self.position()
+        self.expect(TokenType.OUTPUT)
+        self.expect(TokenType.COLON)
         
         output_parts = []
         
         while True:
-            if self.current_token().type == TokenType.STRING:
-                value = self.consume(TokenType.STRING).value
-                output_parts.append(('string', value))
-            elif self.current_token().type == TokenType.HASH:
-                self.consume(TokenType.HASH)
-                output_parts.append(('newline',))
+            if self.current_type() == TokenType.STRING:
+                part_line, part_column = self.position()
+                value = self.consume_value(TokenType.STRING)
+                output_parts.append(Text(unescape(value), part_line, part_column))
+            elif self.current_type() == TokenType.HASH:
+                output_parts.append(Text('\n', *self.position()))
+                self.expect(TokenType.HASH)
             else:
-                expr = self.parse_expression()
-                output_parts.append(('expr', expr))
+                output_parts.append(self.parse_expression())
             
-            if self.current_token().type == TokenType.AMPERSAND:
-                self.consume(TokenType.AMPERSAND)
+            if self.current_type() == TokenType.AMPERSAND:
+                self.expect(TokenType.AMPERSAND)
             else:
                 break
         
-        return ('output', output_parts)
+        return Output(join_text(output_parts), line, column)
     
     def parse_input(self):
-        self.consume(TokenType.INPUT)
-        self.consume(TokenType.COLON)
+        line, column = self.position()
+        self.expect(TokenType.INPUT)
+        self.expect(TokenType.COLON)
         
         variables = []
         while True:
-            var_name = self.consume(TokenType.IDENTIFIER).value
+            var_name = self.consume_value(TokenType.IDENTIFIER)
             variables.append(var_name)
             
-            if self.current_token().type == TokenType.COMMA:
-                self.consume(TokenType.COMMA)
+            if self.current_type() == TokenType.COMMA:
+                self.expect(TokenType.COMMA)
             else:
                 break
         
-        return ('input', variables)
+        return Input(variables, line, column)
     
-    def parse_if(self):
-        self.consume(TokenType.IF)
-        self.consume(TokenType.LPAREN)
+    def parse_if_header(self) -> If:
+        """IF (condition) START, returning the If node with its blocks still empty"""
+        line, column = self.position()
+        self.expect(TokenType.IF)
+        self.expect(TokenType.LPAREN)
         condition = self.parse_expression()
-        self.consume(TokenType.RPAREN)
+        self.expect(TokenType.RPAREN)
         self.skip_newlines()
-        self.consume(TokenType.START)
+        self.expect(TokenType.START)
         self.skip_newlines()
-        
-        # Parse if block
-        if_statements = []
-        while self.current_token().type != TokenType.STOP:
-            if self.current_token().type in [TokenType.NEWLINE, TokenType.COMMENT]:
-                self.pos += 1
-                continue
-            if_statements.append(self.parse_statement())
-            self.skip_newlines()
-        
-        self.consume(TokenType.STOP)
-        self.skip_newlines()
-        
-        # Check for ELSE
-        else_statements = []
-        if self.current_token().type == TokenType.ELSE:
-            self.consume(TokenType.ELSE)
-            self.skip_newlines()
-            self.consume(TokenType.START)
-            self.skip_newlines()
-            
-            while self.current_token().type != TokenType.STOP:
-                if self.current_token().type in [TokenType.NEWLINE, TokenType.COMMENT]:
-                    self.pos += 1
-                    continue
-                else_statements.append(self.parse_statement())
-                self.skip_newlines()
-            
-            self.consume(TokenType.STOP)
-        
-        return ('if', condition, if_statements, else_statements)
+        return If(condition, [], [], line, column)
     
-    def parse_while(self):
-        self.consume(TokenType.WHILE)
-        self.consume(TokenType.LPAREN)
+    def parse_while_header(self) -> While:
+        """WHILE (condition) START, returning the While node with an empty body"""
+        line, column = self.position()
+        self.expect(TokenType.WHILE)
+        self.expect(TokenType.LPAREN)
         condition = self.parse_expression()
-        self.consume(TokenType.RPAREN)
+        self.expect(TokenType.RPAREN)
         self.skip_newlines()
-        self.consume(TokenType.START)
+        self.expect(TokenType.START)
         self.skip_newlines()
-        
-        # Parse loop body
-        statements = []
-        while self.current_token().type != TokenType.STOP:
-            if self.current_token().type in [TokenType.NEWLINE, TokenType.COMMENT]:
+        return While(condition, [], line, column)
+    
+    def parse_if(self):
+        node = self.parse_if_header()
+        self.parse_statements(node.body, [(node, None)])
+        return node
+    
+    def parse_while(self):
+        node = self.parse_while_header()
+        self.parse_statements(node.body, [(node, None)])
+        return node
+    
+    def parse_statements(self, statements: list, blocks: list):
+        """
+        Parse statements into `statements` up to the STOP closing the
+        innermost block in `blocks`, or up to STOP / EOF when no block is
+        open. IF and WHILE blocks are entered and left on the explicit
+        `blocks` stack of (node, statements of the enclosing block) instead
+        of by recursion, so nesting depth is limited only by memory.
+        """
+        while True:
+            token_type = self.current_type()
+            
+            if token_type in [TokenType.NEWLINE, TokenType.COMMENT]:
                 self.pos += 1
                 continue
-            statements.append(self.parse_statement())
+            
+            if token_type == TokenType.STOP or (token_type == TokenType.EOF and not blocks):
+                if not blocks:
+                    return
+                node, outer = blocks.pop()
+                self.expect(TokenType.STOP)
+                if isinstance(node, If) and statements is node.body:
+                    self.skip_newlines()
+                    if self.current_type() == TokenType.ELSE:
+                        self.expect(TokenType.ELSE)
+                        self.skip_newlines()
+                        self.expect(TokenType.START)
+                        self.skip_newlines()
+                        blocks.append((node, outer))
+                        statements = node.orelse
+                        continue
+                if outer is None:
+                    return
+                statements = outer
+            elif token_type == TokenType.IF or token_type == TokenType.WHILE:
+                node = self.parse_if_header() if token_type == TokenType.IF else self.parse_while_header()
+                statements.append(node)
+                blocks.append((node, statements))
+                statements = node.body
+                continue
+            else:
+                statements.append(self.parse_statement())
             self.skip_newlines()
-        
-        self.consume(TokenType.STOP)
-        return ('while', condition, statements)
     
     def parse_statement(self):
-        token = self.current_token()
+        token_type = self.current_type()
         
-        if token.type == TokenType.IDENTIFIER:
+        if token_type == TokenType.IDENTIFIER:
             return self.parse_assignment()
-        elif token.type == TokenType.OUTPUT:
+        elif token_type == TokenType.OUTPUT:
             return self.parse_output()
-        elif token.type == TokenType.INPUT:
+        elif token_type == TokenType.INPUT:
             return self.parse_input()
-        elif token.type == TokenType.IF:
+        elif token_type == TokenType.IF:
             return self.parse_if()
-        elif token.type == TokenType.WHILE:
+        elif token_type == TokenType.WHILE:
             return self.parse_while()
         else:
-            self.error(f"Unexpected token: {token.type}")
+            self.error(f"Unexpected token: {token_type}")
     
     def parse_program(self):
         statements = []
         
         # Parse variable declarations
         self.skip_newlines()
-        while self.current_token().type == TokenType.VAR:
+        line, column = self.position()
+        while self.current_type() == TokenType.VAR:
             statements.append(self.parse_variable_declaration())
             self.skip_newlines()
         
         # Parse START block
-        if self.current_token().type != TokenType.START:
+        if self.current_type() != TokenType.START:
             self.error("Expected START block")
         
-        self.consume(TokenType.START)
+        self.expect(TokenType.START)
         self.skip_newlines()
         
         # Parse statements until STOP
-        while self.current_token().type != TokenType.STOP and self.current_token().type != TokenType.EOF:
-            if self.current_token().type in [TokenType.NEWLINE, TokenType.COMMENT]:
-                self.pos += 1
-                continue
-            statements.append(self.parse_statement())
-            self.skip_newlines()
+        self.parse_statements(statements, [])
         
-        if self.current_token().type != TokenType.STOP:
+        if self.current_type() != TokenType.STOP:
             self.error("Expected STOP")
         
-        return ('program', statements)
+        return Program(statements, line, column)
       
\ No newline at end of file
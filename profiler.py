@@ -0,0 +1,209 @@
+import time
+from typing import Dict, List
+from ast_nodes import Node, Program
+from evaluator import CFPLEvaluator
+
+# How each kind of statement is named in reports and stack frames
+STATEMENT_NAMES = {
+    'Program': 'program', 'VarDecl': 'VAR', 'Assign': 'assignment',
+    'ChainAssign': 'assignment', 'Output': 'OUTPUT', 'Input': 'INPUT', 'If': 'IF',
+    'While': 'WHILE',
+}
+
+class StatementProfile:
+    """
+    Time spent in one statement of the program: hits counts the times it
+    started, total_time includes the statements nested in it and self_time
+    does not (for IF and WHILE, that is the time taken by their conditions)
+    """
+    __slots__ = ('statement', 'parent', 'hits', 'total_time', 'self_time')
+
+    def __init__(self, statement: Node, parent: 'StatementProfile' = None):
+        self.statement = statement
+        self.parent = parent
+        self.hits = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+    @property
+    def name(self) -> str:
+        return STATEMENT_NAMES.get(self.statement.__class__.__name__, self.statement.__class__.__name__)
+
+    @property
+    def frame(self) -> str:
+        """Name of the statement as a frame of a collapsed stack"""
+        if isinstance(self.statement, Program):
+            return self.name
+        return f'{self.name} line {self.statement.line}'
+
+    def stack(self) -> List['StatementProfile']:
+        """The statements enclosing this one, outermost first, and the statement itself"""
+        profiles = []
+        profile = self
+        while profile is not None:
+            profiles.append(profile)
+            profile = profile.parent
+        return profiles[::-1]
+
+class LineProfile:
+    """Time spent in the statements of one line, counted as for StatementProfile"""
+    __slots__ = ('line', 'hits', 'total_time', 'self_time')
+
+    def __init__(self, line: int):
+        self.line = line
+        self.hits = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+class Profiler:
+    """
+    Collects the time each statement of a program takes, when passed to
+    CFPLInterpreter.run(); the results of the run are then available as a
+    text report(), as collapsed() stacks for flamegraph tools and as the
+    to_json() payload the web page shows next to the code. Profiled runs
+    use the tree-walking evaluator whatever the interpreter's backend.
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.source_lines = []
+        self.start()
+
+    def start(self, source: str = ''):
+        """Forget the results of the last run; source is the code about to run"""
+        self.source_lines = source.splitlines()
+        self.statements: Dict[Node, StatementProfile] = {}
+
+    def profile(self, statement: Node, parent: StatementProfile) -> StatementProfile:
+        """The StatementProfile of statement, created as a child of parent when first seen"""
+        profile = self.statements.get(statement)
+        if profile is None:
+            profile = self.statements[statement] = StatementProfile(statement, parent)
+        return profile
+
+    @property
+    def total_time(self) -> float:
+        return sum(profile.total_time for profile in self.statements.values() if profile.parent is None)
+
+    def lines(self) -> List[LineProfile]:
+        """Profiles of the lines that ran, in line order"""
+        lines = {}
+        for profile in self.statements.values():
+            if isinstance(profile.statement, Program):
+                continue
+            line = profile.statement.line
+            line_profile = lines.get(line)
+            if line_profile is None:
+                line_profile = lines[line] = LineProfile(line)
+            line_profile.hits += profile.hits
+            line_profile.self_time += profile.self_time
+            # Time of a statement nested in another on the same line is
+            # already part of that one's total
+            parent = profile.parent
+            if parent is None or parent.statement.line != line or isinstance(parent.statement, Program):
+                line_profile.total_time += profile.total_time
+        return [lines[line] for line in sorted(lines)]
+
+    def source_line(self, line: int) -> str:
+        if 0 < line <= len(self.source_lines):
+            return self.source_lines[line - 1].strip()
+        return ''
+
+    def report(self) -> str:
+        """Hits and times of every line that ran, as a table"""
+        total = self.total_time
+        rows = [
+            f"Total time: {total:.6f} s",
+            '',
+            f"{'Line':>6} {'Hits':>10} {'Total (s)':>12} {'Self (s)':>12} {'Self %':>7}  Source",
+        ]
+        for line in self.lines():
+            share = line.self_time / total * 100 if total else 0.0
+            rows.append(f"{line.line:>6} {line.hits:>10} {line.total_time:>12.6f} {line.self_time:>12.6f} "
+                        f"{share:>6.1f}%  {self.source_line(line.line)}")
+        return '\n'.join(rows)
+
+    def collapsed(self) -> str:
+        """
+        One line per statement that ran: its stack of enclosing statements
+        joined by semicolons and its self time in microseconds, the format
+        flamegraph.pl and similar tools read
+        """
+        stacks = []
+        for profile in self.statements.values():
+            microseconds = round(profile.self_time * 1e6)
+            if microseconds > 0:
+                frames = ';'.join(frame.frame for frame in profile.stack())
+                stacks.append(f'{frames} {microseconds}')
+        return '\n'.join(stacks)
+
+    def to_json(self) -> dict:
+        """
+        The line profiles as plain data; heat is a line's self time relative
+        to that of the slowest line, from 0 to 1
+        """
+        lines = self.lines()
+        slowest = max((line.self_time for line in lines), default=0.0)
+        return {
+            'total_time': self.total_time,
+            'lines': [{
+                'line': line.line,
+                'hits': line.hits,
+                'total_time': line.total_time,
+                'self_time': line.self_time,
+                'heat': line.self_time / slowest if slowest else 0.0,
+            } for line in lines],
+        }
+
+class ProfilingEvaluator(CFPLEvaluator):
+    """
+    The tree-walking evaluator, timing every statement it runs for a
+    Profiler. Only execute_block() differs, so runs without a profiler,
+    which use the other evaluators, pay nothing for profiling.
+    """
+    def __init__(self, profiler: Profiler):
+        super().__init__()
+        self.profiler = profiler
+
+    def execute_block(self, statements: List[Node]):
+        visit = self.visit
+        clock = self.profiler.clock
+        profile_of = self.profiler.profile
+        # Each block runs for the IF, WHILE or program that returned it; its
+        # entry holds that statement's profile, when it started and the
+        # total time of the statements run in it so far
+        blocks = [[iter(statements), None, 0.0, 0.0]]
+        try:
+            while blocks:
+                entry = blocks[-1]
+                parent = entry[1]
+                for statement in entry[0]:
+                    profile = profile_of(statement, parent)
+                    profile.hits += 1
+                    started = clock()
+                    block = visit(statement)
+                    if block is not None:
+                        blocks.append([block, profile, started, 0.0])
+                        break
+                    elapsed = clock() - started
+                    profile.total_time += elapsed
+                    profile.self_time += elapsed
+                    entry[3] += elapsed
+                else:
+                    blocks.pop()
+                    if parent is not None:
+                        self.finish_block(entry, blocks)
+        finally:
+            # A run that fails still reports the time up to the error
+            while blocks:
+                entry = blocks.pop()
+                if entry[1] is not None:
+                    self.finish_block(entry, blocks)
+
+    def finish_block(self, entry: list, blocks: List[list]):
+        """Charge the statement that returned a finished block with the time it took"""
+        _, profile, started, nested_time = entry
+        elapsed = self.profiler.clock() - started
+        profile.total_time += elapsed
+        profile.self_time += elapsed - nested_time
+        if blocks:
+            blocks[-1][3] += elapsed
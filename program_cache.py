@@ -0,0 +1,159 @@
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+from typing import Any, Optional
+from config import CACHE_DIRECTORY, INTERPRETER_VERSION
+
+def source_key(code: str) -> str:
+    """Hash of a program's source text, used as its cache key"""
+    return hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+
+class ProgramCache:
+    """
+    Least-recently-used cache of parsed programs keyed by source hash.
+    A maxsize of 0 disables caching.
+    """
+    def __init__(self, maxsize: int = 64):
+        if maxsize < 0:
+            raise ValueError(f"Cache size must not be negative, got: {maxsize}")
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        program = self.entries.get(key)
+        if program is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return program
+
+    def put(self, key: str, program: Any):
+        if self.maxsize == 0:
+            return
+        self.entries[key] = program
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+class DiskProgramCache:
+    """
+    Compiled programs pickled into a cache directory, one file per source
+    hash and interpreter version. Files are written to a temporary name and
+    renamed into place, so a concurrent reader never sees a partial entry.
+    On load the header and a digest of the payload are checked; an entry
+    that fails is treated as a miss and removed.
+
+    Like __pycache__, the directory must only be writable by users trusted
+    to run code: entries are unpickled.
+    """
+    MAGIC = b'CFPLC\0'
+    SUFFIX = '.cfplc'
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, version: str = INTERPRETER_VERSION):
+        self.directory = directory
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.invalid = 0
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}-{self.version}{self.SUFFIX}")
+
+    def header(self, key: str, digest: bytes) -> bytes:
+        return self.MAGIC + f"{self.version}\0{key}\0".encode('ascii') + digest
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        program = self.decode(key, data)
+        if program is None:
+            self.invalid += 1
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self.hits += 1
+        return program
+
+    def decode(self, key: str, data: bytes) -> Optional[Any]:
+        """Return the program stored in data, or None if it is not a valid entry for key"""
+        header = self.header(key, b'')
+        digest_end = len(header) + hashlib.sha256().digest_size
+        if not data.startswith(header) or len(data) < digest_end:
+            return None
+        payload = data[digest_end:]
+        if hashlib.sha256(payload).digest() != data[len(header):digest_end]:
+            return None
+        try:
+            return pickle.loads(payload)
+        except Exception:
+            return None
+
+    def put(self, key: str, program: Any):
+        """Store program; failing to write the cache never fails the run"""
+        try:
+            payload = pickle.dumps(program, pickle.HIGHEST_PROTOCOL)
+            os.makedirs(self.directory, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'wb') as entry:
+                    entry.write(self.header(key, hashlib.sha256(payload).digest()))
+                    entry.write(payload)
+                os.replace(temp_path, self.path_for(key))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except (OSError, pickle.PicklingError, RecursionError):
+            pass
+
+    def clear(self):
+        """Remove every entry of this interpreter version"""
+        suffix = f"-{self.version}{self.SUFFIX}"
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(suffix):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalid': self.invalid,
+            'directory': self.directory,
+        }
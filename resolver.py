@@ -0,0 +1,33 @@
+from typing import List
+from ast_nodes import Assign, ChainAssign, Input, Program, Var, VarDecl, walk
+
+def resolve(program: Program) -> List[str]:
+    """
+    Give every declared variable an integer slot, in order of first
+    declaration, and record the slot on each node that names a variable.
+    Names that are never declared get slot None; evaluators raise the
+    undefined-variable error when such a node is reached, without looking
+    names up at run time. Returns the slot names, also kept as program.names;
+    program.types gets the type each slot was first declared with in strict
+    programs, and None otherwise.
+    """
+    slots = {}
+    types = []
+    for statement in program.statements:
+        if isinstance(statement, VarDecl):
+            statement.slots = []
+            for var_name, _ in statement.variables:
+                if var_name not in slots:
+                    slots[var_name] = len(slots)
+                    types.append(statement.var_type.name if program.strict else None)
+                statement.slots.append(slots[var_name])
+
+    for node in walk(program):
+        if isinstance(node, (Var, Assign)):
+            node.slot = slots.get(node.name)
+        elif isinstance(node, (ChainAssign, Input)):
+            node.slots = [slots.get(var_name) for var_name in node.names]
+
+    program.names = list(slots)
+    program.types = types
+    return program.names
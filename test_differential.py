@@ -0,0 +1,209 @@
+"""
+Differential tests: random programs must give the same output, variables
+and errors on every backend, with or without the optimizer and closed-form
+loops, whether or not types are checked strictly. Run with
+python -m pytest test_differential.py (or python -m unittest).
+"""
+import random
+import re
+import unittest
+from unittest import mock
+import interpreter
+import loop_optimizer
+from interpreter import CFPLInterpreter
+
+BACKENDS = ('closure', 'vm', 'python')
+
+OPERATORS = ('+', '-', '*', '/', '%', '>', '<', '>=', '<=', '==', '<>', 'AND', 'OR')
+LEAVES = ('a', 'b', 'c', 'f', 't', 'a', 'b', '1', '2', '3', '7', '2.5', '0', 'TRUE', 'FALSE') * 4 + ('zz', '0.0')
+LOOP_CONDITIONS = ('AND TRUE', 'OR FALSE', 'AND a > b', 'AND a + 0.5 > 0')
+INPUTS = ('', '3', '4,5', '2.5,TRUE,x', '0,0,0')
+
+def outcome(code: str, input_data: str, **options):
+    """
+    What running code does: its output and variables (with their types), or
+    its error, without the CFPL line only the python backend can add to
+    errors Python raised
+    """
+    cfpl = CFPLInterpreter(**options)
+    try:
+        output = cfpl.run(code, input_data)
+    except Exception as e:
+        return 'error', re.sub(r' \(CFPL line \d+\)$', '', str(e))
+    return 'ok', output, {name: (type(value).__name__, value) for name, value in cfpl.get_variables().items()}
+
+class ProgramGenerator:
+    """
+    Random programs mixing arithmetic, logic, IFs, bounded WHILEs, INPUT and
+    OUTPUT; typed ones only assign values of each variable's type, so that
+    most pass strict type checking
+    """
+    def __init__(self, seed: int, typed: bool = False):
+        self.random = random.Random(seed)
+        self.typed = typed
+
+    def expression(self, depth: int = 0) -> str:
+        choice = self.random.random()
+        if depth > 3 or choice < 0.35:
+            return self.random.choice(LEAVES)
+        if choice < 0.45:
+            return self.random.choice(('-', '+', 'NOT ')) + self.expression(depth + 1)
+        if choice < 0.55:
+            return f'({self.expression(depth + 1)})'
+        return f'{self.expression(depth + 1)} {self.random.choice(OPERATORS)} {self.expression(depth + 1)}'
+
+    def arithmetic(self, leaves: tuple, operators: str, depth: int = 0) -> str:
+        if depth > 2 or self.random.random() < 0.4:
+            return self.random.choice(leaves)
+        return (f'({self.arithmetic(leaves, operators, depth + 1)} {self.random.choice(operators)} '
+                f'{self.arithmetic(leaves, operators, depth + 1)})')
+
+    def assignment(self) -> str:
+        if not self.typed:
+            return f"{self.random.choice('abcft')} = {self.expression()}"
+        target = self.random.choice('abcft')
+        if target == 't':
+            return f't = {self.condition()}'
+        if target == 'f':
+            return f"f = {self.arithmetic(('a', 'b', 'f', '1', '2', '0', '2.5', '0.0'), '+-*/')}"
+        return f"{target} = {self.arithmetic(('a', 'b', 'c', '1', '2', '3', '7', '0'), '+-*%')}"
+
+    def condition(self, depth: int = 0) -> str:
+        """A condition built from comparisons, BOOL variables, AND, OR and NOT"""
+        choice = self.random.random()
+        if depth > 2 or choice < 0.3:
+            if self.random.random() < 0.3:
+                return self.random.choice(('t', 'TRUE', 'FALSE'))
+            return (f"{self.random.choice('abc')} {self.random.choice(('<', '>', '<=', '>=', '==', '<>'))} "
+                    f"{self.random.choice(('a', 'b', 'c', 'f', '1', '2', '3', '7', '2.5', '0'))}")
+        if choice < 0.45:
+            return f'NOT ({self.condition(depth + 1)})'
+        operator = self.random.choice(('AND', 'OR'))
+        return f' {operator} '.join(f'({self.condition(depth + 1)})' for _ in range(self.random.randint(2, 4)))
+
+    def block(self, depth: int, counters: list) -> str:
+        lines = []
+        for _ in range(self.random.randint(1, 4)):
+            choice = self.random.random()
+            if depth < 3 and choice < 0.2:
+                test = self.condition() if self.typed or self.random.random() < 0.5 else self.expression()
+                statement = f'IF ({test})\nSTART\n{self.block(depth + 1, counters)}STOP\n'
+                if self.random.random() < 0.5:
+                    statement += f'ELSE\nSTART\n{self.block(depth + 1, counters)}STOP\n'
+                lines.append(statement)
+            elif depth < 2 and choice < 0.3 and counters:
+                counter = counters.pop()
+                lines.append(f'{counter} = 0\n'
+                             f'WHILE ({counter} < {self.random.randint(0, 4)} '
+                             f'{self.random.choice(LOOP_CONDITIONS)})\nSTART\n'
+                             f'{counter} = {counter} + 1\n{self.block(depth + 1, counters)}STOP\n')
+            elif choice < 0.6:
+                lines.append(self.assignment() + '\n')
+            elif choice < 0.65:
+                value = self.arithmetic(('a', 'c', '2', '7'), '+-*') if self.typed else self.expression()
+                lines.append(f'a = b = {value}\n')
+            elif choice < 0.7:
+                lines.append(f"INPUT: {self.random.choice(('a', 'b, c', 'f', 't'))}\n")
+            else:
+                if self.typed:
+                    shown = (self.arithmetic(('a', 'b', 'f', '1', '2.5'), '+-*/'), f'({self.condition()})')
+                else:
+                    shown = (self.expression(), self.expression())
+                lines.append(f'OUTPUT: {shown[0]} & "[[x]][#]" & # & {shown[1]}\n')
+        return ''.join(lines)
+
+    def program(self) -> str:
+        return ('VAR a = 1, b = 2 AS INT\nVAR c AS INT\nVAR f = 1.5 AS FLOAT\nVAR t = TRUE AS BOOL\n'
+                'VAR i, j, k AS INT\nSTART\n' + self.block(0, ['i', 'j', 'k']) + 'STOP\n')
+
+    def counting_loop(self) -> str:
+        """
+        A program whose loop steps a counter towards an input bound while
+        adding to accumulators, the shape the loop optimizer gives a closed
+        form; the counter always moves towards the bound, so it ends
+        """
+        numbers = ('0', '1', '2', '3', '-1', '-2', '0.5', '1.5')
+        def term():
+            return self.random.choice(('i', 'i * k', 'k * i', 'i * 2', '3 * i', 'i * 0.5', 'k', 'n')
+                                      + numbers)
+        body = []
+        for accumulator in self.random.sample(['a', 'b', 'f'], self.random.randint(1, 3)):
+            terms = ''.join(f" {self.random.choice('+-')} {term()}" for _ in range(self.random.randint(1, 3)))
+            body.append(f'{accumulator} = {accumulator}{terms}')
+        step = self.random.choice(('1', '2', '3', '1.0', '0.5', '2.0'))
+        if self.random.random() < 0.5:
+            condition, update = f"i {self.random.choice(('<', '<='))} n", f'i = i + {step}'
+        else:
+            condition, update = f"i {self.random.choice(('>', '>='))} n", f'i = i - {step}'
+        body.insert(self.random.randint(0, len(body)), update)
+        return ('VAR i, n, k, a, b AS INT\nVAR f AS FLOAT\nSTART\nINPUT: i, n, k, a, b, f\n'
+                f'WHILE ({condition})\nSTART\n' + '\n'.join(body) + '\nSTOP\n'
+                'OUTPUT: i & " " & a & " " & b & " " & f\nSTOP\n')
+
+    def counting_input(self) -> str:
+        values = ('0', '1', '2', '3', '-1', '-2', '5', '0.5', '2.0', '-0.0', '1.5', '10', '7', '-4', '40')
+        return ','.join(self.random.choice(values) for _ in range(6))
+
+def unoptimized(program):
+    return program
+
+class DifferentialTest(unittest.TestCase):
+    PROGRAMS = 300
+
+    def assert_same(self, code: str, input_data: str, expected, actual, what: str):
+        self.assertEqual(expected, actual, f'{what} differs for input {input_data!r} on:\n{code}')
+
+    def compare_backends(self, seed: int, strict_types: bool):
+        generator = ProgramGenerator(seed, typed=strict_types)
+        for _ in range(self.PROGRAMS):
+            code = generator.program()
+            input_data = generator.random.choice(INPUTS)
+            expected = outcome(code, input_data, strict_types=strict_types)
+            for backend in BACKENDS:
+                actual = outcome(code, input_data, backend=backend, strict_types=strict_types)
+                self.assert_same(code, input_data, expected, actual, f'The {backend} backend')
+
+    def test_backends_agree(self):
+        self.compare_backends(11, strict_types=False)
+
+    def test_backends_agree_with_strict_types(self):
+        self.compare_backends(12, strict_types=True)
+
+    def test_optimizations_keep_behavior(self):
+        generator = ProgramGenerator(13)
+        for _ in range(self.PROGRAMS):
+            code = generator.program()
+            input_data = generator.random.choice(INPUTS)
+            with mock.patch.object(interpreter, 'optimize', unoptimized), \
+                    mock.patch.object(interpreter, 'optimize_loops', unoptimized):
+                expected = outcome(code, input_data)
+            for backend in ('tree',) + BACKENDS:
+                actual = outcome(code, input_data, backend=backend)
+                self.assert_same(code, input_data, expected, actual, f'The optimized {backend} backend')
+
+    def test_closed_forms_match_stepped_loops(self):
+        generator = ProgramGenerator(14)
+        closed_forms = 0
+        for _ in range(self.PROGRAMS):
+            code = generator.counting_loop()
+            input_data = generator.counting_input()
+            with mock.patch.object(loop_optimizer, 'find_closed_form', lambda loop: None):
+                expected = outcome(code, input_data)
+            for backend in ('tree',) + BACKENDS:
+                actual = outcome(code, input_data, backend=backend)
+                self.assert_same(code, input_data, expected, actual, f'The closed form on the {backend} backend')
+            loop = CFPLInterpreter().parse(code).statements[-2]
+            closed_forms += loop.info is not None and loop.info.closed_form is not None
+        # The loops have to actually get closed forms for the test to mean anything
+        self.assertGreater(closed_forms, self.PROGRAMS // 2)
+
+class PythonBackendErrorTest(unittest.TestCase):
+    def test_python_errors_name_the_cfpl_line(self):
+        code = 'VAR a = 1, b = 0 AS INT\nSTART\nOUTPUT: a\nOUTPUT: a % b\nSTOP\n'
+        with self.assertRaises(Exception) as raised:
+            CFPLInterpreter(backend='python').run(code)
+        self.assertEqual(str(raised.exception), 'Interpreter error: integer modulo by zero (CFPL line 4)')
+        self.assertIsInstance(raised.exception.__cause__, ZeroDivisionError)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from evaluator import RECURSIVE_DEPTH_LIMIT, CFPLEvaluator
+from interpreter import CFPLInterpreter
+
+def nested(depth: int) -> str:
+    """a - (a - (... - a)), nested depth levels deep; a itself for an even depth"""
+    return '(a - ' * depth + 'a' + ')' * depth
+
+class DeepExpressionTest(unittest.TestCase):
+    def program(self, depth: int) -> str:
+        expression = nested(depth)
+        return (f'VAR a = 1, b AS INT\nSTART\nb = {expression}\nIF ({expression} > 0)\nSTART\n'
+                f'OUTPUT: {expression}\nSTOP\nWHILE (a < 3 AND {expression} > 0)\nSTART\na = a + 1\nSTOP\n'
+                'OUTPUT: a & " " & b\nSTOP\n')
+
+    def test_deep_expressions_are_chosen_up_front(self):
+        code = self.program(3000)
+        cfpl = CFPLInterpreter()
+        ast = cfpl.parse(code)
+        evaluator = CFPLEvaluator()
+        evaluator.prepare(ast, '')
+        # The assignment, the IF and WHILE conditions and the OUTPUT part
+        self.assertEqual(len(evaluator.deep), 4)
+        self.assertEqual(cfpl.run(code), '1\n3 1')
+
+    def test_shallow_programs_recurse(self):
+        evaluator = CFPLEvaluator()
+        evaluator.prepare(CFPLInterpreter().parse(self.program(RECURSIVE_DEPTH_LIMIT // 2)), '')
+        self.assertEqual(evaluator.deep, frozenset())
+
+    def test_every_backend_runs_deep_expressions(self):
+        code = self.program(3000)
+        for backend in ('tree', 'closure', 'vm', 'python'):
+            self.assertEqual(CFPLInterpreter(backend=backend).run(code), '1\n3 1', backend)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from lexer import CFPLLexer, IncrementalLexer
+
+SOURCE = ('VAR a = 1, b AS INT\nVAR c = \'x\' AS CHAR\nSTART\n'
+          '** a comment\n  b = a * 2.5 + 3\nOUTPUT: a & " [#] " & c\nSTOP\n')
+
+def entries(tokens) -> list:
+    return [(token.type, token.value, token.line, token.column) for token in tokens]
+
+class IncrementalLexerTest(unittest.TestCase):
+    def assert_matches_full_lex(self, incremental: IncrementalLexer):
+        text = '\n'.join(incremental.lines)
+        self.assertEqual(entries(incremental.tokenize()), entries(CFPLLexer(text).tokenize()))
+
+    def test_tokenize_matches_the_full_lexer(self):
+        for text in (SOURCE, '', '\n', 'a', 'a  \n\n  b', SOURCE.rstrip('\n')):
+            self.assert_matches_full_lex(IncrementalLexer(text))
+
+    def test_replace_lines_relexes_only_the_new_lines(self):
+        incremental = IncrementalLexer(SOURCE)
+        untouched = incremental.lexed[0]
+        relexed = incremental.replace_lines(4, 5, ['  b = a - 1', 'a = b'])
+        self.assertEqual(relexed, range(4, 6))
+        self.assertIs(incremental.lexed[0], untouched)
+        self.assertEqual(incremental.lines[4:6], ['  b = a - 1', 'a = b'])
+        self.assert_matches_full_lex(incremental)
+
+    def test_replace_lines_can_insert_and_delete(self):
+        incremental = IncrementalLexer(SOURCE)
+        self.assertEqual(incremental.replace_lines(3, 3, ['c = \'y\'']), range(3, 4))
+        self.assert_matches_full_lex(incremental)
+        self.assertEqual(incremental.replace_lines(3, 5, []), range(3, 3))
+        self.assert_matches_full_lex(incremental)
+
+    def test_errors_follow_edits(self):
+        incremental = IncrementalLexer(SOURCE)
+        incremental.replace_lines(4, 5, ['b = $'])
+        self.assertEqual(incremental.errors(), [(5, incremental.line_error(4))])
+        with self.assertRaises(Exception) as raised:
+            incremental.tokenize()
+        self.assertTrue(str(raised.exception).startswith('Lexical error at line 5: '))
+        # The error moves with the line when lines are inserted above it
+        incremental.replace_lines(0, 0, ['** new first line'])
+        self.assertEqual([number for number, _ in incremental.errors()], [6])
+        incremental.replace_lines(5, 6, ['b = 1'])
+        self.assertEqual(incremental.errors(), [])
+        self.assert_matches_full_lex(incremental)
+
+    def test_nul_ends_the_source(self):
+        incremental = IncrementalLexer('a = 1\nb = 2\0 junk\nc = 3')
+        self.assert_matches_full_lex(incremental)
+        self.assertEqual(incremental.tokenize()[-2].value, 2)
+
+    def test_line_tokens(self):
+        incremental = IncrementalLexer(SOURCE)
+        self.assertEqual([(token.value, token.line, token.column) for token in incremental.line_tokens(4)],
+                         [('b', 5, 3), ('=', 5, 5), ('a', 5, 7), ('*', 5, 9), (2.5, 5, 11), ('+', 5, 15),
+                          (3, 5, 17)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from exceptions import ExecutionStopped
+from interpreter import CFPLInterpreter
+from lexer import CFPLLexer
+from limits import ExecutionLimits
+from metrics import Counter, Histogram, InterpreterMetrics
+
+PROGRAM = ('VAR i = 0 AS INT\nSTART\nWHILE (i < 3)\nSTART\ni = i + 1\nOUTPUT: "é" & i\nSTOP\n'
+           'OUTPUT: "done"\nSTOP\n')
+ENDLESS = 'VAR i = 0 AS INT\nSTART\nWHILE (i >= 0)\nSTART\ni = i + 1\nOUTPUT: i\nSTOP\nSTOP\n'
+
+def series(histogram: Histogram, *label_values: str) -> tuple:
+    """(count, sum) of the values histogram observed with label_values"""
+    counts, count, total = histogram.series.get(label_values, (None, 0, 0))
+    return count, total
+
+class MetricTypesTest(unittest.TestCase):
+    def test_counter(self):
+        counter = Counter('runs_total', 'Runs', ('status',))
+        counter.inc(1, 'ok')
+        counter.inc(2, 'ok')
+        counter.inc(1, 'say "hi"\n')
+        self.assertEqual(counter.prometheus(), [
+            '# HELP runs_total Runs', '# TYPE runs_total counter',
+            'runs_total{status="ok"} 3', 'runs_total{status="say \\"hi\\"\\n"} 1',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('sizes', 'Sizes', (10, 100))
+        for value in (1, 10, 11, 1000):
+            histogram.observe(value)
+        self.assertEqual(histogram.prometheus(), [
+            '# HELP sizes Sizes', '# TYPE sizes histogram',
+            'sizes_bucket{le="10"} 2', 'sizes_bucket{le="100"} 3', 'sizes_bucket{le="+Inf"} 4',
+            'sizes_sum 1022', 'sizes_count 4',
+        ])
+        self.assertEqual(histogram.snapshot()['values'],
+                         [{'labels': {}, 'buckets': [['10', 2], ['100', 3], ['+Inf', 4]], 'count': 4, 'sum': 1022}])
+
+class InterpreterMetricsTest(unittest.TestCase):
+    def test_runs_record_their_phases_and_sizes(self):
+        metrics = InterpreterMetrics()
+        cfpl = CFPLInterpreter(metrics=metrics)
+        output = cfpl.run(PROGRAM)
+        cfpl.run(PROGRAM)
+        self.assertEqual(metrics.runs.values, {('ok',): 2})
+        self.assertEqual(metrics.cache_hits.values, {(): 1})
+        # The second run reused the parsed program
+        self.assertEqual(series(metrics.phase_seconds, 'lex')[0], 1)
+        self.assertEqual(series(metrics.phase_seconds, 'parse')[0], 1)
+        self.assertEqual(series(metrics.phase_seconds, 'execute')[0], 2)
+        self.assertEqual(series(metrics.tokens), (1, len(CFPLLexer(PROGRAM).tokenize())))
+        self.assertEqual(series(metrics.output_bytes), (2, 2 * len(output.encode('utf-8'))))
+        # Statements are only counted on request
+        self.assertEqual(series(metrics.statements), (0, 0))
+
+    def test_statement_estimates(self):
+        metrics = InterpreterMetrics()
+        CFPLInterpreter(metrics=metrics, count_statements=True).run(PROGRAM)
+        CFPLInterpreter(metrics=metrics, limits=ExecutionLimits(max_steps=1000)).run(PROGRAM)
+        # VAR, WHILE and the last OUTPUT, and three iterations of a
+        # condition and two statements
+        self.assertEqual(series(metrics.statements), (2, 2 * (3 + 3 * 3)))
+
+    def test_runs_are_counted_by_how_they_end(self):
+        metrics = InterpreterMetrics()
+        cfpl = CFPLInterpreter(metrics=metrics, limits=ExecutionLimits(max_iterations=10))
+        with self.assertRaises(ExecutionStopped):
+            cfpl.run(ENDLESS)
+        with self.assertRaises(Exception):
+            cfpl.run('START\nOUTPUT: $\nSTOP\n')
+        cfpl.run(PROGRAM)
+        self.assertEqual(metrics.runs.values, {('stopped',): 1, ('error',): 1, ('ok',): 1})
+
+    def test_interpreters_can_share_metrics(self):
+        metrics = InterpreterMetrics(prefix='shared')
+        CFPLInterpreter(metrics=metrics).run(PROGRAM)
+        CFPLInterpreter(metrics=metrics, backend='vm').run(PROGRAM)
+        self.assertEqual(metrics.runs.values, {('ok',): 2})
+        self.assertEqual(set(metrics.snapshot()),
+                         {'shared_runs_total', 'shared_parse_cache_hits_total', 'shared_phase_duration_seconds',
+                          'shared_program_tokens', 'shared_program_nodes', 'shared_statements_executed_estimate',
+                          'shared_output_bytes'})
+
+    def test_write_prometheus(self):
+        metrics = InterpreterMetrics()
+        CFPLInterpreter(metrics=metrics).run(PROGRAM)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cfpl.prom')
+            metrics.write_prometheus(path)
+            self.assertEqual(os.listdir(directory), ['cfpl.prom'])
+            with open(path, encoding='utf-8') as file:
+                text = file.read()
+        self.assertEqual(text, metrics.prometheus())
+        self.assertIn('cfpl_runs_total{status="ok"} 1\n', text)
+        self.assertIn('cfpl_phase_duration_seconds_count{phase="execute"} 1\n', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+import output_sink
+from interpreter import CFPLInterpreter
+from output_sink import BatchSink, BoundedOutput, CallbackSink, FileSink, RingBufferSink
+
+BACKENDS = ('tree', 'closure', 'vm', 'python')
+
+def counting_program(count: int) -> str:
+    return (f'VAR i = 0 AS INT\nSTART\nWHILE (i < {count})\nSTART\ni = i + 1\n'
+            'OUTPUT: "line " & i\nSTOP\nSTOP\n')
+
+FAILING_PROGRAM = 'VAR a = 1, b = 0 AS INT\nSTART\nOUTPUT: "before"\nOUTPUT: a / b\nSTOP\n'
+
+class SinkTest(unittest.TestCase):
+    def test_every_backend_streams_each_line(self):
+        expected = [f'line {i}' for i in range(1, 6)]
+        for backend in BACKENDS:
+            lines = []
+            cfpl = CFPLInterpreter(backend=backend, output_sink=CallbackSink(lines.append))
+            self.assertEqual(cfpl.run(counting_program(5)), '', backend)
+            self.assertEqual(lines, expected, backend)
+
+    def test_lines_before_an_error_are_delivered(self):
+        lines = []
+        cfpl = CFPLInterpreter(output_sink=CallbackSink(lines.append))
+        with self.assertRaises(Exception):
+            cfpl.run(FAILING_PROGRAM)
+        self.assertEqual(lines, ['before'])
+
+    def test_file_sink(self):
+        stream = io.StringIO()
+        cfpl = CFPLInterpreter(output_sink=FileSink(stream))
+        cfpl.run(counting_program(2))
+        cfpl.run(counting_program(1))
+        self.assertEqual(stream.getvalue(), 'line 1\nline 2\nline 1\n')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'output.txt')
+            sink = FileSink(path)
+            CFPLInterpreter(output_sink=sink).run(counting_program(2))
+            sink.close()
+            with open(path, encoding='utf-8') as output:
+                self.assertEqual(output.read(), 'line 1\nline 2\n')
+
+    def test_batch_sink_sends_full_batches_and_the_rest_at_the_end(self):
+        batches = []
+        sink = BatchSink(batches.append, max_lines=3, interval=3600)
+        CFPLInterpreter(output_sink=sink).run(counting_program(7))
+        self.assertEqual(batches, ['line 1\nline 2\nline 3', 'line 4\nline 5\nline 6', 'line 7'])
+
+    def test_batch_sink_sends_after_the_interval(self):
+        batches = []
+        clock = mock.Mock(return_value=0.0)
+        with mock.patch.object(output_sink.time, 'monotonic', clock):
+            sink = BatchSink(batches.append, max_lines=100, interval=1.0)
+            sink.start()
+            sink.append('a')
+            clock.return_value = 1.5
+            sink.append('b')
+            sink.append('c')
+            sink.flush()
+        self.assertEqual(batches, ['a\nb', 'c'])
+
+    def test_ring_buffer_keeps_the_last_lines_of_each_run(self):
+        cfpl = CFPLInterpreter(output_sink=RingBufferSink(max_lines=2))
+        self.assertEqual(cfpl.run(counting_program(5)), 'line 4\nline 5')
+        self.assertEqual(cfpl.run(counting_program(1)), 'line 1')
+
+    def test_removing_the_sink_collects_output_again(self):
+        cfpl = CFPLInterpreter(output_sink=RingBufferSink(max_lines=1))
+        cfpl.set_output_sink(None)
+        self.assertEqual(cfpl.run(counting_program(2)), 'line 1\nline 2')
+
+class BoundedOutputTest(unittest.TestCase):
+    def filled(self, lines: list, **options) -> BoundedOutput:
+        sink = BoundedOutput(**options)
+        self.addCleanup(sink.close)
+        for line in lines:
+            sink.append(line)
+        return sink
+
+    def test_short_output_is_kept_whole(self):
+        sink = self.filled(['a', 'b'], max_bytes=100)
+        self.assertEqual(sink.text(), 'a\nb')
+        self.assertFalse(sink.truncation()['truncated'])
+        self.assertIsNone(sink.spill)
+
+    def test_head_and_tail_are_kept_and_the_middle_spilled(self):
+        # Lines of 3 bytes (newline included): 4 fit in the head, 3 in the tail
+        lines = [f'{i:02}' for i in range(20)]
+        sink = self.filled(lines, max_bytes=21, head_bytes=12)
+        self.assertEqual(sink.truncation(), {
+            'truncated': True, 'lines': 20, 'bytes': 60, 'head_lines': 4,
+            'omitted_lines': 13, 'omitted_bytes': 39, 'tail_lines': 3,
+        })
+        self.assertEqual(sink.text(), '\n'.join(lines[:4] + ['... 13 lines (39 bytes) omitted ...'] + lines[-3:]))
+
+    def test_read_lines_across_the_head_spill_and_tail(self):
+        lines = [f'line {i} ' + 'é' * (i % 3) for i in range(40)]
+        with mock.patch.object(output_sink, 'SPILL_INDEX_INTERVAL', 4):
+            sink = self.filled(lines, max_bytes=80, head_bytes=30)
+            head, spilled = len(sink.head), sink.spilled_lines
+            self.assertGreater(spilled, 8)
+            self.assertGreater(len(sink.tail), 1)
+            boundaries = (0, head - 1, head, head + 3, head + 4, head + spilled - 1, head + spilled, 39)
+            for start in boundaries:
+                for count in (0, 1, 2, 5, 50):
+                    self.assertEqual(sink.read_lines(start, count), lines[start:start + count], (start, count))
+            self.assertEqual(sink.read_lines(0, 40), lines)
+            self.assertEqual(sink.read_lines(40, 5), [])
+            # Reading spilled lines back does not disturb later spilling
+            sink.append('last')
+            self.assertEqual(sink.read_lines(0, 41), lines + ['last'])
+
+    def test_start_resets_between_runs(self):
+        cfpl = CFPLInterpreter(output_sink=BoundedOutput(max_bytes=40))
+        self.addCleanup(cfpl.output_sink.close)
+        cfpl.run(counting_program(50))
+        self.assertTrue(cfpl.output_sink.truncation()['truncated'])
+        self.assertEqual(cfpl.run(counting_program(2)), 'line 1\nline 2')
+        self.assertEqual(cfpl.output_sink.read_lines(0, 5), ['line 1', 'line 2'])
+
+    def test_only_head_lines_are_forwarded(self):
+        lines = []
+        sink = self.filled([f'{i:02}' for i in range(10)], max_bytes=12, head_bytes=6,
+                           forward=CallbackSink(lines.append))
+        self.assertEqual(lines, ['00', '01'])
+        self.assertEqual(sink.read_lines(8, 2), ['08', '09'])
+
+if __name__ == '__main__':
+    unittest.main()
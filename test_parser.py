@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from interpreter import CFPLInterpreter
+from lexer import CFPLLexer
+from parser import CFPLParser, TokenWindow
+from token_types import Token, TokenType
+
+PROGRAM = 'VAR a = 1, b AS INT\nSTART\nb = a * 2 + 3\nOUTPUT: a & " " & b\nSTOP\n'
+
+class CountingIterator:
+    """Token iterator that counts how many tokens were taken from it"""
+    def __init__(self, count: int):
+        self.tokens = iter([Token(TokenType.IDENTIFIER, f'v{i}', 1, i + 1) for i in range(count)])
+        self.taken = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = next(self.tokens)
+        self.taken += 1
+        return token
+
+class TokenWindowTest(unittest.TestCase):
+    def test_tokens_are_taken_lazily(self):
+        tokens = CountingIterator(10)
+        window = TokenWindow(tokens)
+        self.assertEqual(tokens.taken, 0)
+        self.assertEqual(window[1].value, 'v1')
+        self.assertEqual(tokens.taken, 2)
+        self.assertEqual(window.consumed, 2)
+        # Looking at buffered tokens again takes nothing more
+        self.assertEqual(window[0].value, 'v0')
+        self.assertEqual(tokens.taken, 2)
+
+    def test_only_the_last_tokens_stay_buffered(self):
+        window = TokenWindow(CountingIterator(10), size=3)
+        self.assertEqual(window[5].value, 'v5')
+        self.assertEqual(window.start, 3)
+        self.assertEqual([window[i].value for i in (3, 4, 5)], ['v3', 'v4', 'v5'])
+        with self.assertRaises(Exception) as raised:
+            window[2]
+        self.assertEqual(str(raised.exception), 'Token 2 is no longer buffered')
+
+    def test_reading_past_the_end_raises_index_error(self):
+        window = TokenWindow(CountingIterator(3))
+        with self.assertRaises(IndexError):
+            window[3]
+        self.assertEqual(window.consumed, 3)
+        self.assertEqual(window[2].value, 'v2')
+
+    def test_parser_gives_the_same_program_from_a_stream(self):
+        from_list = CFPLParser(CFPLLexer(PROGRAM).tokenize()).parse_program()
+        parser = CFPLParser(CFPLLexer(PROGRAM).iter_tokens())
+        self.assertIsInstance(parser.tokens, TokenWindow)
+        from_stream = parser.parse_program()
+        self.assertEqual(repr(from_stream), repr(from_list))
+
+    def test_run_file_streams_the_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.cfpl')
+            with open(path, 'w', encoding='utf-8') as source:
+                source.write(PROGRAM)
+            self.assertEqual(CFPLInterpreter().run_file(path), CFPLInterpreter().run(PROGRAM))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import itertools
+import unittest
+from interpreter import CFPLInterpreter
+from profiler import Profiler
+
+PROGRAM = ('VAR i = 0 AS INT\nSTART\nWHILE (i < 2)\nSTART\ni = i + 1\nOUTPUT: i\nSTOP\n'
+           'OUTPUT: "done"\nSTOP\n')
+
+def ticking_profiler() -> Profiler:
+    """A profiler whose clock advances by one second every time it is read"""
+    ticks = itertools.count()
+    return Profiler(clock=lambda: float(next(ticks)))
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.profiler = ticking_profiler()
+        self.output = CFPLInterpreter().run(PROGRAM, profiler=self.profiler)
+
+    def test_profiled_runs_give_the_same_output(self):
+        for backend in ('tree', 'closure', 'vm', 'python'):
+            cfpl = CFPLInterpreter(backend=backend)
+            self.assertEqual(cfpl.run(PROGRAM, profiler=Profiler()), cfpl.run(PROGRAM), backend)
+            self.assertEqual(cfpl.get_variables(), {'i': 2}, backend)
+
+    def test_line_profiles(self):
+        self.assertEqual(self.output, '1\n2\ndone')
+        self.assertEqual(self.profiler.total_time, 15.0)
+        self.assertEqual([(line.line, line.hits, line.total_time, line.self_time) for line in self.profiler.lines()],
+                         [(1, 1, 1.0, 1.0), (3, 1, 9.0, 5.0), (5, 2, 2.0, 2.0), (6, 2, 2.0, 2.0), (8, 1, 1.0, 1.0)])
+
+    def test_report(self):
+        report = self.profiler.report().split('\n')
+        self.assertEqual(report[0], 'Total time: 15.000000 s')
+        self.assertEqual(report[4].split(), ['3', '1', '9.000000', '5.000000', '33.3%', 'WHILE', '(i', '<', '2)'])
+
+    def test_collapsed_stacks(self):
+        self.assertEqual(self.profiler.collapsed().split('\n'), [
+            'program 4000000',
+            'program;VAR line 1 1000000',
+            'program;WHILE line 3 5000000',
+            'program;WHILE line 3;assignment line 5 2000000',
+            'program;WHILE line 3;OUTPUT line 6 2000000',
+            'program;OUTPUT line 8 1000000',
+        ])
+
+    def test_json_heat(self):
+        profile = self.profiler.to_json()
+        self.assertEqual(profile['total_time'], 15.0)
+        self.assertEqual([line['heat'] for line in profile['lines']], [0.2, 1.0, 0.4, 0.4, 0.2])
+
+    def test_failed_runs_keep_the_time_up_to_the_error(self):
+        profiler = ticking_profiler()
+        with self.assertRaises(Exception):
+            CFPLInterpreter().run('VAR a = 0 AS INT\nSTART\nWHILE (a < 5)\nSTART\na = a + 1\n'
+                                  'OUTPUT: 1 / (3 - a)\nSTOP\nSTOP\n', profiler=profiler)
+        lines = {line.line: line for line in profiler.lines()}
+        self.assertEqual(lines[6].hits, 3)
+        self.assertEqual(lines[3].total_time, lines[3].self_time + lines[5].total_time + lines[6].total_time)
+
+    def test_start_forgets_the_last_run(self):
+        self.profiler.start('')
+        self.assertEqual(self.profiler.lines(), [])
+        self.assertEqual(self.profiler.to_json(), {'total_time': 0, 'lines': []})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import unittest
+from interpreter import CFPLInterpreter
+from program_cache import DiskProgramCache, ProgramCache, source_key
+
+PROGRAM = 'VAR a = 1 AS INT\nSTART\nOUTPUT: a + 1\nSTOP\n'
+
+class ProgramCacheTest(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ProgramCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.info(), {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_putting_an_existing_key_refreshes_it(self):
+        cache = ProgramCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 10)
+        cache.put('c', 3)
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertEqual(cache.get('a'), 10)
+
+    def test_size_zero_disables_caching(self):
+        cache = ProgramCache(0)
+        cache.put('a', 1)
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get('a'))
+        with self.assertRaises(ValueError):
+            ProgramCache(-1)
+
+    def test_clear(self):
+        cache = ProgramCache()
+        cache.put('a', 1)
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(cache.info(), {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 64})
+
+    def test_runs_reuse_the_parsed_program(self):
+        cfpl = CFPLInterpreter(cache_size=4)
+        self.assertEqual(cfpl.run(PROGRAM), cfpl.run(PROGRAM))
+        self.assertEqual(cfpl.program_cache.info()['hits'], 1)
+        self.assertIsNotNone(cfpl.program_cache.get(source_key(PROGRAM)))
+
+class DiskProgramCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = DiskProgramCache(self.directory, version='test')
+        self.key = source_key(PROGRAM)
+
+    def rewrite(self, change):
+        path = self.cache.path_for(self.key)
+        with open(path, 'rb') as entry:
+            data = bytearray(entry.read())
+        change(data)
+        with open(path, 'wb') as entry:
+            entry.write(data)
+
+    def assert_invalid(self):
+        self.assertIsNone(self.cache.get(self.key))
+        self.assertEqual(self.cache.info()['invalid'], 1)
+        self.assertFalse(os.path.exists(self.cache.path_for(self.key)))
+
+    def test_round_trip(self):
+        self.assertIsNone(self.cache.get(self.key))
+        self.cache.put(self.key, {'program': [1, 2]})
+        self.assertEqual(self.cache.get(self.key), {'program': [1, 2]})
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.invalid), (1, 1, 0))
+        # Only the renamed entry is left behind
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.cache.path_for(self.key))])
+
+    def test_corrupt_header_is_a_miss(self):
+        self.cache.put(self.key, [1])
+        def corrupt(data):
+            data[0] ^= 0xFF
+        self.rewrite(corrupt)
+        self.assert_invalid()
+
+    def test_truncated_entry_is_a_miss(self):
+        self.cache.put(self.key, [1])
+        header = len(self.cache.header(self.key, b''))
+        def truncate(data):
+            # Cut the entry inside its digest
+            del data[header + 4:]
+        self.rewrite(truncate)
+        self.assert_invalid()
+
+    def test_digest_mismatch_is_a_miss(self):
+        self.cache.put(self.key, [1, 2, 3])
+        def corrupt(data):
+            data[-2] ^= 0x01
+        self.rewrite(corrupt)
+        self.assert_invalid()
+
+    def test_entries_belong_to_one_key_and_version(self):
+        self.cache.put(self.key, [1])
+        other = source_key('other')
+        os.replace(self.cache.path_for(self.key), self.cache.path_for(other))
+        self.assertIsNone(self.cache.get(other))
+        self.cache.put(self.key, [1])
+        self.assertIsNone(DiskProgramCache(self.directory, version='newer').get(self.key))
+
+    def test_clear_removes_this_version_only(self):
+        self.cache.put(self.key, [1])
+        DiskProgramCache(self.directory, version='newer').put(self.key, [2])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(self.key))
+        self.assertEqual(DiskProgramCache(self.directory, version='newer').get(self.key), [2])
+
+    def test_interpreters_share_parsed_programs(self):
+        first = CFPLInterpreter(cache_dir=self.directory)
+        output = first.run(PROGRAM)
+        second = CFPLInterpreter(cache_dir=self.directory)
+        self.assertEqual(second.run(PROGRAM), output)
+        self.assertEqual(second.disk_cache.hits, 1)
+
+if __name__ == '__main__':
+    unittest.main()
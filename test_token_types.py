@@ -0,0 +1,54 @@
+import io
+import unittest
+from lexer import CFPLLexer
+from token_types import TokenStream, TokenType
+
+SOURCE = ('VAR a = 1, b AS INT\nSTART\n** counts up\n  b = a + 1\n\tOUTPUT: a & " [&] " & b ** done\n'
+          'IF (a >= 1 AND b <> 2)\nSTART\nb = b * 1.5\nSTOP\nSTOP')
+
+def entries(tokens) -> list:
+    return [(token.type, token.value, token.line, token.column) for token in tokens]
+
+class TokenStreamTest(unittest.TestCase):
+    def test_compact_stream_matches_tokens(self):
+        for text in (SOURCE, SOURCE + '\n', '', '\n\n', 'a  ', 'a = 1\0 ignored $'):
+            self.assertEqual(entries(CFPLLexer(text).tokenize_compact()), entries(CFPLLexer(text).tokenize()), text)
+
+    def test_streamed_sources_match_in_memory_ones(self):
+        from_file = CFPLLexer(io.StringIO(SOURCE)).tokenize_compact()
+        from_text = CFPLLexer(SOURCE).tokenize_compact()
+        self.assertEqual(entries(from_file), entries(from_text))
+        self.assertEqual(from_file.values, from_text.values)
+
+    def test_values_are_interned(self):
+        stream = CFPLLexer('a = a + 1\na = 1').tokenize_compact()
+        self.assertEqual(stream.value_ids[0], stream.value_ids[2])
+        self.assertEqual(stream.value_ids[4], stream.value_ids[8])
+        # The integer 1 and the identifier a are distinct entries
+        self.assertNotEqual(stream.value_ids[0], stream.value_ids[4])
+        self.assertEqual(len(stream.values), len(set(stream.values)))
+
+    def test_accessors(self):
+        stream = TokenStream()
+        stream.append(TokenType.IDENTIFIER, 'a', 1, 1)
+        stream.append(TokenType.INTEGER, 7, 2, 5)
+        stream.append(TokenType.EOF, None, 2, 6)
+        self.assertEqual(len(stream), 3)
+        self.assertEqual(stream.type_at(1), TokenType.INTEGER)
+        self.assertEqual(stream.value_at(1), 7)
+        self.assertEqual(stream.position_at(1), (2, 5))
+        self.assertEqual(entries([stream[-1]]), [(TokenType.EOF, None, 2, 6)])
+        self.assertEqual(entries(stream[:2]), [(TokenType.IDENTIFIER, 'a', 1, 1), (TokenType.INTEGER, 7, 2, 5)])
+        with self.assertRaises(IndexError):
+            stream[3]
+        with self.assertRaises(IndexError):
+            stream[-4]
+
+    def test_lexical_errors_name_their_line(self):
+        for lex in (lambda text: CFPLLexer(text).tokenize_compact(), lambda text: CFPLLexer(text).tokenize()):
+            with self.assertRaises(Exception) as raised:
+                lex('a = 1\nb = $\nc = $')
+            self.assertTrue(str(raised.exception).startswith('Lexical error at line 2'), str(raised.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
+from array import array
+from collections.abc import Sequence
 from enum import Enum
-from typing import Any
+from typing import Any, Iterable
 
 class TokenType(Enum):
     # Data types
@@ -62,11 +64,102 @@ class TokenType(Enum):
     COMMENT = 'COMMENT'
 
 class Token:
-    def __init__(self, type_: TokenType, value: Any, line: int = 0):
+    __slots__ = ('type', 'value', 'line', 'column')
+
+    def __init__(self, type_: TokenType, value: Any, line: int = 0, column: int = 0):
         self.type = type_
         self.value = value
         self.line = line
+        self.column = column
     
     def __repr__(self):
         return f'Token({self.type}, {self.value})'
-      
\ No newline at end of file
+      
+
+# Compact one-byte codes for TokenStream
+TOKEN_TYPES = list(TokenType)
+TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
+class TokenStream(Sequence):
+    """
+    Array-backed token sequence: one byte of type code, one value index and
+    a line and column number per token instead of a Token object. Values are interned
+    in a table of distinct (type, value) pairs, so repeated identifiers,
+    keywords and literals are stored once. Indexing materialises a
+    (slotted) Token view of the entry on demand.
+    """
+    def __init__(self):
+        self.types = array('B')
+        self.value_ids = array('I')
+        self.lines = array('I')
+        self.columns = array('I')
+        self.values = []
+        self.value_index = {}
+    
+    def intern(self, entry: tuple) -> int:
+        value_id = self.value_index.get(entry)
+        if value_id is None:
+            value_id = self.value_index[entry] = len(self.values)
+            self.values.append(entry)
+        return value_id
+    
+    def append(self, type_: TokenType, value: Any, line: int, column: int = 0):
+        self.types.append(TYPE_CODES[type_])
+        self.value_ids.append(self.intern((type_, value)))
+        self.lines.append(line)
+        self.columns.append(column)
+    
+    def extend(self, entries: Iterable[tuple], line: int = 1) -> int:
+        """
+        Append the ((type, value), leading blanks, width) entries produced by
+        CFPLLexer.scan(), numbering lines from line onwards. Returns the
+        column just past the last entry.
+        """
+        types = self.types.append
+        value_ids = self.value_ids.append
+        lines = self.lines.append
+        columns = self.columns.append
+        value_index = self.value_index
+        type_codes = TYPE_CODES
+        newline = TokenType.NEWLINE
+        column = 1
+        for pair, blanks, width in entries:
+            value_id = value_index.get(pair)
+            if value_id is None:
+                value_id = self.intern(pair)
+            types(type_codes[pair[0]])
+            value_ids(value_id)
+            lines(line)
+            columns(column + blanks)
+            if pair[0] is newline:
+                line += 1
+                column = 1
+            else:
+                column += width
+        return column
+    
+    def type_at(self, index: int) -> TokenType:
+        return TOKEN_TYPES[self.types[index]]
+    
+    def value_at(self, index: int) -> Any:
+        return self.values[self.value_ids[index]][1]
+    
+    def position_at(self, index: int) -> tuple:
+        return self.lines[index], self.columns[index]
+    
+    def token_at(self, index: int) -> Token:
+        type_code = self.types[index]
+        return Token(TOKEN_TYPES[type_code], self.values[self.value_ids[index]][1],
+                     self.lines[index], self.columns[index])
+    
+    def __len__(self):
+        return len(self.types)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.token_at(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self.types)
+        if index < 0:
+            raise IndexError(index)
+        return self.token_at(index)
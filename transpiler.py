@@ -0,0 +1,358 @@
+import linecache
+import math
+import weakref
+from typing import Any, Dict, List
+from ast_nodes import Node, NodeVisitor, Program, Text, tree_depth
+from config import DEFAULT_VALUES
+from evaluator import CFPLEvaluator, UNSET
+from exceptions import ExecutionStopped
+from limits import iteration_steps
+from program_cache import source_key
+from resolver import resolve
+
+# Python's own parser and compiler limit how deeply code may nest; deeper
+# programs are left to the tree-walking evaluator
+TRANSPILE_DEPTH_LIMIT = 90
+
+# Python operators for CFPL operators whose semantics Python shares; /
+# (zero check first) is handled separately. Python compiles comparisons and
+# and / or in an if or while condition straight into branches.
+PYTHON_OPERATORS = {
+    'or': 'or', 'and': 'and',
+    '==': '==', '<>': '!=', '>': '>', '<': '<', '>=': '>=', '<=': '<=',
+    '+': '+', '-': '-', '*': '*', '%': '%',
+}
+
+PYTHON_UNARY_OPERATORS = {'+': '+', '-': '-', 'NOT': 'not '}
+
+class PythonProgram:
+    """Python source generated for a CFPL program, with its line map and code object"""
+    def __init__(self, source: str, line_map: List[int], variables: Dict[str, str], filename: str,
+                 constants: Dict[str, Any] = None):
+        self.source = source
+        # line_map[n] is the CFPL line of Python line n (1-based; 0 unknown)
+        self.line_map = line_map
+        # CFPL variable name -> Python local name, in declaration order
+        self.variables = variables
+        self.filename = filename
+        self.code = compile(source, filename, 'exec')
+        # Objects the generated code refers to by name
+        namespace = dict(constants or {}, UNSET=UNSET)
+        exec(self.code, namespace)
+        self.function = namespace['cfpl_program']
+        # Let tracebacks show the generated source while the program is around
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        weakref.finalize(self, linecache.cache.pop, filename, None)
+
+    def cfpl_line(self, traceback) -> int:
+        """CFPL line of the innermost traceback entry in the generated code, or 0"""
+        line = 0
+        while traceback is not None:
+            if traceback.tb_frame.f_code.co_filename == self.filename:
+                lineno = traceback.tb_lineno
+                if lineno < len(self.line_map):
+                    line = self.line_map[lineno] or line
+            traceback = traceback.tb_next
+        return line
+
+class PythonTranspiler(NodeVisitor):
+    """
+    Translates a syntax tree into the source of a Python function,
+    cfpl_program(runtime, values), whose locals are the CFPL variables.
+    Every CFPL variable is declared before START, so references to names
+    that were never declared compile to a call that raises the
+    undefined-variable error when (and only if) it is reached. With
+    limited, loops report their iterations to the runtime's ExecutionBudget.
+    """
+    def __init__(self, limited: bool = False):
+        super().__init__()
+        self.limited = limited
+        self.lines = []
+        self.line_map = [0]
+        self.indent = 1
+        self.line = 0
+        self.temporaries = 0
+        self.variables = {}
+        self.types = []
+        self.constants = {}
+
+    def transpile(self, program: Program, filename: str = None) -> PythonProgram:
+        """
+        The PythonProgram of program; its code is compiled as filename, by
+        default one naming the hash of the generated source
+        """
+        if program.names is None:
+            resolve(program)
+        for var_name in program.names:
+            self.declare(var_name)
+        self.types = program.types
+
+        self.emit('try:')
+        self.indent += 1
+        self.visit(program)
+        self.emit('pass')
+        self.indent -= 1
+        self.emit('finally:')
+        self.indent += 1
+        # Declared variables are all assigned before anything can fail;
+        # copy them back into the value slots
+        self.emit(f"values[:] = [{', '.join(self.variables.values())}]")
+
+        header = [
+            'def cfpl_program(runtime, values):',
+            '    append = runtime.output.append',
+            '    divide = runtime.checked_divide',
+            '    undefined = runtime.undefined',
+            '    read = runtime.input_value',
+            '    closed_form = runtime.apply_closed_form',
+            '    unset = UNSET',
+        ]
+        if self.limited:
+            header.append('    charge = runtime.budget.charge')
+        source = '\n'.join(header + self.lines) + '\n'
+        line_map = [0] * len(header) + self.line_map
+        if filename is None:
+            filename = f'<cfpl {source_key(source)[:16]}>'
+        return PythonProgram(source, line_map, dict(self.variables), filename, self.constants)
+
+    def declare(self, var_name: str) -> str:
+        local = self.variables.get(var_name)
+        if local is None:
+            local = 'v_' + var_name
+            if not local.isidentifier():
+                local = f'v{len(self.variables)}'
+            self.variables[var_name] = local
+        return local
+
+    def emit(self, code: str):
+        self.lines.append('    ' * self.indent + code)
+        self.line_map.append(self.line)
+
+    def temporary(self) -> str:
+        self.temporaries += 1
+        return f't{self.temporaries}'
+
+    def generic_visit(self, node: Node):
+        raise Exception(f"Cannot transpile node: {node!r}")
+
+    # Expressions; every operation is parenthesized, since Python chains
+    # comparisons where CFPL does not
+
+    def literal(self, value) -> str:
+        if isinstance(value, float) and not math.isfinite(value):
+            return f"float('{value}')"
+        return repr(value)
+
+    def visit_Literal(self, node):
+        return self.literal(node.value)
+
+    def visit_Var(self, node):
+        local = self.variables.get(node.name)
+        if local is None:
+            return f'undefined({node.name!r}, {node.line})'
+        return local
+
+    def binary(self, node: Node, op: str, left: str, right: str) -> str:
+        if op == '/':
+            return f'divide({left}, {right}, {node.line})'
+        return f'({left} {PYTHON_OPERATORS[op]} {right})'
+
+    def visit_BinaryOp(self, node):
+        return self.binary(node, node.op, self.visit(node.left), self.visit(node.right))
+
+    def visit_Chain(self, node):
+        source = self.visit(node.operands[0])
+        for op, operand in zip(node.ops, node.operands[1:]):
+            source = self.binary(node, op, source, self.visit(operand))
+        return source
+
+    def visit_UnaryOp(self, node):
+        if node.op == 'FLOAT':
+            return f'float({self.visit(node.operand)})'
+        return f'({PYTHON_UNARY_OPERATORS[node.op]}{self.visit(node.operand)})'
+
+    def visit_Invariant(self, node):
+        local = f'c{node.slot}'
+        return f'({local} if {local} is not unset else ({local} := {self.visit(node.expr)}))'
+
+    # Statements
+
+    def block(self, statements: List[Node]):
+        self.indent += 1
+        for statement in statements:
+            self.visit(statement)
+        if not statements:
+            self.emit('pass')
+        self.indent -= 1
+
+    def check_defined(self, var_names: List[str], line: int) -> bool:
+        """Emit the undefined-variable error for the first undeclared name, if any"""
+        for var_name in var_names:
+            if var_name not in self.variables:
+                self.emit(f'undefined({var_name!r}, {line})')
+                return False
+        return True
+
+    def visit_VarDecl(self, node):
+        self.line = node.line
+        default = DEFAULT_VALUES[node.var_type.name]
+        for var_name, initial_value in node.variables:
+            value = default if initial_value is None else initial_value
+            self.emit(f'{self.variables[var_name]} = {self.literal(value)}')
+
+    def visit_Assign(self, node):
+        self.line = node.line
+        if self.check_defined([node.name], node.line):
+            self.emit(f'{self.variables[node.name]} = {self.visit(node.value)}')
+
+    def visit_ChainAssign(self, node):
+        self.line = node.line
+        if self.check_defined(node.names, node.line):
+            targets = ' = '.join(self.variables[var_name] for var_name in node.names)
+            self.emit(f'{targets} = {self.visit(node.value)}')
+
+    def visit_Output(self, node):
+        self.line = node.line
+        parts = []
+        for part in node.parts:
+            if isinstance(part, Text):
+                parts.append(repr(part.value))
+            elif part.type == 'CHAR':
+                parts.append(self.visit(part))
+            else:
+                parts.append(f'str({self.visit(part)})')
+        if len(parts) <= 3:
+            self.emit(f"append({' + '.join(parts)})")
+        else:
+            # join sizes the result once rather than once per +
+            self.emit(f"append(''.join(({', '.join(parts)})))")
+
+    def visit_Input(self, node):
+        self.line = node.line
+        for i, var_name in enumerate(node.names):
+            if not self.check_defined([var_name], node.line):
+                break
+            var_type = self.types[node.slots[i]]
+            self.emit(f'{self.variables[var_name]} = read({i}, {var_name!r}, {var_type!r}, {node.line})')
+
+    def visit_If(self, node):
+        self.line = node.line
+        self.emit(f'if {self.visit(node.condition)}:')
+        self.block(node.body)
+        if node.orelse:
+            self.line = node.line
+            self.emit('else:')
+            self.block(node.orelse)
+
+    def visit_While(self, node):
+        self.line = node.line
+        for slot in node.invariants:
+            self.emit(f'c{slot} = unset')
+        closed_form = node.info.closed_form if node.info is not None else None
+        if closed_form is None:
+            self.loop(node)
+            return
+
+        # Compute the result directly, running the loop only if that fails
+        name = f'closed{len(self.constants)}'
+        self.constants[name] = closed_form
+        locals_ = list(self.variables.values())
+        reads = ', '.join(f'{slot}: {locals_[slot]}' for slot in closed_form.reads)
+        result = self.temporary()
+        self.emit(f'{result} = closed_form({name}, {{{reads}}}.__getitem__)')
+        self.emit(f'if {result} is None:')
+        self.indent += 1
+        self.loop(node)
+        self.indent -= 1
+        self.emit('else:')
+        self.indent += 1
+        targets = ', '.join(locals_[slot] for slot in closed_form.targets)
+        self.emit(f'{targets}, = {result}')
+        self.indent -= 1
+
+    def loop(self, node: Node):
+        """The while statement of a loop, counting its iterations when limited"""
+        if not self.limited:
+            self.emit(f'while {self.visit(node.condition)}:')
+            self.block(node.body)
+            return
+        steps = iteration_steps(node)
+        count, batch = self.temporary(), self.temporary()
+        self.emit(f'{count} = 0')
+        self.emit(f'{batch} = charge(0, {steps}, {node.line})')
+        self.emit(f'while {self.visit(node.condition)}:')
+        self.indent += 1
+        self.emit(f'{count} += 1')
+        self.emit(f'if {count} >= {batch}:')
+        self.indent += 1
+        self.emit(f'{batch} = charge({count}, {steps}, {node.line})')
+        self.emit(f'{count} = 0')
+        self.indent -= 1
+        self.indent -= 1
+        self.block(node.body)
+        self.line = node.line
+        self.emit(f'if {count}:')
+        self.indent += 1
+        self.emit(f'charge({count}, {steps}, {node.line})')
+        self.indent -= 1
+
+    def visit_Program(self, node):
+        for statement in node.statements:
+            self.visit(statement)
+
+class PythonEvaluator(CFPLEvaluator):
+    """
+    Runs programs transpiled to Python by PythonTranspiler. The compiled
+    function of the last program run is kept, so running it again with new
+    input does not transpile it again. Python errors raised inside the
+    generated code get a note naming the CFPL line they come from, which
+    CFPLInterpreter adds to its error message.
+    """
+    def __init__(self):
+        super().__init__()
+        self.compiled_ast = None
+        self.compiled_limited = False
+        self.program = None
+
+    def execute_program(self, ast: Program, input_data: str = ""):
+        self.prepare(ast, input_data)
+
+        limited = self.limits is not None
+        if ast is not self.compiled_ast or limited != self.compiled_limited:
+            program = None
+            if tree_depth(ast) <= TRANSPILE_DEPTH_LIMIT:
+                try:
+                    program = PythonTranspiler(limited).transpile(ast)
+                except (SyntaxError, RecursionError, MemoryError):
+                    # Nested too deeply for Python's compiler
+                    program = None
+            self.compiled_ast, self.compiled_limited, self.program = ast, limited, program
+
+        if self.program is None:
+            return super().execute_program(ast, input_data)
+
+        try:
+            self.program.function(self, self.values)
+        except Exception as e:
+            line = self.program.cfpl_line(e.__traceback__)
+            if line and not str(e).startswith('Runtime error') and not isinstance(e, ExecutionStopped):
+                # What BaseException.add_note() does, on any Python version
+                e.__notes__ = [*getattr(e, '__notes__', ()), f"CFPL line {line}"]
+            raise
+
+        return self.output_text()
+
+    # Helpers called by the generated code
+
+    def checked_divide(self, left, right, line: int):
+        if right == 0:
+            self.error_at("Division by zero", line)
+        return left / right
+
+    def undefined(self, var_name: str, line: int):
+        self.error_at(f"Undefined variable: {var_name}", line)
+
+    def input_value(self, index: int, var_name: str, var_type: str, line: int):
+        if index >= len(self.input_queue):
+            self.error_at(f"Not enough input values provided for variable: {var_name}", line)
+        return self.typed_input(self.input_queue[index].strip(), var_type, var_name, line)
@@ -0,0 +1,265 @@
+from typing import Any, Dict, List, Optional
+from ast_nodes import (Assign, BinaryOp, Chain, ChainAssign, If, Input, Invariant, Literal, Node,
+                       Output, Program, Text, UnaryOp, Var, VarDecl, While)
+
+NUMERIC_TYPES = ('INT', 'FLOAT')
+
+ARITHMETIC_OPERATORS = ('+', '-', '*', '%')
+ORDERING_OPERATORS = ('<', '>', '<=', '>=')
+EQUALITY_OPERATORS = ('==', '<>')
+LOGICAL_OPERATORS = ('and', 'or')
+
+def value_type(value: Any) -> str:
+    """Static type of a literal value"""
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT'
+    if isinstance(value, float):
+        return 'FLOAT'
+    return 'CHAR'
+
+def operator_name(op: str) -> str:
+    return op.upper() if op in LOGICAL_OPERATORS else op
+
+def binary_type(op: str, left: Optional[str], right: Optional[str]) -> Optional[str]:
+    """
+    Type of `left op right`, None if it depends on an operand whose type is
+    not known; raises ValueError for operand types the operator rejects
+    """
+    if op in ORDERING_OPERATORS or op in EQUALITY_OPERATORS:
+        result = 'BOOL'
+    else:
+        # AND / OR give back one of their operands, whatever its type
+        result = None
+    if left is None or right is None:
+        return result
+
+    if op in LOGICAL_OPERATORS:
+        if left == right == 'BOOL':
+            return 'BOOL'
+    elif op in EQUALITY_OPERATORS:
+        if left == right or (left in NUMERIC_TYPES and right in NUMERIC_TYPES):
+            return result
+    elif op in ORDERING_OPERATORS:
+        if left == right == 'CHAR' or (left in NUMERIC_TYPES and right in NUMERIC_TYPES):
+            return result
+    elif left in NUMERIC_TYPES and right in NUMERIC_TYPES:
+        if op == '/' or 'FLOAT' in (left, right):
+            return 'FLOAT'
+        return 'INT'
+    raise ValueError(f"Operator {operator_name(op)} cannot be applied to {left} and {right}")
+
+def unary_type(op: str, operand: Optional[str]) -> Optional[str]:
+    if op == 'NOT':
+        if operand in (None, 'BOOL'):
+            return 'BOOL'
+    elif op == 'FLOAT':
+        return 'FLOAT'
+    elif operand is None or operand in NUMERIC_TYPES:
+        return operand
+    raise ValueError(f"Operator {op} cannot be applied to {operand}")
+
+def widen(expr: Node) -> Node:
+    """expr converted from INT to FLOAT"""
+    if isinstance(expr, Literal):
+        literal = Literal(float(expr.value), expr.line, expr.column)
+        literal.type = 'FLOAT'
+        return literal
+    node = UnaryOp('FLOAT', expr, expr.line, expr.column)
+    node.type = 'FLOAT'
+    return node
+
+class TypeChecker:
+    """
+    Records the static type of every expression of a parsed program on its
+    node, None where it cannot be known before the program runs.
+
+    By default programs run as they always have: a variable holds whatever
+    is assigned to it, INPUT guesses the type of each value, and nothing is
+    reported before the program runs. A variable then has its declared type
+    only if everything the program stores in it has that type.
+
+    With strict, the program is checked against its VAR ... AS declarations
+    instead, and the first mismatch is reported as a type error, even in
+    code that would never run. An INT value may be stored in a FLOAT
+    variable; it is converted when it is assigned, so FLOAT variables only
+    ever hold floats, and INPUT converts values to the declared type.
+    Names that are never declared have no type; using them is still
+    reported at run time, when (and if) they are reached.
+    """
+    def __init__(self, strict: bool = False):
+        self.strict = strict
+        self.types: Dict[str, Optional[str]] = {}
+
+    def error(self, message: str, node: Node):
+        raise Exception(f"Type error at line {node.line}: {message}")
+
+    def check(self, program: Program) -> Program:
+        program.strict = self.strict
+        statements = program.statements
+        for statement in statements:
+            if isinstance(statement, VarDecl):
+                self.declare(statement)
+        if not self.strict:
+            return self.infer_program(program)
+
+        pending = statements[::-1]
+        while pending:
+            statement = pending.pop()
+            if isinstance(statement, Assign):
+                statement.value = self.check_assignment([statement.name], statement.value, statement)
+            elif isinstance(statement, ChainAssign):
+                statement.value = self.check_assignment(statement.names, statement.value, statement)
+            elif isinstance(statement, Output):
+                for part in statement.parts:
+                    if not isinstance(part, Text):
+                        self.infer(part)
+            elif isinstance(statement, If):
+                self.check_condition(statement.condition)
+                pending.extend(reversed(statement.orelse))
+                pending.extend(reversed(statement.body))
+            elif isinstance(statement, While):
+                self.check_condition(statement.condition)
+                pending.extend(reversed(statement.body))
+        return program
+
+    def infer_program(self, program: Program) -> Program:
+        """
+        Without strict: drop the declared type of every variable that may be
+        given a value of another type, until the types of the values
+        assigned no longer change, then record the types on every expression
+        """
+        assignments = []
+        expressions = []
+        pending = program.statements[::-1]
+        while pending:
+            statement = pending.pop()
+            if isinstance(statement, Assign):
+                assignments.append(([statement.name], statement.value))
+            elif isinstance(statement, ChainAssign):
+                assignments.append((statement.names, statement.value))
+            elif isinstance(statement, Input):
+                # INPUT may read a value of any type
+                for var_name in statement.names:
+                    self.types[var_name] = None
+            elif isinstance(statement, Output):
+                expressions.extend(part for part in statement.parts if not isinstance(part, Text))
+            elif isinstance(statement, (If, While)):
+                expressions.append(statement.condition)
+                if isinstance(statement, If):
+                    pending.extend(reversed(statement.orelse))
+                pending.extend(reversed(statement.body))
+
+        # Types are only ever dropped, so this ends
+        changed = True
+        while changed:
+            changed = False
+            for names, value in assignments:
+                value_type_ = self.infer(value)
+                for var_name in names:
+                    if self.types.get(var_name) not in (None, value_type_):
+                        self.types[var_name] = None
+                        changed = True
+        for expr in expressions:
+            self.infer(expr)
+        return program
+
+    def declare(self, node: VarDecl):
+        var_type = node.var_type.name
+        if not self.strict:
+            for var_name, initial_value in node.variables:
+                if self.types.setdefault(var_name, var_type) != var_type or (
+                        initial_value is not None and value_type(initial_value) != var_type):
+                    self.types[var_name] = None
+            return
+        variables = []
+        for var_name, initial_value in node.variables:
+            declared = self.types.setdefault(var_name, var_type)
+            if declared != var_type:
+                self.error(f"Variable {var_name} is already declared as {declared}", node)
+            if initial_value is not None:
+                initial_type = value_type(initial_value)
+                if var_type == 'FLOAT' and initial_type == 'INT':
+                    initial_value = float(initial_value)
+                elif initial_type != var_type:
+                    self.error(f"Cannot initialize {var_type} variable {var_name} with {initial_type} "
+                               f"value {initial_value!r}", node)
+            variables.append((var_name, initial_value))
+        node.variables = variables
+
+    def check_assignment(self, names: List[str], value: Node, node: Node) -> Node:
+        """Check value against every target; returns it, widened to FLOAT if needed"""
+        value_type_ = self.infer(value)
+        targets = {self.types[var_name] for var_name in names if var_name in self.types}
+        if value_type_ is None or not targets:
+            return value
+        if len(targets) > 1:
+            self.error(f"Cannot assign one value to variables of types {', '.join(sorted(targets))}", node)
+        target_type, = targets
+        if target_type == value_type_:
+            return value
+        if target_type == 'FLOAT' and value_type_ == 'INT':
+            return widen(value)
+        for var_name in names:
+            if self.types.get(var_name) == target_type:
+                self.error(f"Cannot assign {value_type_} to {target_type} variable {var_name}", node)
+
+    def check_condition(self, condition: Node):
+        condition_type = self.infer(condition)
+        if condition_type not in (None, 'BOOL'):
+            self.error(f"Condition must be BOOL, not {condition_type}", condition)
+
+    def infer(self, expr: Node) -> Optional[str]:
+        """Type of expr, recorded on it and on all of its subexpressions"""
+        pending = [(expr, False)]
+        while pending:
+            node, children_done = pending.pop()
+            if isinstance(node, Literal):
+                node.type = value_type(node.value)
+            elif isinstance(node, Var):
+                node.type = self.types.get(node.name)
+            elif not children_done:
+                pending.append((node, True))
+                pending.extend((child, False) for child in child_expressions(node))
+            else:
+                try:
+                    node.type = self.combine(node)
+                except ValueError as e:
+                    if self.strict:
+                        self.error(str(e), node)
+                    # Left to fail (or not) at run time
+                    node.type = None
+        return expr.type
+
+    def combine(self, node: Node) -> Optional[str]:
+        if isinstance(node, BinaryOp):
+            return binary_type(node.op, node.left.type, node.right.type)
+        if isinstance(node, Chain):
+            result = node.operands[0].type
+            for op, operand in zip(node.ops, node.operands[1:]):
+                result = binary_type(op, result, operand.type)
+            return result
+        if isinstance(node, UnaryOp):
+            return unary_type(node.op, node.operand.type)
+        if isinstance(node, Invariant):
+            return node.expr.type
+        raise ValueError(f"Cannot type node: {node!r}")
+
+def child_expressions(node: Node) -> List[Node]:
+    if isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    if isinstance(node, Chain):
+        return node.operands
+    if isinstance(node, UnaryOp):
+        return [node.operand]
+    if isinstance(node, Invariant):
+        return [node.expr]
+    return []
+
+def check_types(program: Program, strict: bool = False) -> Program:
+    """
+    Give the expressions of a parsed program their static types; with
+    strict, raise the first type error found
+    """
+    return TypeChecker(strict).check(program)
@@ -61,6 +61,11 @@ STOP`,
     };
 
     this.currentExample = "input";
+    // Whether output of the current run has arrived through appendOutput()
+    this.streamed = false;
+    // Whether this page is waiting for a run or profile to end; Python
+    // turns away runs that other windows start meanwhile
+    this.running = false;
     this.initializeEditor();
     this.bindEvents();
     this.updateLineCount();
@@ -78,12 +83,14 @@ STOP`,
         matchBrackets: true,
         autoCloseBrackets: true,
         foldGutter: true,
-        gutters: ["CodeMirror-linenumbers", "CodeMirror-foldgutter"],
+        gutters: ["cfpl-heat-gutter", "CodeMirror-linenumbers", "CodeMirror-foldgutter"],
       },
     );
 
-    this.editor.on("change", () => {
+    this.editor.on("change", (editor, change) => {
+      this.editor.clearGutter("cfpl-heat-gutter");
       this.updateLineCount();
+      this.relexChange(change);
     });
 
     // Set initial content
@@ -95,6 +102,12 @@ STOP`,
     document
       .getElementById("runCode")
       .addEventListener("click", () => this.runCode());
+    document
+      .getElementById("stopCode")
+      .addEventListener("click", () => this.stopCode());
+    document
+      .getElementById("profileCode")
+      .addEventListener("click", () => this.profileCode());
     document
       .getElementById("clearCode")
       .addEventListener("click", () => this.clearCode());
@@ -217,6 +230,28 @@ STOP`,
     }
   }
 
+  async relexChange(change) {
+    // Only the lines touched by the edit are sent back for lexing
+    const first = change.from.line;
+    const lines = [];
+    for (let i = first; i < first + change.text.length; i++) {
+      lines.push(this.editor.getLine(i));
+    }
+
+    try {
+      const errors = await eel.relex_lines(first, change.to.line + 1, lines)();
+      errors.forEach((error, offset) => {
+        if (error) {
+          this.editor.addLineClass(first + offset, "background", "lex-error");
+        } else {
+          this.editor.removeLineClass(first + offset, "background", "lex-error");
+        }
+      });
+    } catch (error) {
+      console.error("Error lexing edited lines:", error);
+    }
+  }
+
   async runCode() {
     const code = this.editor.getValue();
     const inputData = document.getElementById("inputData").value;
@@ -225,29 +260,117 @@ STOP`,
       this.showError("Please enter some CFPL code to execute.");
       return;
     }
+    if (this.running) {
+      return;
+    }
 
+    this.running = true;
     this.showLoading(true);
     this.setStatus("Executing...");
+    this.startOutput();
 
     try {
-      const result = await eel.run_cfpl_code(code, inputData)();
+      // Output arrives through appendOutput() while the program runs
+      const result = await eel.run_cfpl_code(code, inputData, true)();
 
+      const truncated = result.truncation && result.truncation.truncated;
       if (result.success) {
-        this.showOutput(result.output || "(No output)");
+        // Only the head of truncated output is streamed; show its tail too
+        if (truncated) {
+          this.showTruncatedOutput(result);
+        } else if (!this.streamed) {
+          this.showOutput(result.output || "(No output)");
+        }
         this.setStatus("Execution completed successfully");
         await this.refreshVariables();
       } else {
-        this.showError(result.error);
+        // Keep the output produced before the error
+        if (truncated) {
+          this.showTruncatedOutput(result, result.error);
+        } else {
+          const outputElement = document.getElementById("output");
+          const partial = this.streamed && outputElement ? outputElement.textContent + "\n" : "";
+          this.showError(partial + result.error);
+        }
         this.setStatus("Execution failed");
       }
     } catch (error) {
       this.showError("Connection error: " + error.message);
       this.setStatus("Connection error");
     } finally {
+      this.running = false;
+      this.showLoading(false);
+    }
+  }
+
+  async profileCode() {
+    const code = this.editor.getValue();
+    const inputData = document.getElementById("inputData").value;
+
+    if (!code.trim()) {
+      this.showError("Please enter some CFPL code to profile.");
+      return;
+    }
+    if (this.running) {
+      return;
+    }
+
+    this.running = true;
+    this.showLoading(true);
+    this.setStatus("Profiling...");
+    this.startOutput();
+
+    try {
+      const result = await eel.profile_cfpl_code(code, inputData)();
+      this.showProfile(result.profile);
+      if (result.success) {
+        this.showOutput(result.report);
+        this.setStatus("Profiling completed");
+        await this.refreshVariables();
+      } else {
+        // Keep the output produced before the error
+        if (result.truncation && result.truncation.truncated) {
+          this.showTruncatedOutput(result, result.error);
+        } else {
+          this.showError((result.output ? result.output + "\n" : "") + result.error);
+        }
+        this.setStatus("Profiling failed");
+      }
+    } catch (error) {
+      this.showError("Connection error: " + error.message);
+      this.setStatus("Connection error");
+    } finally {
+      this.running = false;
       this.showLoading(false);
     }
   }
 
+  showProfile(profile) {
+    // Mark each line that ran, more opaque the more time it took itself
+    this.editor.clearGutter("cfpl-heat-gutter");
+    if (!profile) {
+      return;
+    }
+    profile.lines.forEach((line) => {
+      const marker = document.createElement("div");
+      marker.className = "cfpl-heat";
+      marker.style.opacity = Math.max(line.heat, 0.05);
+      marker.title = `${line.hits} hits, ${(line.self_time * 1000).toFixed(3)} ms self, ` +
+        `${(line.total_time * 1000).toFixed(3)} ms total`;
+      this.editor.setGutterMarker(line.line - 1, "cfpl-heat-gutter", marker);
+    });
+  }
+
+  async stopCode() {
+    // The run stops at its next limit check and reports that it was cancelled
+    this.setStatus("Stopping...");
+    try {
+      await eel.cancel_run()();
+    } catch (error) {
+      console.error("Error stopping the program:", error);
+    }
+  }
+
   async refreshVariables() {
     try {
       const variables = await eel.get_variables()();
@@ -304,6 +427,23 @@ STOP`,
     return String(value);
   }
 
+  startOutput() {
+    const outputElement = document.getElementById("output");
+    if (outputElement) {
+      outputElement.textContent = "";
+      outputElement.className = "output-content success";
+    }
+    this.streamed = false;
+  }
+
+  appendOutput(text) {
+    const outputElement = document.getElementById("output");
+    if (outputElement) {
+      outputElement.textContent += (this.streamed ? "\n" : "") + text;
+    }
+    this.streamed = true;
+  }
+
   showOutput(output) {
     const outputElement = document.getElementById("output");
     if (outputElement) {
@@ -312,6 +452,47 @@ STOP`,
     }
   }
 
+  showTruncatedOutput(result, error) {
+    // Head and tail of the output, with a button in place of the omitted
+    // lines that fetches them from Python a chunk at a time
+    const outputElement = document.getElementById("output");
+    if (!outputElement) {
+      return;
+    }
+    const truncation = result.truncation;
+    const expand = document.createElement("button");
+    expand.className = "output-expand";
+    let next = truncation.head_lines;
+    const end = truncation.head_lines + truncation.omitted_lines;
+    const label = () => {
+      expand.textContent = `... ${end - next} lines omitted (show ${Math.min(end - next, OUTPUT_CHUNK_LINES)} more) ...`;
+    };
+    expand.addEventListener("click", async () => {
+      expand.disabled = true;
+      try {
+        const lines = await eel.get_output_lines(next, Math.min(end - next, OUTPUT_CHUNK_LINES))();
+        expand.before("\n" + lines.join("\n"));
+        next += lines.length;
+      } catch (error) {
+        console.error("Error fetching output lines:", error);
+      }
+      expand.disabled = false;
+      if (next >= end) {
+        expand.remove();
+      } else {
+        label();
+      }
+    });
+    label();
+
+    outputElement.textContent = "";
+    outputElement.append(result.head, "\n", expand, "\n" + result.tail);
+    if (error) {
+      outputElement.append("\n" + error);
+    }
+    outputElement.className = "output-content " + (error ? "error" : "success");
+  }
+
   showError(error) {
     const outputElement = document.getElementById("output");
     if (outputElement) {
@@ -376,7 +557,20 @@ STOP`,
   }
 }
 
+// Omitted output lines fetched per click on the marker of truncated output
+const OUTPUT_CHUNK_LINES = 1000;
+
+// The interpreter UI that output streamed from Python goes to
+let activeInterpreter = null;
+
+function appendOutput(text) {
+  if (activeInterpreter) {
+    activeInterpreter.appendOutput(text);
+  }
+}
+eel.expose(appendOutput, "append_output");
+
 // Initialize the interpreter when the page loads
 document.addEventListener("DOMContentLoaded", () => {
-  new CFPLInterpreter();
+  activeInterpreter = new CFPLInterpreter();
 });